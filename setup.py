@@ -49,6 +49,7 @@ setup(
     install_requires=["requests~=2.24.0", "selenium~=3.141.0"],
     extras_require={
         'gui': ["r2g_gui", "PyQt5~=5.12.3"],
+        'local': ["numpy"],
         'test': ["pytest", "pytest-cov", "codecov"],
     },
 )
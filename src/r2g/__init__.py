@@ -20,3 +20,15 @@ __maintainer__ = "Yang Wu"
 __author_email__ = "wuyang@drwu.ga"
 __license__ = "MIT Licence"
 __copyright__ = "Copyright {} Yang Wu".format(date.today().year)
+
+
+def __getattr__(name):
+    # `from r2g import Pipeline` imports the pipeline on demand (Python 3.7+), so `import r2g` stays light.
+    # On Python 3.6, use `from r2g.pipeline import Pipeline` instead.
+    if name == "Pipeline":
+        from r2g.pipeline import Pipeline
+        return Pipeline
+    if name == "default_arguments":
+        from r2g.utils import default_arguments
+        return default_arguments
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -0,0 +1,285 @@
+import gzip
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+from r2g import utils
+from r2g import errors
+from r2g.online import blast
+
+
+# Reads are dealt out to the shards in blocks of this many spots:
+SHARD_BLOCK = 10000
+
+
+def _which(app):
+    path = shutil.which(app)
+    if path is None:
+        raise errors.AlignerError("Couldn't find {} in your $PATH.".format(app))
+    return path
+
+
+def _run(cmd, verbose=False):
+    utils.log("Aligner cmd: {}".format(' '.join(cmd)), verbose, 'debug')
+    try:
+        p = subprocess.run(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as err:
+        raise errors.AlignerError("Couldn't run {}: {}".format(cmd[0], err))
+    if p.returncode != 0:
+        raise errors.AlignerError("{} exited {}: {}".format(
+            os.path.split(cmd[0])[-1], p.returncode, utils.bytes2str(p.stderr).strip()
+        ))
+    return p
+
+
+class BlastPlus:
+    """
+    BLAST+. The query fragments are made into a database, and the reads are aligned to it as queries, so the
+    BLAST programs are turned around: tblastn (a protein query against translated reads) runs as blastx.
+    Every shard of reads runs in its own single-threaded process.
+    """
+
+    programs = {
+        "megablast": ("blastn", "megablast", "nucl"),
+        "blastn": ("blastn", "blastn", "nucl"),
+        "discomegablast": ("blastn", "dc-megablast", "nucl"),
+        "tblastn": ("blastx", None, "prot"),
+        "tblastx": ("tblastx", None, "nucl"),
+    }
+
+    def __init__(self, args, workdir):
+        program, self.task, self.dbtype = self.programs[args['program']]
+        self.makeblastdb = _which("makeblastdb")
+        self.exe = _which(program)
+        self.db = os.path.join(workdir, "query_db")
+        self.evalue = str(args['evalue'])
+        self.shards = max(1, int(args['CPU']))
+        self.verbose = args['verbose']
+
+    def build(self, query_file):
+        _run([self.makeblastdb, "-in", query_file, "-dbtype", self.dbtype, "-out", self.db], self.verbose)
+
+    def align(self, shard, output):
+        cmd = [
+            self.exe,
+            "-query", shard,
+            "-db", self.db,
+            "-evalue", self.evalue,
+            "-outfmt", "6 qseqid",
+            "-max_hsps", "1",
+            "-num_threads", "1",
+            "-out", output
+        ]
+        if self.task is not None:
+            cmd += ["-task", self.task]
+        _run(cmd, self.verbose)
+
+
+class Diamond:
+    """DIAMOND blastx for protein queries (tblastn). DIAMOND uses all the threads by itself, so reads aren't sharded."""
+
+    def __init__(self, args, workdir):
+        if args['program'] != "tblastn":
+            raise errors.AlignerError("DIAMOND only aligns reads to protein queries (-p tblastn).")
+        self.exe = _which("diamond")
+        self.db = os.path.join(workdir, "query_db")
+        self.evalue = str(args['evalue'])
+        self.threads = str(args['CPU'])
+        self.shards = 1
+        self.verbose = args['verbose']
+
+    def build(self, query_file):
+        _run([self.exe, "makedb", "--in", query_file, "-d", self.db], self.verbose)
+
+    def align(self, shard, output):
+        _run([
+            self.exe, "blastx",
+            "-q", shard,
+            "-d", self.db,
+            "-e", self.evalue,
+            "-f", "6", "qseqid",
+            "-k", "1",
+            "--threads", self.threads,
+            "-o", output
+        ], self.verbose)
+
+
+ALIGNERS = {
+    "blast": BlastPlus,
+    "diamond": Diamond,
+}
+
+
+def _open(path, mode='r'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't')
+    return open(path, mode)
+
+
+def _iter_fastq(path):
+    """Yield every read in a FASTQ file as a tuple of 4 lines."""
+    with _open(path) as inf:
+        while True:
+            read = tuple([inf.readline() for _ in range(4)])
+            if read[0] == '':
+                break
+            if read[0][0] != '@' or read[2][:1] != '+' or len(read[1]) != len(read[3]):
+                raise errors.AlignerError("{} is not in FASTQ format: \n{}".format(path, ''.join(read)))
+            yield read
+
+
+def _iter_spots(library):
+    """Yield the reads of every spot in a library (one file, or two files of mates in the same order)."""
+    for reads in zip_longest(*[_iter_fastq(f) for f in library]):
+        if None in reads:
+            raise errors.AlignerError("The paired files {} have different numbers of reads.".format(
+                ' and '.join(library)
+            ))
+        yield reads
+
+
+def _sra_to_fastq(sra_file, app_json, outdir):
+    """Convert an SRA file with fastq-dump. Return its library: (mate_1, mate_2) if it is paired, else (reads,)."""
+    cmd = [
+        app_json['fastq-dump'],
+        "--defline-seq", "@$sn/$ri",
+        "--split-files",
+        "-O", outdir,
+        sra_file
+    ]
+    try:
+        p = subprocess.run(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as err:
+        raise errors.InputError(err)
+    if p.returncode != 0:
+        raise errors.FetchError(utils.bytes2str(p.stderr))
+    acc = os.path.split(sra_file)[-1]
+    if acc.endswith(".sra"):
+        acc = acc[:-4]
+    mates = [os.path.join(outdir, "{}_{}.fastq".format(acc, i)) for i in (1, 2)]
+    if os.path.isfile(mates[1]):
+        return tuple(mates)
+    return (mates[0], )
+
+
+def _libraries(args, app_json, workdir):
+    libraries = [(left, right) for left, right in zip(args['left'], args['right'])]
+    libraries += [(single, ) for single in args['single']]
+    for sra_file in args['sra_files']:
+        utils.log("Converting {} with fastq-dump.".format(sra_file))
+        libraries.append(_sra_to_fastq(sra_file, app_json, workdir))
+    return libraries
+
+
+def _write_shards(libraries, workdir, num_shards):
+    """
+    Deal reads out to FASTA shards, named "library.spot.mate", e.g. ">0.1234.2" is the right read of the 1234th spot
+    in the first library, so a hit on either read can recruit the whole spot.
+    """
+    shards = [os.path.join(workdir, "reads_{}.fasta".format(i)) for i in range(num_shards)]
+    outfs = [open(shard, 'w') for shard in shards]
+    try:
+        for lib, library in enumerate(libraries):
+            for spot, reads in enumerate(_iter_spots(library)):
+                outf = outfs[(spot // SHARD_BLOCK) % num_shards]
+                for mate, read in enumerate(reads):
+                    outf.write(">{}.{}.{}\n{}\n".format(lib, spot, mate + 1, read[1].rstrip()))
+    finally:
+        for outf in outfs:
+            outf.close()
+    return shards
+
+
+def _output_name(path, outdir, lib, mate):
+    """
+    The file of the reads recruited from a file of a library, e.g. sample1_1.lib0_1.recruited.fastq for the left reads
+    of the first library. The library and the mate are in the name, so files of the same name in different folders
+    don't overwrite each other.
+    """
+    name = os.path.split(path)[-1]
+    for ext in [".gz", ".fastq", ".fq"]:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.join(outdir, "{}.lib{}_{}.recruited.fastq".format(name, lib, mate))
+
+
+def _extract(libraries, hits, outdir):
+    """
+    Write out the spots hit in every library, where hits = {library: {spot, ...}}.
+    Return the FASTQ files for Trinity and whether they are paired.
+    """
+    fastq_list = {}
+    paired = True
+    for lib, library in enumerate(libraries):
+        if lib not in hits:
+            continue
+        files = [_output_name(f, outdir, lib, mate + 1) for mate, f in enumerate(library)]
+        outfs = [open(f, 'w') for f in files]
+        try:
+            for spot, reads in enumerate(_iter_spots(library)):
+                if spot in hits[lib]:
+                    for outf, read in zip(outfs, reads):
+                        outf.write("{}\n".format('\n'.join([line.rstrip('\n') for line in read])))
+        finally:
+            for outf in outfs:
+                outf.close()
+        for mate, f in enumerate(files):
+            fastq_list[str(mate + 1)] = fastq_list.get(str(mate + 1), []) + [f]
+        if len(files) < 2:
+            paired = False
+    if paired is False and len(fastq_list.keys()) > 1:
+        utils.log("WARNING: since some of fastq files are paired but some are not, "
+                  "all fastq files will be taken as singled-end files while being fed to Trinity.")
+    return fastq_list, paired
+
+
+def _align(aligner, libraries, outdir):
+    """Align the reads in shards with an external aligner. Return the spots hit in every library."""
+    utils.log("Splitting reads from {} librar{} into {} shard(s).".format(
+        len(libraries), "y" if len(libraries) == 1 else "ies", aligner.shards
+    ))
+    shards = _write_shards(libraries, outdir, aligner.shards)
+    outputs = ["{}.hits".format(shard) for shard in shards]
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        for future in [executor.submit(aligner.align, s, o) for s, o in zip(shards, outputs)]:
+            future.result()
+    hits = {}
+    for output in outputs:
+        with open(output, 'r') as inf:
+            for line in inf:
+                if line.strip() != '':
+                    lib, spot, _ = line.strip().split('.')
+                    hits.setdefault(int(lib), set()).add(int(spot))
+    return hits
+
+
+def recruit(args, app_json, outdir):
+    """
+    Recruit local reads hit by the query, with a local aligner or the built-in k-mer recruiter, and write the spots
+    hit into outdir. Return (name, fastq_list, paired), where fastq_list = {'1': [...], '2': [...]} can be fed to
+    Trinity directly.
+    """
+    name, seq_list = blast._split_query(args)
+    if args['aligner'] == "kmer":
+        # The k-mer recruiter loads NumPy, which the other aligners don't need:
+        from r2g.local import recruiter
+        utils.log("Indexing {}-mers of {} fragment(s) of {}.".format(args['kmer_size'], len(seq_list), name))
+        aligner = recruiter.KmerRecruiter(args, seq_list)
+    else:
+        aligner = ALIGNERS[args['aligner']](args, outdir)
+        query_file = os.path.join(outdir, "query.fasta")
+        with open(query_file, 'w') as outf:
+            outf.write("{}\n".format('\n'.join(seq_list)))
+        utils.log("Building the {} database of {} fragment(s) of {}.".format(args['aligner'], len(seq_list), name))
+        aligner.build(query_file)
+    libraries = _libraries(args, app_json, outdir)
+    utils.log("Aligning reads with {}.".format(args['aligner']))
+    if args['aligner'] == "kmer":
+        hits = aligner.recruit(libraries)
+    else:
+        hits = _align(aligner, libraries, outdir)
+    utils.log("{} spots were hit.".format(sum([len(spots) for spots in hits.values()])))
+    fastq_list, paired = _extract(libraries, hits, outdir)
+    return name, fastq_list, paired
@@ -5,13 +5,15 @@ from shutil import copyfile, copytree
 
 from r2g import utils
 from r2g import errors
+from r2g.utils import metrics
 
 
 class Trinity:
-    def __init__(self, args, app_json, fastq_list, paired):
+    def __init__(self, args, app_json, fastq_list, paired, output=None):
         self.stamp = utils.stamp()
-        self.output = os.path.join(args["outdir"], "trinity_output_{}".
-                                   format(self.stamp))
+        if output is None:
+            output = os.path.join(args["outdir"], "trinity_output_{}".format(self.stamp))
+        self.output = output
         self.cmd = [
             app_json["Trinity"],
             "--seqType", "fq",
@@ -59,12 +61,17 @@ class Trinity:
         utils.log("Trinity log file: {}".format(self.log))
         logs = ""
         try:
-            p = subprocess.run(
-                self.cmd,
-                shell=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
+            with metrics.timer("r2g_trinity_seconds"):
+                p = subprocess.run(
+                    self.cmd,
+                    shell=False,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+            # The largest child so far, which is Trinity or one of its own children most of the time:
+            rss = metrics.peak_rss(children=True)
+            if rss is not None:
+                metrics.gauge("r2g_trinity_peak_rss_bytes", rss)
             logs = p.stdout.decode('utf-8')
             if p.returncode != 0:
                 if self.args['verbose']:
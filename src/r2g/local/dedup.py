@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import os
+from itertools import zip_longest
+
+from r2g import utils
+from r2g import errors
+from r2g.utils import bgzf
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _iter_records(path):
+    """Yield every read in a FASTQ file as a tuple of 4 lines (bytes)."""
+    with _open(path) as inf:
+        while True:
+            read = tuple([inf.readline() for _ in range(4)])
+            if read[0] == b'':
+                break
+            if read[0][:1] != b'@' or read[2][:1] != b'+':
+                raise errors.FetchError("{} is not in FASTQ format.".format(path))
+            yield read
+
+
+def _digest(data):
+    """A 64-bit hash, which keeps the set of seen reads small."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def _spot_key(read):
+    """
+    The run, the spot and the mate of a read by fastq-dump, e.g. b"SRR1812889.232339/1" from "@.../1" and
+    "+SRR1812889.232339 FCC2U5KACXX...", or None if the read doesn't have them.
+    """
+    name = read[2][1:].split(None, 1)
+    if len(name) == 0 or not name[0].rsplit(b'.', 1)[-1].isdigit() or b'.' not in name[0]:
+        return None
+    mate = read[0].rstrip()[-2:]
+    return name[0] + (mate if mate[:1] == b'/' else b'')
+
+
+def _output_name(path, outdir):
+    name = os.path.split(path)[-1]
+    gz = name.endswith('.gz')
+    if gz:
+        name = name[:-3]
+    for ext in ['.fastq', '.fq']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.join(outdir, "{}.dedup.fastq{}".format(name, ".gz" if gz else ""))
+
+
+class Deduplicator:
+    """
+    Drop exact duplicates from the reads fed to Trinity, i.e. spots downloaded more than once (the same run and spot
+    in the quality defline written by fastq-dump), and spots whose reads have the same sequences as a kept one.
+    Reads are streamed, and only a 64-bit BLAKE2b hash of every kept spot is remembered.
+    """
+
+    def __init__(self, threads=1):
+        self.threads = threads
+        self.spots = set()
+        self.seqs = set()
+        self.total = 0
+        self.by_spot = 0
+        self.by_seq = 0
+
+    def is_duplicate(self, reads):
+        self.total += 1
+        spot = _spot_key(reads[0])
+        if spot is not None:
+            spot = _digest(spot)
+            if spot in self.spots:
+                self.by_spot += 1
+                return True
+        seq = _digest(b'\n'.join([r[1].rstrip() for r in reads]))
+        if seq in self.seqs:
+            self.by_seq += 1
+            return True
+        if spot is not None:
+            self.spots.add(spot)
+        self.seqs.add(seq)
+        return False
+
+    def dedup_library(self, library, outdir):
+        """Write the unique spots of a library (one file, or two files of mates in the same order) into outdir."""
+        outputs = [_output_name(f, outdir) for f in library]
+        outfs = [bgzf.BgzfWriter(o, threads=self.threads) if o.endswith('.gz') else open(o, 'wb') for o in outputs]
+        try:
+            for reads in zip_longest(*[_iter_records(f) for f in library]):
+                if None in reads:
+                    raise errors.FetchError("The paired files {} have different numbers of reads.".format(
+                        ' and '.join(library)
+                    ))
+                if not self.is_duplicate(reads):
+                    for outf, read in zip(outfs, reads):
+                        outf.write(b''.join(read))
+        finally:
+            for outf in outfs:
+                outf.close()
+        return outputs
+
+    @property
+    def removed(self):
+        return self.by_spot + self.by_seq
+
+
+def dedup_reads(fastq_list, paired, outdir, threads=1):
+    """
+    Remove duplicated reads from fastq_list = {'1': [...], '2': [...]} before they are fed to Trinity.
+    Return (the deduplicated fastq_list, the number of spots removed). If anything goes wrong, the reads are left
+    as they are.
+    """
+    if paired:
+        libraries = list(zip(fastq_list['1'], fastq_list['2']))
+    else:
+        libraries = [(f,) for mate in sorted(fastq_list.keys()) for f in fastq_list[mate]]
+    dedup = Deduplicator(threads)
+    deduped = {}
+    try:
+        for library in libraries:
+            for mate, output in enumerate(dedup.dedup_library(library, outdir)):
+                deduped.setdefault(str(mate + 1), []).append(output)
+    except (OSError, EOFError, errors.FetchError) as err:
+        utils.log("WARNING: couldn't remove duplicated reads, so all reads are fed to Trinity. {}".format(err))
+        return fastq_list, 0
+    if not paired:
+        deduped = {'1': deduped.get('1', [])}
+    utils.log("Removed {} duplicated spot(s) of {}: {} downloaded more than once, and {} with the same "
+              "sequences.".format(dedup.removed, dedup.total, dedup.by_spot, dedup.by_seq))
+    return deduped, dedup.removed
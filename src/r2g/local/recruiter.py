@@ -0,0 +1,144 @@
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from r2g import utils
+from r2g import errors
+
+
+# FASTQ files are read in blocks of about this many bytes, cut at the end of a read:
+BLOCK_SIZE = 1 << 22
+MAX_KMER_SIZE = 31  # 2 bits per base in a uint64
+
+# 2-bit codes of A, C, G and T (and U); everything else is 4, which breaks k-mers:
+if np is not None:
+    _CODES = np.full(256, 4, dtype=np.uint8)
+    for _bases, _code in [(b"Aa", 0), (b"Cc", 1), (b"Gg", 2), (b"TtUu", 3)]:
+        _CODES[np.frombuffer(_bases, dtype=np.uint8)] = _code
+
+
+def _require_numpy():
+    if np is None:
+        raise errors.AlignerError(
+            "The k-mer recruiter needs NumPy. Please install it by `pip install numpy` (or `pip install r2g[local]`)."
+        )
+
+
+def _canonical_kmers(buf, k):
+    """
+    Encode every k-mer starting in buf (a uint8 array of text) in 2 bits per base.
+    Return the canonical k-mers (the smaller one of each k-mer and its reverse complement), and whether each
+    of them is made of A, C, G and T only.
+    """
+    codes = _CODES[buf]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    broken = np.concatenate([[0], np.cumsum(codes == 4)])
+    valid = (broken[k:] - broken[:-k]) == 0
+    bases = np.where(codes == 4, 0, codes).astype(np.uint64)
+    forward = np.zeros(n, dtype=np.uint64)
+    reverse = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        forward = (forward << np.uint64(2)) | bases[j:(j + n)]
+        reverse = reverse | ((np.uint64(3) - bases[j:(j + n)]) << np.uint64(2 * j))
+    return np.minimum(forward, reverse), valid
+
+
+def query_kmers(seq_list, k):
+    """Return the sorted distinct canonical k-mers of the query fragments, e.g. [">name_0\nseq0", ...]."""
+    _require_numpy()
+    seqs = '\n'.join([chunk.split('\n', 1)[-1] for chunk in seq_list]).encode()
+    kmers, valid = _canonical_kmers(np.frombuffer(seqs, dtype=np.uint8), k)
+    return np.unique(kmers[valid])
+
+
+def _match_block(block, first_spot, kmers, k):
+    """Return the spots of the reads in a block of FASTQ records that share at least one k-mer with the query."""
+    buf = np.frombuffer(block, dtype=np.uint8)
+    newline = buf == 10
+    # The line every byte is on, counting from the start of the block:
+    line = np.cumsum(newline) - newline
+    # Only the sequence lines are kept:
+    buf = np.where((line % 4 == 1) & ~newline, buf, 78)  # "N"
+    canonical, valid = _canonical_kmers(buf, k)
+    i = np.searchsorted(kmers, canonical)
+    i[i == len(kmers)] = 0
+    hit = valid & (kmers[i] == canonical)
+    return np.unique(line[:len(hit)][hit] // 4) + first_spot
+
+
+def _iter_blocks(path, block_size=None):
+    """Yield (block, index of its first spot) from a FASTQ file, where every block holds complete reads."""
+    if block_size is None:
+        block_size = BLOCK_SIZE
+    if path.endswith('.gz'):
+        inf = gzip.open(path, 'rb')
+    else:
+        inf = open(path, 'rb')
+    spots, rest = 0, b""
+    with inf:
+        while True:
+            data = inf.read(block_size)
+            block = rest + data
+            if len(block) == 0:
+                break
+            if len(data) == 0:
+                ends = len(block)
+            else:
+                lines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+                if len(lines) < 4:
+                    rest = block
+                    continue
+                ends = lines[(len(lines) // 4) * 4 - 1] + 1
+            block, rest = block[:ends], block[ends:]
+            yield block, spots
+            spots += (block.count(b"\n") + (0 if block.endswith(b"\n") else 1)) // 4
+            if len(data) == 0:
+                break
+
+
+class KmerRecruiter:
+    """
+    A built-in read recruiter for nucleotide queries, which doesn't need any external aligner. Reads sharing at
+    least one canonical k-mer with the query fragments are recruited. FASTQ files are streamed in big blocks of
+    complete reads, and every block is encoded and matched by vectorized NumPy operations in a pool of processes.
+    """
+
+    def __init__(self, args, seq_list):
+        _require_numpy()
+        if args['program'] in ["tblastn", "tblastx"]:
+            raise errors.AlignerError("The k-mer recruiter only works with nucleotide queries (-p blastn).")
+        self.k = int(args['kmer_size'])
+        if not 0 < self.k <= MAX_KMER_SIZE:
+            raise errors.AlignerError("The k-mer size must be between 1 and {}.".format(MAX_KMER_SIZE))
+        self.kmers = query_kmers(seq_list, self.k)
+        if len(self.kmers) == 0:
+            raise errors.AlignerError("The query is shorter than the k-mer size {}.".format(self.k))
+        self.workers = max(1, int(args['CPU']))
+        self.verbose = args['verbose']
+
+    def recruit(self, libraries):
+        """Return the spots hit in every library, i.e. {library: {spot, ...}}."""
+        hits = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for lib, library in enumerate(libraries):
+                for fastq in library:
+                    utils.log("Matching {}-mers of reads in {}.".format(self.k, fastq), self.verbose, 'debug')
+                    pending = []
+                    for block, first_spot in _iter_blocks(fastq):
+                        pending.append(executor.submit(_match_block, block, first_spot, self.kmers, self.k))
+                        # Keep a few blocks in flight only, so a large file never sits in the memory:
+                        while len(pending) >= 2 * self.workers:
+                            spots = pending.pop(0).result()
+                            if len(spots) > 0:
+                                hits.setdefault(lib, set()).update(spots.tolist())
+                    for future in pending:
+                        spots = future.result()
+                        if len(spots) > 0:
+                            hits.setdefault(lib, set()).update(spots.tolist())
+        return hits
@@ -1,20 +1,67 @@
+import os
 import re
 import time
-import os
+import threading
+import queue
 from copy import deepcopy
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import requests
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
 import r2g
 from r2g import errors
 from r2g import utils
+from r2g.utils import metrics
+from r2g.utils import taxonomy
 
 
 headers = {
     "User-Agent": "R2gClient/{} (X11; Linux x86_64)".format(r2g.__version__)
 }
 
+# The real NCBI, unless --ncbi_url or R2G_NCBI_URL points elsewhere (e.g. a stand-in server from r2g.online.stand_in):
+NCBI_URL = "https://blast.ncbi.nlm.nih.gov"
+
+# The SRA BLAST form takes at most 20 experiments (EQ_MENU, EQ_MENU1, ..., EQ_MENU19) per search:
+MAX_NUM_ORG = 20
+
+
+class RateLimiter:
+    """
+    Do not contact the server more often than once every 10 seconds.
+    A single limiter is shared by all threads that talk to NCBI, so the rule holds for the whole run
+    no matter how many RIDs are in flight.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self._previous = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            wait = self._previous + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._previous = time.time()
+
+
+def _base_url(base_url=None):
+    """ (PRIVATE)
+    The base URL of BLAST services: base_url if given, else $R2G_NCBI_URL, else the real NCBI.
+    """
+    if base_url is None:
+        base_url = os.environ.get("R2G_NCBI_URL", None)
+    if base_url is None or base_url.strip() == "":
+        base_url = NCBI_URL
+    return base_url.strip().rstrip('/')
+
 
 def _search_keyword(pattern, text, default_value=None):
     """ (PRIVATE)
@@ -76,53 +123,78 @@ def _taxid_to_species(taxid):
     """ (PRIVATE)
     transfer the taxid to the speicies name
     """
-    taxid_dict = utils.file2json(os.path.join(r2g.__path__[0], "taxid_to_species.json"))
-    species = taxid_dict.get(
-        taxid,
-        "Unknown species (taxid {})".format(taxid)
-    )
-    return species
+    return taxonomy.species(taxid)
 
 
-def check_sra_validity(input_SRAs, proxy=None):
+def _resolve_sra(sra, proxy=None, limiter=None, base_url=None):
+    """ (PRIVATE)
+    Ask NCBI what the SRA accession is. Return a tuple of (taxid, srx, [srr...]).
+    """
+    check_sra_params = {"dict": "srx_dict_sg", "q": sra}
+    if limiter is not None:
+        limiter.wait()
+    try:
+        check_sra_response = requests.get(
+            "{}/portal/utils/autocomp.fcgi".format(_base_url(base_url)),
+            params=check_sra_params,
+            headers=headers,
+            timeout=60,
+            proxies=proxy
+        )
+    except Exception as err:
+        raise errors.QueryError(
+            "Couldn't check the validity of SRA accession numbers "
+            "probably because of network issues. {}.".format(err)
+        )
+    if not check_sra_response.ok:
+        raise errors.QueryError(
+            "Couldn't check the validity of SRA accession numbers "
+            "probably because of network issues. Status code: {}".format(check_sra_response.status_code)
+        )
+    # returned srr is a list
+    return _format_sra(sra, check_sra_response.content.decode('utf-8'))
+
+
+def check_sra_validity(input_SRAs, proxy=None, cache=None, max_workers=4, interval=1, base_url=None):
     """
     End users can input either SRX or SRR, which will be submitted to NCBI to check the validity,
     and this function is for deciding what the kind of SRA the input is.
     The proxy should be args[proxy].
+    Accessions found in the cache (an AccessionCache) are not sent to NCBI again. The others are resolved by
+    `max_workers` threads, which start no more than one request every `interval` seconds.
     """
     if type(input_SRAs) == str:
         input_SRAs = [input_SRAs, ]
-    output_SRAs = {}
+    input_SRAs = list(input_SRAs)
+    resolved = {}
+    missed = []
     for s in input_SRAs:
-        check_sra_params = {"dict": "srx_dict_sg", "q": s}
-        try:
-            check_sra_response = requests.get(
-                "https://blast.ncbi.nlm.nih.gov/portal/utils/autocomp.fcgi",
-                params=check_sra_params,
-                headers=headers,
-                timeout=60,
-                proxies=proxy
-            )
-        except Exception as err:
-            raise errors.QueryError(
-                "Couldn't check the validity of SRA accession numbers "
-                "probably because of network issues. {}.".format(err)
-            )
+        cached = cache.get(s) if cache is not None else None
+        if cached is not None:
+            resolved[s] = cached
         else:
-            if not check_sra_response.ok:
-                raise errors.QueryError(
-                    "Couldn't check the validity of SRA accession numbers "
-                    "probably because of network issues. Status code: {}".format(check_sra_response.status_code)
-                )
-            else:
-                # returned srr is a list
-                taxid, srx, srr = _format_sra(s, check_sra_response.content.decode('utf-8'))
-                species = _taxid_to_species(taxid)
-                srxes = deepcopy(output_SRAs.get(species, {}))
-                srxes[srx] = deepcopy(srxes.get(srx, []) + srr)
-                output_SRAs[species] = deepcopy(srxes)
-                # output_SRAs = {species1: {srx1: [srr...], srx2: [srr...]}, species2: ...}
-        time.sleep(5)
+            missed.append(s)
+    if len(missed) > 0:
+        limiter = RateLimiter(interval=interval)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missed)))) as executor:
+            futures = [(s, executor.submit(_resolve_sra, s, proxy, limiter, base_url)) for s in missed]
+            for s, future in futures:
+                resolved[s] = future.result()
+                if cache is not None:
+                    cache.put(s, *resolved[s])
+        if cache is not None:
+            try:
+                cache.save()
+            except OSError as err:
+                utils.log("WARNING: couldn't save resolved SRA accessions to {}. {}".format(cache.cache_file, err))
+    output_SRAs = {}
+    for s in input_SRAs:
+        taxid, srx, srr = resolved[s]
+        species = _taxid_to_species(taxid)
+        srxes = deepcopy(output_SRAs.get(species, {}))
+        srxes[srx] = deepcopy(srxes.get(srx, []) + srr)
+        output_SRAs[species] = deepcopy(srxes)
+        # output_SRAs = {species1: {srx1: [srr...], srx2: [srr...]}, species2: ...}
     return output_SRAs
 
 
@@ -139,7 +211,9 @@ def _parse_qblast_wait_page(wait_html):
     status2 = _search_keyword(r'Status=(\w+)', wait_html)
     job_title = _search_keyword(r'<input name="JOB_TITLE".+?value="(.+?)"', wait_html)
     entrez_query = _search_keyword(r'<input name="ENTREZ_QUERY".+?value="(.+?)"', wait_html)
-    rtoe = _search_keyword(r'<input name="RID".+?value="(\d+?)">', wait_html)
+    rtoe = _search_keyword(r'<input name="RTOE".+?value="(\d+?)"', wait_html)
+    if rtoe is None:
+        rtoe = _search_keyword(r'RTOE = (\d+)', wait_html)
     max_num_seq = _search_keyword(r'<input name="MAX_NUM_SEQ".+?value="(\d+?)"', wait_html, 500)
 
     if rid is None:
@@ -258,6 +332,183 @@ def _parse_qblast_wait_page(wait_html):
 #     return firefox
 
 
+class Poller:
+    """
+    Poll all outstanding RIDs from a single thread.
+
+    Instead of a blocking loop per RID, every RID is scheduled to be polled when NCBI estimates it to be done (RTOE),
+    and thereafter once a minute. The poller only wakes up when the next RID is due, and sends one request per
+    wake-up through the shared RateLimiter. The request asks for the results straight away, so a finished search is
+    retrieved by the same request that finds it ready.
+    --
+    https://blast.ncbi.nlm.nih.gov/Blast.cgi?CMD=Web&PAGE_TYPE=BlastDocs&DOC_TYPE=DeveloperInfo
+    1. Do not contact the server more often than once every 10 seconds.
+    2. Do not poll for any single RID more often than once a minute.
+    3. Use the URL parameter email and tool, so that the NCBI
+       can contact you if there is a problem.
+    4. Run scripts weekends or between 9 pm and 5 am Eastern time
+       on weekdays if more than 50 searches will be submitted.
+    """
+
+    # Give up a RID whose results are ready but can't be retrieved after this many polls:
+    max_unreadable = 5
+
+    def __init__(self, limiter=None, proxy=None, verbose=False, interval=60, first_delay=20, base_url=None):
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.base_url = _base_url(base_url)
+        self.proxy = proxy
+        self.verbose = verbose
+        self.interval = interval  # per RID
+        self.first_delay = first_delay  # if NCBI didn't estimate the time of execution
+        self._jobs = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def add(self, rid, poll_params, cookies=(), rtoe=None):
+        """Start tracking a submitted RID. Return a Future of the retrieved results."""
+        poll_params = [tuple(p) for p in poll_params]
+        session = requests.Session()
+        for c in cookies:
+            session.cookies.set(c['name'], c['value'])
+        try:
+            delay = max(int(rtoe), min(self.interval, 10))
+        except (TypeError, ValueError):
+            delay = self.first_delay
+        job = {
+            "rid": rid,
+            "params": poll_params,
+            "session": session,
+            "due": time.time() + delay,
+            "added": time.time(),
+            "polls": 0,
+            "unreadable": 0,
+            "future": Future(),
+        }
+        with self._condition:
+            if self._closed:
+                raise errors.QueryError("The poller was closed.")
+            self._jobs[rid] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="r2g-poller", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job["future"]
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            for job in self._jobs.values():
+                if job["future"].done():
+                    continue
+                job["future"].set_exception(errors.QueryError("The poller was closed before RID {} was done.".format(
+                    job["rid"]
+                )))
+            self._jobs = {}
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._jobs) == 0 and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job = min(self._jobs.values(), key=lambda j: j["due"])
+                wait = job["due"] - time.time()
+                if wait > 0:
+                    # Wake up again when it is due, or earlier if another RID comes in:
+                    self._condition.wait(wait)
+                    continue
+            try:
+                done = self._poll(job)
+            except Exception as err:
+                done = True
+                if not job["future"].done():
+                    job["future"].set_exception(err)
+            with self._condition:
+                if done:
+                    self._jobs.pop(job["rid"], None)
+
+    def _poll(self, job):
+        """Send one request for the RID. Return True if it is done, or reschedule it."""
+        rid = job["rid"]
+        self.limiter.wait()
+        job["polls"] += 1
+        metrics.inc("r2g_ncbi_polls_total")
+        job["due"] = time.time() + self.interval
+        try:
+            poll_response = job["session"].get(
+                "{}/Blast.cgi".format(self.base_url),
+                params=job["params"],
+                headers=headers,
+                timeout=120,
+                proxies=self.proxy,
+            )
+        except Exception as err:
+            utils.log(
+                "WARNING: Couldn't poll results from NCBI. {}. "
+                "But don't panic, we will retry and are almost there.".format(err),
+                verbose=self.verbose,
+                attr="debug"
+            )
+            return False
+        if not poll_response.ok:
+            utils.log(
+                "WARNING: Couldn't get results from NCBI. Status code: {}. "
+                "But don't panic, we will retry and are almost there.".format(poll_response.status_code),
+                verbose=self.verbose,
+                attr="debug"
+            )
+            return False
+        content = poll_response.content.decode("utf-8")
+        poll_format = _search_keyword(r'<!DOCTYPE ([\w]+?) PUBLIC', content, "NA")
+        if poll_format.lower() == "blastoutput":
+            utils.log("RID: {}, Status: ready ({} polls).".format(rid, job["polls"]), self.verbose, "debug")
+            # From the submission to the results, most of which is spent in NCBI's queue:
+            metrics.observe("r2g_ncbi_queue_wait_seconds", time.time() - job["added"])
+            job["future"].set_result(content)  # XML
+            return True
+        poll_rid, poll_status, _, _, _, _ = _parse_qblast_wait_page(content)
+        utils.log("RID: {}, Status: {}.".format(poll_rid, poll_status), self.verbose, "debug")
+        if poll_rid != rid:
+            utils.log(
+                "WARNING: The submitted RID ({}) "
+                "is different from the polled one ({}). "
+                "But don't panic, we will try to retrieve results again.".format(rid, poll_rid),
+                verbose=self.verbose,
+                attr="debug"
+            )
+        elif poll_status.lower() == "failed":
+            err_msg = _search_keyword(r'(<p class="error">.+?</p>)', content, ">NA<")
+            err_msg = ''.join(re.findall(r'>(.+?)<', err_msg))  # remove inside links <a></a>
+            raise errors.QueryError(
+                'Retrieving results failed. Error message from NCBI: "{}".'.format(err_msg)
+            )
+        elif poll_status.lower() == "ready":
+            # The results are ready but haven't come back in the requested format, so ask again at the next poll:
+            job["unreadable"] += 1
+            if job["unreadable"] >= self.max_unreadable:
+                raise errors.QueryError("The results of RID {} are ready, but couldn't be retrieved after {} "
+                                        "polls.".format(rid, job["unreadable"]))
+            utils.log(
+                "WARNING: Although the results are ready, "
+                "they can't be retrieved somehow. "
+                "Don't panic, we will retry and are almost there.",
+                verbose=self.verbose,
+                attr="debug"
+            )
+        elif poll_status.lower() not in ["waiting", "searching"]:
+            utils.log(
+                "WARNING: Something wrong while retrieving results from NCBI. "
+                "RID: {}. Status: {}. "
+                "But don't panic, we will retry and are almost there.".format(poll_rid, poll_status),
+                verbose=self.verbose,
+                attr="debug"
+            )
+        return False
+
+
 def _setup_chrome_webdriver(browser="http://127.0.0.1:4444/wd/hub", proxy=None):
     # TODO: change the user-agent and proxy settings in the remote webdriver. Maybe utilize a crx plugin?
     caps = webdriver.common.desired_capabilities.DesiredCapabilities.CHROME.copy()
@@ -289,12 +540,152 @@ def _setup_chrome_webdriver(browser="http://127.0.0.1:4444/wd/hub", proxy=None):
     return chrome
 
 
+class WebDriverPool:
+    """
+    A pool of long-lived browser sessions reused across chunks and SRXs, so the browser startup is paid once per
+    session instead of once per submission. Sessions are health-checked before being handed out, and recycled
+    after `max_uses` submissions or whenever the webdriver itself fails.
+    """
+
+    def __init__(self, browser="http://127.0.0.1:4444/wd/hub", proxy=None, size=1, max_uses=50):
+        self.browser = browser
+        self.proxy = proxy
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._uses = {}
+        self._starting = 0  # sessions being started, which count towards size
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        """Start a session, whose place was reserved in _starting beforehand."""
+        try:
+            with metrics.timer("r2g_browser_start_seconds"):
+                chrome = _setup_chrome_webdriver(browser=self.browser, proxy=self.proxy)
+        except BaseException:
+            with self._lock:
+                self._starting -= 1
+            raise
+        with self._lock:
+            self._starting -= 1
+            self._uses[chrome] = 0
+        return chrome
+
+    def _quit(self, chrome):
+        with self._lock:
+            self._uses.pop(chrome, None)
+        try:
+            chrome.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(chrome):
+        try:
+            chrome.execute_script("return document.readyState")
+        except WebDriverException:
+            return False
+        return True
+
+    def warm_up(self):
+        """Start sessions in advance, e.g. while the SRA accessions are being checked."""
+        while True:
+            # A slot is held while starting, like acquire() does, so acquire() waits for the session instead of
+            # starting another one, and the place of the session is reserved before the lock is let go:
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                with self._lock:
+                    if self._closed or len(self._uses) + self._starting >= self.size:
+                        break
+                    self._starting += 1
+                self._idle.put(self._start())
+            finally:
+                self._slots.release()
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    chrome = self._idle.get_nowait()
+                except queue.Empty:
+                    with self._lock:
+                        self._starting += 1
+                    return self._start()
+                if self._is_healthy(chrome):
+                    return chrome
+                self._quit(chrome)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, chrome, broken=False):
+        try:
+            with self._lock:
+                self._uses[chrome] = self._uses.get(chrome, 0) + 1
+                recycle = broken or self._closed or self._uses[chrome] >= self.max_uses
+            if recycle:
+                self._quit(chrome)
+            else:
+                self._idle.put(chrome)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self):
+        chrome = self.acquire()
+        broken = False
+        try:
+            yield chrome
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(chrome, broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                chrome = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(chrome)
+
+
+def _page_loaded(chrome):
+    return chrome.execute_script("return document.readyState") == "complete"
+
+
+def _submit_query_form(chrome, limiter, timeout=60):
+    """ (PRIVATE)
+    Click the BLAST button once it is clickable and return the page it leads to.
+    """
+    button = WebDriverWait(chrome, timeout).until(
+        expected_conditions.element_to_be_clickable((By.CLASS_NAME, "blastbutton"))
+    )
+    limiter.wait()
+    button.click()
+    try:
+        WebDriverWait(chrome, timeout).until(expected_conditions.staleness_of(button))
+        WebDriverWait(chrome, timeout).until(_page_loaded)
+    except TimeoutException:
+        # The page didn't move on, which will be reported while parsing it.
+        pass
+    return chrome.page_source
+
+
 def _add_eq_menus(srx):
     """ (PRIVATE)
-    Construct the part of EQ_MENUs in the base url. Input must be srx.
+    Construct the part of EQ_MENUs in the base url. Input must be srx, or a list of up to MAX_NUM_ORG srx.
     """
     if type(srx) == str:
         srx = srx.strip().split(',')
+    if len(srx) > MAX_NUM_ORG:
+        raise errors.InputError("No more than {} SRA experiments can be searched at once.".format(MAX_NUM_ORG))
     params = "&EQ_MENU={}".format(srx[0])
     if len(srx) > 1:
         for i in range(1, len(srx)):
@@ -337,18 +728,28 @@ def qblast(
         browser="http://127.0.0.1:4444/wd/hub",
         proxies=(None, None),  # (webdriver_proxy, general_proxy)
         verbose=False,
+        limiter=None,
+        pool=None,
+        poller=None,
+        on_submit=None,
+        base_url=None,
 ):
     """BLAST search using the selenium module:
          Some useful parameters:
 
           - program        megaBlast, blastn, discoMegablast, or tblastn (capital sensitive)
-          - sra            Which sra database to search against (srr or srx).
+          - srx            Which SRA experiments to search against, either "SRX1,SRX2" or a list.
           - sequence       The sequence to search.
           - max_num_seq    The number of hits that NCBI returned.
           - expect         An expect value cutoff.  Default 10.0.
           - repeat_filter  "L" turns on filtering low complexity regions.  Default no filtering.
           - word_size      default: 28 for blastn, 6 for tblastn
           - format_type    "HTML", "Text", "ASN.1", or "XML".  Default "XML".
+          - limiter        A RateLimiter shared with other concurrent queries. Default: a private one.
+          - pool           A WebDriverPool to borrow a browser session from. Default: a private one-off session.
+          - poller         A Poller shared with other concurrent queries. Default: a private one.
+          - on_submit      Called with (rid, poll_params, cookies, rtoe) as soon as the query is submitted.
+          - base_url       Where the BLAST services are. Default: $R2G_NCBI_URL or https://blast.ncbi.nlm.nih.gov.
     """
     # - base url:
     # https://blast.ncbi.nlm.nih.gov/blast/Blast.cgi?PAGE_TYPE=BlastSearch&BLAST_SPEC=SRA&DB_GROUP=Exp&
@@ -358,12 +759,11 @@ def qblast(
     # PROGRAM=blastn&BLAST_PROGRAMS=megaBlast&NUM_ORG=1&EQ_MENU=SRX000001
     # PROGRAM=tblastn&NUM_ORG=2&EQ_MENU=SRX000001&EQ_MENU1=SRX000002
     # Step 1 - Submit queries using the selenium module:
-    url = "https://blast.ncbi.nlm.nih.gov/blast/Blast.cgi?PAGE_TYPE=BlastSearch&BLAST_SPEC=SRA&DB_GROUP=Exp"
+    url = "{}/blast/Blast.cgi?PAGE_TYPE=BlastSearch&BLAST_SPEC=SRA&DB_GROUP=Exp".format(_base_url(base_url))
     url += _add_eq_menus(srx)
     url += _add_program(program)
-
-    chrome = _setup_chrome_webdriver(browser=browser, proxy=proxies[0])
-    time.sleep(4)
+    if limiter is None:
+        limiter = RateLimiter()
 
     submit_params = [
         # ("QUERY", query),
@@ -380,166 +780,54 @@ def qblast(
         if p[1] is not None:
             url += "&{}={}".format(p[0], p[-1])
 
-    chrome.get(url)
-    time.sleep(4)
-    chrome.find_element_by_name("QUERY").send_keys(query)
-    if query_from is not None and query_to is not None:
-        chrome.find_element_by_name("QUERY_FROM").send_keys(query_from)
-        chrome.find_element_by_name("QUERY_TO").send_keys(query_to)
-    time.sleep(4)
-    chrome.find_element_by_class_name('blastbutton').click()
-    wait_page = chrome.page_source
+    if pool is None:
+        private_pool = True
+        pool = WebDriverPool(browser=browser, proxy=proxies[0])
+    else:
+        private_pool = False
     try:
-        rid, status, job_title, entrez_query, rtoe, max_num_seq = _parse_qblast_wait_page(wait_page)
-    except errors.QueryError:
-        # In my experience, the first submit may be blocked somehow, so try to submit again:
-        time.sleep(4)
-        chrome.find_element_by_class_name('blastbutton').click()
-        wait_page = chrome.page_source
-        rid, status, job_title, entrez_query, rtoe, max_num_seq = _parse_qblast_wait_page(wait_page)
-    cookies = chrome.get_cookies()
-    _previous = time.time()
-    chrome.quit()
+        with pool.session() as chrome:
+            chrome.get(url)
+            query_box = WebDriverWait(chrome, 60).until(
+                expected_conditions.presence_of_element_located((By.NAME, "QUERY"))
+            )
+            query_box.clear()
+            query_box.send_keys(query)
+            if query_from is not None and query_to is not None:
+                chrome.find_element_by_name("QUERY_FROM").send_keys(query_from)
+                chrome.find_element_by_name("QUERY_TO").send_keys(query_to)
+            wait_page = _submit_query_form(chrome, limiter)
+            try:
+                rid, status, job_title, entrez_query, rtoe, max_num_seq = _parse_qblast_wait_page(wait_page)
+            except errors.QueryError:
+                # In my experience, the first submit may be blocked somehow, so try to submit again:
+                wait_page = _submit_query_form(chrome, limiter)
+                rid, status, job_title, entrez_query, rtoe, max_num_seq = _parse_qblast_wait_page(wait_page)
+            cookies = chrome.get_cookies()
+    finally:
+        if private_pool:
+            pool.close()
 
     # Step 2 - Poll results from NCBI:
     # Actually, all parameters for polling results can be obtained from the wait page.
-    # --
-    # Poll NCBI until the results are ready.
-    # https://blast.ncbi.nlm.nih.gov/Blast.cgi?CMD=Web&PAGE_TYPE=BlastDocs&DOC_TYPE=DeveloperInfo
-    # 1. Do not contact the server more often than once every 10 seconds.
-    # 2. Do not poll for any single RID more often than once a minute.
-    # 3. Use the URL parameter email and tool, so that the NCBI
-    #    can contact you if there is a problem.
-    # 4. Run scripts weekends or between 9 pm and 5 am Eastern time
-    #    on weekdays if more than 50 searches will be submitted.
-    # --
-    # Could start with a 10s delay, but expect most short queries
-    # will take longer thus at least 70s with delay. Therefore,
-    # start with 20s delay, thereafter once a minute.
     poll_params = [
         ("RID", rid),
         ("JOB_TITLE", job_title),
         ("ENTREZ_QUERY", entrez_query),
         ('MAX_NUM_SEQ', max_num_seq),
         ("CMD", "Get"),
+        ("FORMAT_TYPE", format_type),
     ]
     poll_params = [p for p in poll_params if p[1] is not None]
-
-    delay = 20  # seconds
-    session = requests.Session()
-    for c in cookies:
-        session.cookies.set(c['name'], c['value'])
-    not_done_yet = True
-    while not_done_yet:
-        current = time.time()
-        wait = _previous + delay - current
-        if wait > 0:
-            time.sleep(wait)
-            _previous = current + wait
-        else:
-            _previous = current
-        # delay by at least 60 seconds only if running the request against the public NCBI API
-        if delay < 60:
-            # Wasn't a quick return, must wait at least a minute
-            delay = 60
-
-        try:
-            poll_response = session.get(
-                "https://blast.ncbi.nlm.nih.gov/Blast.cgi",
-                params=poll_params,
-                headers=headers,
-                timeout=120,
-                proxies=proxies[-1],
-            )
-        except Exception as err:
-            utils.log(
-                "WARNING: Couldn't poll results from NCBI. {}. "
-                "But don't panic, we will retry and are almost there.".format(err),
-                verbose=verbose,
-                attr="debug"
-            )
-        else:
-            if poll_response.ok:
-                poll_rid, poll_status, _, _, _, _ = _parse_qblast_wait_page(poll_response.content.decode("utf-8"))
-                utils.log("RID: {}, Status: {}.".format(poll_rid, poll_status), verbose, "debug")
-                if poll_rid == rid:
-                    if poll_status.lower() in ["waiting", "searching"]:
-                        continue
-                    elif poll_status.lower() == "failed":
-                        err_msg = _search_keyword(
-                            r'(<p class="error">.+?</p>)',
-                            poll_response.content.decode("utf-8"),
-                            ">NA<"
-                        )
-                        err_msg = ''.join(re.findall(r'>(.+?)<', err_msg))  # remove inside links <a></a>
-                        raise errors.QueryError(
-                            'Retrieving results failed. Error message from NCBI: "{}".'.format(err_msg)
-                        )
-                    elif poll_status.lower() == "ready":
-                        poll_params.append(("FORMAT_TYPE", format_type))
-                        while not_done_yet:
-                            try:
-                                poll_response = session.get(
-                                    "https://blast.ncbi.nlm.nih.gov/Blast.cgi",
-                                    params=poll_params,
-                                    headers=headers,
-                                    timeout=120,
-                                    proxies=proxies[-1]
-                                )
-                            except Exception as err:
-                                raise errors.QueryError(
-                                    "Although the query was submitted, "
-                                    "but the results couldn't be retrieved. {}".format(err)
-                                )
-                            else:
-                                if poll_response.ok:
-                                    poll_format = _search_keyword(
-                                        r'<!DOCTYPE ([\w]+?) PUBLIC',
-                                        poll_response.content.decode("utf-8"),
-                                        "NA"
-                                    )
-                                    if poll_format.lower() == "blastoutput":
-                                        blastoutput = poll_response.content.decode("utf-8")  # XML
-                                        not_done_yet = False
-                                        break
-                                    else:
-                                        utils.log(
-                                            "WARNING: Although the results are ready, "
-                                            "they can't be retrieved somehow. "
-                                            "Don't panic, we will retry and are almost there.",
-                                            verbose=verbose,
-                                            attr="debug"
-                                        )
-                                        continue
-                                else:
-                                    utils.log(
-                                        "WARNING: Although the query was submitted, "
-                                        "but the results couldn't be retrieved probably because of network issues. "
-                                        "Status code: {}.".format(poll_response.status_code),
-                                        verbose=verbose,
-                                        attr="debug"
-                                    )
-                    else:
-                        utils.log(
-                            "WARNING: Something wrong while retrieving results from NCBI. "
-                            "RID: {}. Status: {}. "
-                            "But don't panic, we will retry and are almost there.".format(poll_rid, poll_status),
-                            verbose=verbose,
-                            attr="debug"
-                        )
-                else:
-                    utils.log(
-                        "WARNING: The submitted RID ({}) "
-                        "is different from the polled one ({}). "
-                        "But don't panic, we will try to retrieve results again.".format(rid, poll_rid),
-                        verbose=verbose,
-                        attr="debug"
-                    )
-            else:
-                utils.log(
-                    "WARNING: Couldn't get results from NCBI. Status code: {}. "
-                    "But don't panic, we will retry and are almost there.".format(poll_response.status_code),
-                    verbose=verbose,
-                    attr="debug"
-                )
-    return blastoutput
+    if on_submit is not None:
+        on_submit(rid, poll_params, cookies, rtoe)
+    if poller is None:
+        private_poller = True
+        poller = Poller(limiter=limiter, proxy=proxies[-1], verbose=verbose, base_url=base_url)
+    else:
+        private_poller = False
+    try:
+        return poller.add(rid, poll_params, cookies, rtoe).result()
+    finally:
+        if private_poller:
+            poller.close()
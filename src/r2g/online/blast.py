@@ -1,15 +1,28 @@
 from __future__ import division
 
+import io
 import os
+import threading
 import time
+from array import array
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET
 
 from r2g import utils
-from r2g.online import NCBIWWW_selenium
+from r2g.utils import metrics
+from r2g.online.cache import BlastCache, AccessionCache
 from r2g import errors
 
 
+# NCBIWWW_selenium loads selenium and requests, so it is imported only when NCBI is queried. Splitting the query and
+# parsing the results, e.g. by the local mode, don't need it.
+
+# Per-submission limits of the SRA BLAST query box:
+MAX_FRAGMENTS = 20
+MAX_RESIDUES = 10000
+
+
 def _cut_seq(name, seq, args):
     chunks = []
     try:
@@ -42,8 +55,31 @@ def _cut_seq(name, seq, args):
     return chunks
 
 
-def _format_seq(args):
-    batch = 20
+def _plan_submissions(seq_list, max_fragments=None, max_residues=None):
+    """
+    Pack query fragments into as few submissions as NCBI's per-query limits allow, keeping their order
+    and never submitting a fragment twice. Return a list of submissions, each one a list of fragments.
+    """
+    if max_fragments is None:
+        max_fragments = MAX_FRAGMENTS
+    if max_residues is None:
+        max_residues = MAX_RESIDUES
+    plan = []
+    fragments, residues = [], 0
+    for chunk in seq_list:
+        length = len(chunk.split('\n', 1)[-1])
+        if len(fragments) > 0 and (len(fragments) >= max_fragments or residues + length > max_residues):
+            plan.append(fragments)
+            fragments, residues = [], 0
+        fragments.append(chunk)
+        residues += length
+    if len(fragments) > 0:
+        plan.append(fragments)
+    return plan
+
+
+def _split_query(args):
+    """Cut the query into fragments. Return (name, [">name_0\nseq0", ">name_1\nseq1", ...])."""
     seq, seq_list = [], []
     if os.path.isfile(args['query']):
         with open(args['query'], 'r') as inf:
@@ -65,13 +101,20 @@ def _format_seq(args):
             name = "Undefined"
             seq = args['query']
         seq_list = _cut_seq(name, seq, args)
-    seq = [
-        '\n'.join(seq_list[(n * batch):((n + 1) * batch + 1)])
-        for n in range(len(seq_list) // 20 + 1)
-    ]
+    return name, seq_list
+
+
+def _format_seq(args):
+    name, seq_list = _split_query(args)
+    plan = _plan_submissions(seq_list)
+    utils.log("Submission plan: {} fragment(s) of {} in {} submission(s) ({}).".format(
+        len(seq_list), name, len(plan),
+        ', '.join([
+            "{} fragments/{} residues".format(len(p), sum([len(c.split('\n', 1)[-1]) for c in p])) for p in plan
+        ])
+    ))
+    seq = ['\n'.join(p) for p in plan]
     # seq = [">name1\nseq1\n>name2\nseq2...>name20\nseq20", ...]
-    while '' in seq:
-        seq.remove('')
     return name, seq
 
 
@@ -117,41 +160,44 @@ def _clear_up_list(download_list):
 #     return download_list
 
 
+def _iter_hit_accessions(raw_results):
+    """
+    Yield the text of every <Hit_accession> incrementally. Finished <Hit>s and <Iteration>s are dropped from the tree
+    as soon as they end, so the memory usage doesn't grow with the size of the document.
+    """
+    if type(raw_results) == str:
+        raw_results = raw_results.encode('utf-8')
+    parents = []
+    for event, elem in ET.iterparse(io.BytesIO(raw_results), events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'Hit_accession':
+            yield elem.text
+        elif elem.tag in ('Hit', 'Iteration') and len(parents) > 0:
+            parents[-1].remove(elem)
+
+
 def _parse_xml(raw_results, args):
+    """Return spot IDs hit in every SRR as compact integer arrays, e.g. {SRR1812889: array('q', [25821753, ...])}"""
     download_list = {}
-    r = -1
-    err = ""
-    while r < int(args['retry']):
-        try:
-            results_tree = ET.fromstring(raw_results)
-        except ET.ParseError as e:
-            err = str(e)
-            r += 1
-            print(raw_results)
-            utils.log("WARNING: couldn't get results from NCBI due to temporary errors. Retrying...",
-                      args['verbose'], 'debug')
-        else:
-            Iterations = results_tree.find(
-                'BlastOutput_iterations'
-            ).findall('Iteration')
-            for i in Iterations:
-                hits = i.find('Iteration_hits')
-                for hit in hits:
-                    hit = hit.find('Hit_accession').text.strip().split('.')
-                    try:
-                        sra = hit[0]
-                        spot = int(hit[1])
-                    except (ValueError, IndexError):
-                        pass
-                    else:
-                        spots = deepcopy(download_list.get(sra, []))
-                        spots.append(spot)
-                        download_list[sra] = deepcopy(spots)
-            err = ""
-            break
-    if len(err) > 0:
+    try:
+        for accession in _iter_hit_accessions(raw_results):
+            hit = accession.strip().split('.')
+            try:
+                sra = hit[0]
+                spot = int(hit[1])
+            except (ValueError, IndexError):
+                pass
+            else:
+                if sra not in download_list:
+                    download_list[sra] = array('q')
+                download_list[sra].append(spot)
+    except ET.ParseError as err:
         utils.log("WARNING: couldn't get results for from NCBI due to temporary errors. "
-                  "The fragment was skipped.")
+                  "The fragment was skipped. {}".format(err))
+        download_list = {}
         if args['verbose']:
             with open(
                     os.path.join(
@@ -162,73 +208,271 @@ def _parse_xml(raw_results, args):
     return download_list
 
 
-def query(args, webdriver):
-    download_list = {}
-    name, seq_chunks = _format_seq(args)
-    utils.log(seq_chunks, args['verbose'], 'debug')
+def _pack_srx(formatted_SRAs, pack="none"):
+    """
+    Group SRXs into as few submissions as NCBI allows:
+      - none     one SRX per submission
+      - species  SRXs of the same species are searched together
+      - all      SRXs of all species are searched together
+    """
+    from r2g.online import NCBIWWW_selenium
+    if pack == "all":
+        units = [[srx for srxes in formatted_SRAs.values() for srx in srxes.keys()]]
+    elif pack == "species":
+        units = [list(srxes.keys()) for srxes in formatted_SRAs.values()]
+    else:
+        units = [[srx] for srxes in formatted_SRAs.values() for srx in srxes.keys()]
+    groups = []
+    for unit in units:
+        for i in range(0, len(unit), NCBIWWW_selenium.MAX_NUM_ORG):
+            groups.append(unit[i:(i + NCBIWWW_selenium.MAX_NUM_ORG)])
+    # groups = [[srx1, srx2], [srx3], ...]
+    return groups
+
+
+def _open_cache(args):
+    if args.get('cache', None) is None or float(args.get('cache_size', 0)) <= 0:
+        return None
+    try:
+        return BlastCache(
+            args['cache'],
+            max_size=int(float(args['cache_size']) * 1024 ** 2),
+            max_age=float(args.get('cache_age', 30)) * 24 * 3600
+        )
+    except OSError as err:
+        utils.log("WARNING: couldn't use the cache folder {}. Caching is disabled. {}".format(args['cache'], err))
+        return None
+
+
+def _open_sra_cache(args):
+    if args.get('cache', None) is None or float(args.get('cache_size', 0)) <= 0:
+        return None
+    return AccessionCache(
+        os.path.join(args['cache'], "sra_accessions.json"),
+        max_age=float(args.get('cache_age', 30)) * 24 * 3600
+    )
+
+
+def _query_chunk(args, srx, chunk, max_num_seq, key, resources):
+    """
+    Submit one chunk to NCBI and retry on failures. Runs in a worker thread of query().
+    The resources are shared by all chunks: webdriver, limiter, pool, poller, cache, journal, stop, and base_url.
+    """
+    from r2g.online import NCBIWWW_selenium
+    cache = resources['cache']
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            utils.log("Found cached results for {} in {}.".format(chunk.split('\n', 1)[0], srx),
+                      args['verbose'], 'debug')
+            metrics.inc("r2g_blast_cache_hits_total")
+            return result
+    journal = resources['journal']
+    if journal is not None:
+        submitted = journal.last("submitted", key=key)
+        if submitted is not None:
+            # It was submitted before the last run stopped, so poll the same RID instead of submitting it again:
+            utils.log("Polling the RID {} submitted by the last run.".format(submitted['rid']))
+            try:
+                result = resources['poller'].add(
+                    submitted['rid'], submitted['params'], submitted['cookies'], submitted['rtoe']
+                ).result()
+            except Exception as err:
+                utils.log("WARNING: couldn't get results of the RID {}, so it will be submitted again. {}".format(
+                    submitted['rid'], err
+                ))
+            else:
+                if cache is not None and '</BlastOutput>' in result:
+                    cache.put(key, result)
+                return result
+
+    def on_submit(rid, poll_params, cookies, rtoe):
+        if journal is not None:
+            journal.write("submitted", key=key, rid=rid, params=poll_params, cookies=cookies, rtoe=rtoe)
+
+    r = -1
+    err = ''
+    while r < int(args['retry']):
+        if resources['stop'].is_set():
+            raise errors.QueryError("Cancelled because of errors above.")
+        if len(err) > 0:
+            utils.log("Retrying...")
+            metrics.inc("r2g_ncbi_retries_total")
+        metrics.inc("r2g_ncbi_submissions_total")
+        try:
+            with metrics.timer("r2g_qblast_seconds"):
+                result = NCBIWWW_selenium.qblast(
+                    program=args["program"],
+                    srx=srx,
+                    query=chunk,
+                    max_num_seq=max_num_seq,
+                    expect=args["evalue"],
+                    # format_type='Tabular'
+                    # Don't know why the number of returned hits can't be determined when the format is Tabular.
+                    # So the XML format is required:
+                    format_type='XML',
+                    browser=resources['webdriver'],
+                    proxies=(args["chrome_proxy"], args["proxy"]),
+                    verbose=args["verbose"],
+                    limiter=resources['limiter'],
+                    pool=resources['pool'],
+                    poller=resources['poller'],
+                    on_submit=on_submit,
+                    base_url=resources['base_url']
+                )
+        except Exception as e:
+            err = str(e)
+            r += 1
+            utils.log("Error msg while querying: {}.".format(err), shift="\n")
+        else:
+            if cache is not None and '</BlastOutput>' in result:
+                cache.put(key, result)
+            return result
+    raise errors.QueryError("Couldn't get results from NCBI. Errors above must be investigated.")
+
+
+def open_resources(args, webdriver):
+    """
+    Start what all queries can share: browser sessions, the rate limiter, the poller, the caches, and the SRA
+    accessions resolved by NCBI, e.g. for many genes in one run. Close them by close_resources().
+    """
+    from r2g.online import NCBIWWW_selenium
+    parallel = max(1, int(args.get('parallel', 1)))
+    # Browser sessions are started once and reused by all chunks and SRXs:
+    pool = NCBIWWW_selenium.WebDriverPool(browser=webdriver, proxy=args["chrome_proxy"], size=parallel)
+    warm_up = ThreadPoolExecutor(max_workers=1)
+    warm_up.submit(pool.warm_up)
     SRAs = {}.fromkeys(args['sra'].strip().split(',')).keys()
-    formatted_SRAs = NCBIWWW_selenium.check_sra_validity(SRAs, proxy=args["proxy"])
+    base_url = NCBIWWW_selenium._base_url(args.get('ncbi_url', None))
+    try:
+        formatted_SRAs = NCBIWWW_selenium.check_sra_validity(
+            SRAs, proxy=args["proxy"], cache=_open_sra_cache(args), base_url=base_url
+        )
+    except Exception:
+        warm_up.shutdown(wait=True)
+        pool.close()
+        raise
     # formatted_SRAs = {species1: {srx1: [srr...], srx2: [srr...]}, species2: ...}
-    interval = 10
     for i in formatted_SRAs.items():
         for j in i[-1].items():
-            srx = j[0]
-            srr = ','.join(j[-1])
-            current = 0
-            for chunk in seq_chunks:
-                current += 1
-                if args.get('docker', False) is True:
-                    utils.log("{} - {} ({}): {}%".format(i[0], srx, srr, round(current*100.0/len(seq_chunks), 1)))
-                else:
-                    utils.processing(
-                        current,
-                        len(seq_chunks),
-                        "{} - {} ({})".format(i[0], srx, srr),
-                        "percent"
-                    )
-                r = -1
-                err = ''
-                while r < int(args['retry']):
-                    # Do not contact the server more often than once every 10 seconds:
-                    if interval < 10:
-                        time.sleep(11 - interval)
-                    start_time = time.time()
-                    if len(err) > 0:
-                        # utils.log("Retrying...", shift="\n")
-                        utils.log("Retrying...")
-                    try:
-                        result = NCBIWWW_selenium.qblast(
-                            program=args["program"],
-                            srx=srx,
-                            query=chunk,
-                            max_num_seq=(args["max_num_seq"] // (len(seq_chunks) * 20) + 1),
-                            expect=args["evalue"],
-                            # format_type='Tabular'
-                            # Don't know why the number of returned hits can't be determined when the format is Tabular.
-                            # So the XML format is required:
-                            format_type='XML',
-                            browser=webdriver,
-                            proxies=(args["chrome_proxy"], args["proxy"]),
-                            verbose=args["verbose"]
-                        )
-                        if args['verbose']:
-                            with open(os.path.join(args['outdir'], "{}.xml".format(srx)), 'w') as outf:
-                                outf.write(result)
-                    except Exception as e:
-                        err = str(e)
-                        r += 1
-                        utils.log("Error msg while querying: {}.".format(err), shift="\n")
-                    else:
-                        err = ''
-                        break
-                if len(err) > 0:
-                    raise errors.QueryError("Couldn't get results from NCBI. Errors above must be investigated.")
-                else:
-                    result = _parse_xml(result, args)
-                    for sra in result.keys():
-                        spots = deepcopy(download_list.get(sra, []))
-                        spots += result[sra]
-                        download_list[sra] = deepcopy(spots)
-                    interval = time.time() - start_time
+            utils.log("{} - {} ({})".format(i[0], j[0], ','.join(j[-1])))
+    # Keep several RIDs in flight at once. All of them share one limiter,
+    # so NCBI is still contacted no more than once every 10 seconds:
+    if base_url == NCBIWWW_selenium.NCBI_URL:
+        limiter = NCBIWWW_selenium.RateLimiter(interval=10)
+        intervals = {}
+    else:
+        # NCBI's usage rules don't bind a stand-in server, which is there to be loaded as hard as possible:
+        utils.log("Using the BLAST services at {}.".format(base_url))
+        limiter = NCBIWWW_selenium.RateLimiter(interval=0)
+        intervals = {'interval': 1, 'first_delay': 1}
+    # Outstanding RIDs are polled by one thread, when NCBI expects them to be done:
+    poller = NCBIWWW_selenium.Poller(limiter=limiter, proxy=args["proxy"], verbose=args["verbose"],
+                                     base_url=base_url, **intervals)
+    return {
+        'webdriver': webdriver,
+        'limiter': limiter,
+        'pool': pool,
+        'poller': poller,
+        'cache': _open_cache(args),
+        'base_url': base_url,
+        'formatted_SRAs': formatted_SRAs,
+        'warm_up': warm_up,
+    }
+
+
+def close_resources(resources):
+    resources['poller'].close()
+    resources['warm_up'].shutdown(wait=True)
+    resources['pool'].close()
+
+
+def iter_query(args, webdriver, journal=None, resources=None):
+    """
+    Query NCBI, and yield (name, hits) as soon as every submission is done, while the others are still running,
+    where hits = {SRR: array('q', [spot, ...])}. Submissions finished by the last run (see the journal) come first.
+    Resources from open_resources() can be shared with other queries, otherwise they are opened and closed here.
+    """
+    start = time.time()
+    name, seq_chunks = _format_seq(args)
+    utils.log(seq_chunks, args['verbose'], 'debug')
+    if journal is not None:
+        journal.check_plan(name=name, chunks=seq_chunks, sra=args['sra'], program=args['program'],
+                           evalue=str(args['evalue']), max_num_seq=args['max_num_seq'])
+    shared = resources is not None
+    if not shared:
+        resources = open_resources(args, webdriver)
+    # The journal and the stop flag belong to this query only:
+    resources = dict(resources, journal=journal, stop=threading.Event())
+    formatted_SRAs = resources['formatted_SRAs']
+    groups = _pack_srx(formatted_SRAs, args.get('pack', 'none'))
+    if len(groups) < sum([len(srxes) for srxes in formatted_SRAs.values()]):
+        utils.log("SRA experiments are packed into {} submission(s) per chunk: {}".format(
+            len(groups), '; '.join([','.join(g) for g in groups])
+        ))
+    jobs = []
+    for group in groups:
+        for n in range(len(seq_chunks)):
+            jobs.append((group, n))
+    executor = ThreadPoolExecutor(max_workers=max(1, int(args.get('parallel', 1))))
+    max_num_seq = args["max_num_seq"] // (len(seq_chunks) * MAX_FRAGMENTS) + 1
+    futures = {}
+    done = []
+    current = 0
+    for job in jobs:
+        # NCBI returns max_num_seq hits per submission, which are shared by all packed SRXs:
+        key = BlastCache.key(args["program"], job[0], seq_chunks[job[1]], args["evalue"], max_num_seq * len(job[0]))
+        finished = journal.last("result", key=key) if journal is not None else None
+        if finished is not None:
+            current += 1
+            done.append(dict([(sra, array('q', spots)) for sra, spots in finished['hits'].items()]))
+            continue
+        future = executor.submit(
+            _query_chunk, args, job[0], seq_chunks[job[1]], max_num_seq * len(job[0]), key, resources
+        )
+        futures[future] = job + (key, )
+    if current > 0:
+        utils.log("{} of {} queries were finished by the last run.".format(current, len(jobs)))
+    try:
+        for result in done:
+            yield name, result
+        for future in as_completed(futures):
+            group, n, key = futures[future]
+            result = future.result()
+            current += 1
+            if args.get('docker', False) is True:
+                utils.log("Querying NCBI: {}%".format(round(current * 100.0 / len(jobs), 1)))
+            else:
+                utils.processing(current, len(jobs), "Querying NCBI", "percent")
+            if args['verbose']:
+                with open(os.path.join(args['outdir'], "{}_{}.xml".format('_'.join(group), n)), 'w') as outf:
+                    outf.write(result)
+            with metrics.timer("r2g_xml_parse_seconds"):
+                result = _parse_xml(result, args)
+            if journal is not None:
+                journal.write("result", key=key, hits=dict([(sra, list(result[sra])) for sra in result.keys()]))
+            yield name, result
+        metrics.observe("r2g_blast_query_seconds", time.time() - start)
+    except BaseException:
+        # Including GeneratorExit, when the caller stops early:
+        resources['stop'].set()
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        if not shared:
+            close_resources(resources)
+
+
+def query(args, webdriver, journal=None):
+    """Query NCBI. Return (name, {SRR: [(first spot, last spot), ...]})."""
+    download_list = {}
+    name = None
+    for name, hits in iter_query(args, webdriver, journal):
+        for sra in hits.keys():
+            download_list.setdefault(sra, array('q')).extend(hits[sra])
+    if name is None:
+        name = _split_query(args)[0]
     download_list = _clear_up_list(download_list)
     return name, download_list
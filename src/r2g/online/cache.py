@@ -0,0 +1,334 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # It isn't there on Windows, where the index of a spot store is only guarded against other threads:
+    fcntl = None
+
+
+class BlastCache:
+    """
+    A content-addressed on-disk cache of the BLAST XML returned by NCBIWWW_selenium.qblast.
+
+    Every entry is keyed by a hash of (program, SRX, query chunk, expect, max_num_seq). The modification time of an
+    entry is the time it was stored, which is checked against `max_age`, and the access time is the time it was last
+    used, which decides what to evict first once the cache grows over `max_size`.
+    The size of the cache is scanned once, and then kept up to date by put(), so the folder is only scanned again
+    when it has to be trimmed.
+    """
+
+    # Trim the cache down to this fraction of max_size, so it isn't trimmed again by the next few entries:
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir, max_size=1024 ** 3, max_age=30 * 24 * 3600):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size  # bytes
+        self.max_age = max_age  # seconds
+        self._lock = threading.Lock()
+        self._size = None  # bytes, unknown until the first scan
+        os.makedirs(self.cache_dir, 0o750, exist_ok=True)
+
+    @staticmethod
+    def key(program, srx, query, expect, max_num_seq):
+        if type(srx) == str:
+            srx = srx.strip().split(',')
+        raw = json.dumps([
+            program.lower(),
+            sorted(srx),
+            ''.join(query.strip().split()),
+            str(float(expect)),
+            int(max_num_seq)
+        ])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], "{}.xml".format(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stored = os.stat(path).st_mtime
+            if time.time() - stored > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, 'r') as inf:
+                xml = inf.read()
+            # Mark it as recently used:
+            os.utime(path, (time.time(), stored))
+        except OSError:
+            return None
+        return xml
+
+    def put(self, key, xml):
+        path = self._path(key)
+        os.makedirs(os.path.split(path)[0], 0o750, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.split(path)[0])
+        with os.fdopen(fd, 'w') as outf:
+            outf.write(xml)
+        size = os.path.getsize(tmp)
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp, path)
+            if self._size is not None:
+                self._size += size - replaced
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, and then the least recently used ones until the cache fits in max_size, or in
+        EVICT_TO of it if it had outgrown max_size.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            now = time.time()
+            for root, _, files in os.walk(self.cache_dir):
+                for f in files:
+                    if not f.endswith(".xml"):
+                        continue
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                        if now - st.st_mtime > self.max_age:
+                            os.remove(path)
+                            continue
+                    except OSError:
+                        continue
+                    entries.append((st.st_atime, st.st_size, path))
+                    total += st.st_size
+            entries.sort()
+            limit = self.max_size * self.EVICT_TO if total > self.max_size else self.max_size
+            for _, size, path in entries:
+                if total <= limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+            self._size = total
+
+
+class AccessionCache:
+    """
+    A persistent cache of SRA accessions resolved by NCBIWWW_selenium.check_sra_validity, i.e.
+    {accession: {"taxid": ..., "srx": ..., "srr": [...], "time": ...}}, kept in one JSON file.
+    Entries older than `max_age` are resolved again.
+    """
+
+    def __init__(self, cache_file, max_age=30 * 24 * 3600):
+        self.cache_file = os.path.abspath(os.path.expanduser(cache_file))
+        self.max_age = max_age  # seconds
+        self._lock = threading.Lock()
+        try:
+            with open(self.cache_file, 'r') as inf:
+                self._entries = json.load(inf)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, accession):
+        with self._lock:
+            entry = self._entries.get(accession.upper(), None)
+        if entry is None or time.time() - entry["time"] > self.max_age:
+            return None
+        return entry["taxid"], entry["srx"], entry["srr"]
+
+    def put(self, accession, taxid, srx, srr):
+        with self._lock:
+            self._entries[accession.upper()] = {"taxid": taxid, "srx": srx, "srr": list(srr), "time": time.time()}
+
+    def save(self):
+        with self._lock:
+            entries = dict([(k, v) for k, v in self._entries.items() if time.time() - v["time"] <= self.max_age])
+            folder = os.path.split(self.cache_file)[0]
+            os.makedirs(folder, 0o750, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+            with os.fdopen(fd, 'w') as outf:
+                json.dump(entries, outf, indent=4, separators=(',', ': '))
+            os.replace(tmp, self.cache_file)
+
+
+class SpotStore:
+    """
+    A persistent on-disk store of the reads fetched from SRA, keyed by (SRR, spot), so spots hit by related genes
+    or by earlier runs don't have to be downloaded again.
+
+    Every fetched piece of an SRR is kept as a segment, i.e. gzipped per-mate FASTQ files such as
+    SRR1812889/1-5000.ab12cd34_1.fastq.gz, and SRR1812889/index.json maps the segments to the spot ranges they hold.
+    The access time of the segment files is the time they were last used, which decides what to evict first once
+    the store grows over `max_size`. Like BlastCache, the size of the store is scanned once and then kept up to date,
+    so the folders are only scanned again when the store has to be trimmed.
+    Every index is replaced at once, and updated under a lock file (SRR1812889/index.lock), so a store can be shared
+    by r2g processes running at the same time.
+    """
+
+    COMPRESS_LEVEL = 1  # packing is on the way of every download, so it should be fast
+
+    def __init__(self, store_dir, max_size=10 * 1024 ** 3):
+        self.store_dir = os.path.abspath(os.path.expanduser(store_dir))
+        self.max_size = max_size  # bytes
+        self._lock = threading.RLock()
+        self._size = None  # bytes, unknown until the first scan
+        os.makedirs(self.store_dir, 0o750, exist_ok=True)
+
+    def _index_file(self, sra):
+        return os.path.join(self.store_dir, sra, "index.json")
+
+    @contextmanager
+    def _locked(self, sra):
+        """Hold the index of an SRR against other threads, and against other processes sharing the store."""
+        with self._lock:
+            folder = os.path.join(self.store_dir, sra)
+            os.makedirs(folder, 0o750, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(folder, "index.lock"), 'a') as lockf:
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+
+    def _segment_file(self, sra, name, mate):
+        return os.path.join(self.store_dir, sra, "{}_{}.fastq.gz".format(name, mate))
+
+    def _load(self, sra):
+        try:
+            with open(self._index_file(sra), 'r') as inf:
+                return json.load(inf)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, sra, index):
+        folder = os.path.join(self.store_dir, sra)
+        os.makedirs(folder, 0o750, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        with os.fdopen(fd, 'w') as outf:
+            json.dump(index, outf, indent=4, separators=(',', ': '))
+        os.replace(tmp, self._index_file(sra))
+
+    def lookup(self, sra, ranges):
+        """
+        Find the stored spots in ranges = [(first, last), ...].
+        Return [(segment, {mate: file}, [(first, last), ...]), ...], where the spot ranges don't overlap.
+        """
+        with self._lock:
+            index = self._load(sra)
+        stored = []
+        for name, entry in index.items():
+            files = dict([(mate, self._segment_file(sra, name, mate)) for mate in entry["mates"]])
+            if all([os.path.isfile(f) for f in files.values()]):
+                stored.extend([(first, last, name, files) for first, last in entry["ranges"]])
+        stored.sort()
+        found = {}
+        for first, last in sorted(ranges):
+            cursor = first
+            for a, b, name, files in stored:
+                if a > last:
+                    break
+                if b < cursor:
+                    continue
+                found.setdefault(name, (files, []))[1].append((max(a, cursor), min(b, last)))
+                cursor = min(b, last) + 1
+                if cursor > last:
+                    break
+        segments = []
+        for name, (files, pieces) in found.items():
+            try:
+                for f in files.values():
+                    # Mark it as recently used:
+                    os.utime(f, (time.time(), os.stat(f).st_mtime))
+            except OSError:
+                continue
+            segments.append((name, files, pieces))
+        return sorted(segments, key=lambda x: x[2][0])
+
+    def add(self, sra, ranges, files):
+        """Store the FASTQ files {mate: file} holding the spot ranges [(first, last), ...] of an SRR."""
+        ranges = sorted([tuple(r) for r in ranges])
+        name = "{}-{}.{}".format(ranges[0][0], ranges[-1][1], uuid.uuid4().hex[:8])
+        os.makedirs(os.path.join(self.store_dir, sra), 0o750, exist_ok=True)
+        for mate, path in files.items():
+            target = self._segment_file(sra, name, mate)
+            with open(path, 'rb') as inf, gzip.open(target + ".tmp", 'wb', compresslevel=self.COMPRESS_LEVEL) as outf:
+                shutil.copyfileobj(inf, outf)
+            os.replace(target + ".tmp", target)
+        size = sum([os.path.getsize(self._segment_file(sra, name, mate)) for mate in files.keys()])
+        with self._locked(sra):
+            index = self._load(sra)
+            index[name] = {"ranges": [list(r) for r in ranges], "mates": sorted(files.keys()), "time": time.time()}
+            self._save(sra, index)
+            if self._size is not None:
+                self._size += size
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def discard(self, sra, name):
+        """Remove a segment, e.g. one that can't be read any more."""
+        with self._locked(sra):
+            index = self._load(sra)
+            entry = index.pop(name, None)
+            self._save(sra, index)
+            for mate in entry["mates"] if entry is not None else []:
+                path = self._segment_file(sra, name, mate)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                if self._size is not None:
+                    self._size -= size
+
+    def evict(self):
+        """Remove the least recently used segments until the store fits in max_size."""
+        with self._lock:
+            segments = {}
+            total = 0
+            for sra in os.listdir(self.store_dir):
+                folder = os.path.join(self.store_dir, sra)
+                if not os.path.isdir(folder):
+                    continue
+                for f in os.listdir(folder):
+                    if not f.endswith(".fastq.gz"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(folder, f))
+                    except OSError:
+                        continue
+                    atime, size = segments.get((sra, f.rsplit('_', 1)[0]), (0, 0))
+                    segments[(sra, f.rsplit('_', 1)[0])] = (max(atime, st.st_atime), size + st.st_size)
+                    total += st.st_size
+            evicted = {}
+            for (sra, name), (_, size) in sorted(segments.items(), key=lambda x: x[1][0]):
+                if total <= self.max_size:
+                    break
+                for f in os.listdir(os.path.join(self.store_dir, sra)):
+                    if f.startswith("{}_".format(name)):
+                        try:
+                            os.remove(os.path.join(self.store_dir, sra, f))
+                        except OSError:
+                            pass
+                evicted.setdefault(sra, []).append(name)
+                total -= size
+            for sra, names in evicted.items():
+                with self._locked(sra):
+                    index = self._load(sra)
+                    for name in names:
+                        index.pop(name, None)
+                    self._save(sra, index)
+            self._size = total
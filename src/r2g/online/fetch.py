@@ -1,55 +1,571 @@
+import gzip
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from r2g import utils
 from r2g import errors
+from r2g.utils import bgzf
+from r2g.utils import metrics
+from r2g.online.cache import SpotStore
 
 
-def fastq_dump(sra, spotN, spotX, app_json):
-    """Works with fastq-dump 2.8.2 and 2.9.2"""
+def _iter_fastq(stream):
+    """
+    Read FASTQ records from a binary stream (e.g. the stdout of fastq-dump) one by one, and check them on the way.
+    Yield (mate, record), e.g. ('1', b"@name/1\nATGC\n+\nAAAA\n").
+    """
+    while True:
+        read = [stream.readline() for _ in range(4)]
+        if read[0] == b'':
+            break
+        read = [line.rstrip(b'\r\n') for line in read]
+        try:
+            assert read[0][:1] == b'@'
+            assert read[2][:1] == b'+'
+            assert len(read[1]) == len(read[3])
+            pair = read[0][-2:]
+            assert pair in [b'/1', b'/2']
+        except AssertionError:
+            raise errors.FetchError("Downloaded sequences are not in FASTQ format: \n{}".format(
+                utils.bytes2str(b'\n'.join(read))
+            ))
+        yield utils.bytes2str(pair[-1:]), b'\n'.join(read) + b'\n'
+
+
+class FastqWriter:
+    """
+    Write the reads of an SRR straight to its per-mate files in outdir, e.g. SRR1812889_1.fastq and SRR1812889_2.fastq.
+    mark() remembers where the files end, and rollback() cuts them back there, so a spot range that fails halfway
+    can be fetched again without leaving partial reads behind.
+    """
+
+    def __init__(self, outdir, sra):
+        self.outdir = outdir
+        self.sra = sra
+        self.files = {}
+        self.reads = 0
+        self.bytes = 0
+        self._outfs = {}
+        self._marks = {}
+        self._marked = (0, 0)
+
+    def write(self, mate, record):
+        if mate not in self._outfs:
+            self.files[mate] = os.path.join(self.outdir, "{}_{}.fastq".format(self.sra, mate))
+            self._outfs[mate] = open(self.files[mate], 'wb')
+        self._outfs[mate].write(record)
+        self.reads += 1
+        self.bytes += len(record)
+
+    def mark(self):
+        self._marks = dict([(mate, outf.tell()) for mate, outf in self._outfs.items()])
+        self._marked = (self.reads, self.bytes)
+
+    def rollback(self):
+        for mate, outf in self._outfs.items():
+            outf.seek(self._marks.get(mate, 0))
+            outf.truncate()
+        self.reads, self.bytes = self._marked
+
+    def close(self):
+        for outf in self._outfs.values():
+            outf.close()
+        self._outfs = {}
+
+
+def _spot_id(record):
+    """The spot id in the quality defline of a record, e.g. 232339 in "+SRR1812889.232339 FCC2U5KACXX:6:1101..."."""
+    try:
+        return int(record.split(b'\n', 3)[2][1:].split(None, 1)[0].rsplit(b'.', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _range_index(spot, firsts, keep):
+    """The index of the range in keep = [(first, last), ...] that the spot is in, or -1."""
+    i = bisect_right(firsts, spot) - 1
+    return i if i >= 0 and spot <= keep[i][1] else -1
+
+
+def _in_ranges(spot, firsts, keep):
+    return _range_index(spot, firsts, keep) >= 0
+
+
+def fastq_dump_to(sra, spotN, spotX, app_json, writer, keep=None, source=None):
+    """
+    Stream the spots from spotN to spotX into a FastqWriter, and return the log of fastq-dump.
+    If keep = [(first, last), ...] is given, only the spots in these ranges are written, and the others are dropped.
+    The spots are read from source, e.g. a local SRA file of the SRR (see locate_sra), or from the network by default.
+    """
+    if keep is not None:
+        keep = sorted(keep)
+        firsts = [k[0] for k in keep]
     cmd = [
         app_json['fastq-dump'],
-        # "--defline-seq", "@$sn[_$rn]/$ri",
         "--defline-seq", "@$sn/$ri",
+        "--defline-qual", "+$ac.$si $sn length=$rl",  # the default of fastq-dump, where the spot id is read from
         "--split-files",
         "-W",         # Clip adapter sequences
-        # "-O", tmpdir,
         "-Z",         # stdout
         "-N", str(spotN),  # Minimum spot id (included)
-        "-X", str(spotX),  # Minimum spot id (included)
-        sra
+        "-X", str(spotX),  # Maximum spot id (included)
+        sra if source is None else source
     ]
-    try:
-        with subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE) as p:
-            stdout, stderr = p.communicate()
+    writer.mark()
+    start, reads, size = time.time(), writer.reads, writer.bytes
+    # Its stderr goes to a temporary file, so it can never fill up a pipe while stdout is read:
+    with tempfile.TemporaryFile() as errf:
+        try:
+            with subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE, stderr=errf) as p:
+                try:
+                    for mate, record in _iter_fastq(p.stdout):
+                        if keep is not None:
+                            spot = _spot_id(record)
+                            if spot is not None and not _in_ranges(spot, firsts, keep):
+                                continue
+                        writer.write(mate, record)
+                except errors.FetchError:
+                    p.kill()
+                    raise
+                finally:
+                    p.stdout.close()
+                    p.wait()
+            errf.seek(0)
+            stderr = errf.read()
             if p.returncode != 0:
                 raise errors.FetchError(utils.bytes2str(stderr))
+        except errors.FetchError:
+            writer.rollback()
+            raise
+        except OSError as err:
+            writer.rollback()
+            raise errors.InputError(err)
+    metrics.observe("r2g_fastq_dump_seconds", time.time() - start)
+    metrics.inc("r2g_fetched_reads_total", writer.reads - reads)
+    metrics.inc("r2g_fetched_bytes_total", writer.bytes - size)
+    return '{} {}-{}:\n{}----'.format(sra, spotN, spotX, stderr)
+
+
+def _mirror_file(sra, mirror):
+    for name in ["{}.sra", "{}.sralite", os.path.join("{}", "{}.sra"), os.path.join("{}", "{}.sralite")]:
+        path = os.path.join(mirror, name.format(sra, sra))
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def locate_sra(sra, app_json, mirror, prefetch=False):
+    """
+    Find the SRA file of an SRR in the mirror folder, or download it there by prefetch first if asked to.
+    Return the path of the file, or None if the SRR has to be read from the network.
+    """
+    path = _mirror_file(sra, mirror)
+    if path is not None or prefetch is False:
+        return path
+    prefetch_app = app_json.get('prefetch', None)
+    if prefetch_app is None:
+        # prefetch comes with fastq-dump in the SRA Toolkit:
+        prefetch_app = os.path.join(os.path.split(app_json['fastq-dump'])[0], "prefetch")
+        if not os.path.isfile(prefetch_app):
+            prefetch_app = shutil.which("prefetch")
+    if prefetch_app is None:
+        utils.log("WARNING: couldn't find prefetch of the SRA Toolkit, so {} is read from the network.".format(sra))
+        return None
+    utils.log("Prefetching {} into {}.".format(sra, mirror))
+    try:
+        subprocess.check_output([prefetch_app, sra, "-O", mirror], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as err:
+        utils.log("WARNING: couldn't prefetch {}, so it is read from the network. {}".format(
+            sra, utils.bytes2str(getattr(err, 'output', b'')) or err
+        ))
+        return None
+    return _mirror_file(sra, mirror)
+
+
+def _fetch_range(sra, n, spots, app_json, parts_dir, retry=5, store=None, source=None):
+    """
+    Fetch the nth spot range of an SRR, i.e. spots = (first, last, [wanted ranges...]) from plan_ranges, into its own
+    part files, retrying on failures, and keep a copy in the spot store if any.
+    Runs in a worker of fetch_all. Return (files of the part, log, seconds taken).
+    """
+    keep = spots[2] if len(spots[2]) > 1 else None
+    writer = FastqWriter(parts_dir, "{}.{}".format(sra, n))
+    r = -1
+    try:
+        while r < retry:
+            try:
+                start = time.time()
+                log = fastq_dump_to(sra, spots[0], spots[1], app_json, writer, keep, source)
+            except errors.FetchError as err:
+                r += 1
+                if r < retry:
+                    metrics.inc("r2g_fastq_dump_retries_total")
+                    utils.log("Errors occurred while fetching the spots {} - {} in the sra {}. Retrying...".format(
+                        spots[0], spots[1], sra
+                    ), shift="\n")
+                else:
+                    utils.log("WARNING: couldn't fetch sequences from the spots {} - {} "
+                              "in the sra {} after {} retries. Skipped. "
+                              "Errors from fastq-dump below must be investigated: "
+                              "{}".format(spots[0], spots[1], sra, r, err), shift="\n")
             else:
-                sequence = _parse_fastq(utils.bytes2str(stdout))
-                log = '{} {}-{}:\n{}----'.format(sra, spotN, spotX, stderr)
-                return sequence, log
+                seconds = time.time() - start
+                writer.close()
+                if store is not None:
+                    try:
+                        store.add(sra, spots[2], writer.files)
+                    except OSError as err:
+                        utils.log("WARNING: couldn't keep the spots {} - {} of the sra {} in the spot store. {}".format(
+                            spots[0], spots[1], sra, err
+                        ))
+                return writer.files, log, seconds
+    finally:
+        writer.close()
+    for path in writer.files.values():
+        os.remove(path)
+    return {}, '', None
+
+
+def _open_store(args):
+    if args.get('spot_store', None) is None or float(args.get('spot_store_size', 0)) <= 0:
+        return None
+    try:
+        return SpotStore(args['spot_store'], max_size=int(float(args['spot_store_size']) * 1024 ** 2))
     except OSError as err:
-        raise errors.InputError(err)
+        utils.log("WARNING: couldn't use the spot store {}. It is disabled. {}".format(args['spot_store'], err))
+        return None
 
 
-def _parse_fastq(sequence):
-    sequence = sequence.strip().split('\n')
-    split_sequence = {}
-    for i in range(int(len(sequence)/4)):
-        read = sequence[4*i: 4*(i+1)]
+def _subtract(ranges, covered):
+    """Remove the spot ranges in covered from ranges, e.g. [(1, 10)] - [(3, 4)] = [(1, 2), (5, 10)]."""
+    covered = sorted(covered)
+    left = []
+    for first, last in sorted(ranges):
+        for a, b in covered:
+            if b < first or a > last:
+                continue
+            if a > first:
+                left.append((first, a - 1))
+            first = max(first, b + 1)
+            if first > last:
+                break
+        if first <= last:
+            left.append((first, last))
+    return left
+
+
+def _read_stored(sra, n, ranges, store, parts_dir):
+    """
+    Copy the spots of an SRR found in the spot store into part files named after the nth part, one for every piece of
+    spot ranges served, so they can be put in spot order with the parts fetched. Segments that can't be read are
+    dropped from the store, and their spots are fetched again.
+    Return ([(first spot, files of the part), ...], [(first, last) served, ...]).
+    """
+    parts = []
+    served = []
+    for name, files, pieces in store.lookup(sra, ranges):
+        firsts = [p[0] for p in pieces]
+        writers = [FastqWriter(parts_dir, "{}.{}.{}".format(sra, n, len(served) + i)) for i in range(len(pieces))]
         try:
-            assert read[0][0] == '@'
-            assert read[2][0] == '+'
-            assert len(read[1]) == len(read[3])
-            pair = read[0][-2:]
-            assert pair in ['/1', '/2']
-        except (AssertionError, IndexError):
-            raise errors.FetchError("Downloaded sequences are not in FASTQ format: \n{}".format('\n'.join(read)))
+            for mate in sorted(files.keys()):
+                with gzip.open(files[mate], 'rb') as inf:
+                    for m, record in _iter_fastq(inf):
+                        spot = _spot_id(record)
+                        if spot is None:
+                            continue
+                        i = _range_index(spot, firsts, pieces)
+                        if i >= 0:
+                            writers[i].write(m, record)
+        except (OSError, EOFError, zlib.error, errors.FetchError) as err:
+            for writer in writers:
+                writer.close()
+                for path in writer.files.values():
+                    os.remove(path)
+            utils.log("WARNING: couldn't read the segment {} of the sra {} in the spot store. "
+                      "It is removed. {}".format(name, sra, err))
+            store.discard(sra, name)
         else:
-            split_sequence[pair[-1]] = split_sequence.get(pair[-1], '') + '\n'.join(read) + '\n'
-    # num_keys = len(split_sequence.keys())
-    # if num_keys == 1:
-    #     split_sequence['paired'] = False
-    # else:
-    #     split_sequence['paired'] = False
-    return split_sequence
+            for piece, writer in zip(pieces, writers):
+                writer.close()
+                parts.append((piece[0], writer.files))
+            served.extend(pieces)
+    return parts, served
+
+
+def _join_parts(sra, parts, outdir, compress=0):
+    """
+    Concatenate the part files of an SRR in the order of its spot ranges, e.g. into SRR1812889_1.fastq, or into
+    SRR1812889_1.fastq.gz compressed by `compress` threads in the BGZF format if compress > 0.
+    """
+    files = {}
+    lines = {}
+    for part in parts:
+        for mate in part.keys():
+            files[mate] = os.path.join(outdir, "{}_{}.fastq{}".format(sra, mate, ".gz" if compress > 0 else ""))
+    for mate in sorted(files.keys()):
+        if compress > 0:
+            outf = bgzf.BgzfWriter(files[mate], threads=compress)
+        else:
+            outf = open(files[mate], 'wb')
+        with outf:
+            for part in parts:
+                if mate in part:
+                    with open(part[mate], 'rb') as inf:
+                        for chunk in iter(lambda: inf.read(1024 ** 2), b''):
+                            lines[mate] = lines.get(mate, 0) + chunk.count(b'\n')
+                            outf.write(chunk)
+    for part in parts:
+        for path in part.values():
+            os.remove(path)
+    # Every spot has a read in each mate, so the reads of one mate are counted:
+    metrics.observe("r2g_reads_per_srr", max(lines.values() or [0]) // 4, buckets=metrics.COUNTS, sra=sra)
+    return files
+
+
+# The default cost model of a fastq-dump launch and of every spot it reads, in seconds:
+LAUNCH_COST = 2.0
+SPOT_COST = 0.0002
+
+
+def plan_ranges(download_list, launch_cost=None, spot_cost=None):
+    """
+    Merge the spot ranges of every SRR whenever reading the spots between them costs less than launching another
+    fastq-dump, and the extra spots are dropped while fetching.
+    Return {SRR: [(first, last, [(first, last) wanted, ...]), ...]}.
+    """
+    if launch_cost is None:
+        launch_cost = LAUNCH_COST
+    if spot_cost is None:
+        spot_cost = SPOT_COST
+    plan = {}
+    for sra, ranges in download_list.items():
+        merged = []
+        for first, last in sorted([tuple(r) for r in ranges]):
+            if len(merged) > 0 and (first - merged[-1][1] - 1) * spot_cost < launch_cost:
+                merged[-1] = (merged[-1][0], max(last, merged[-1][1]), merged[-1][2] + [(first, last)])
+            else:
+                merged.append((first, last, [(first, last)]))
+        plan[sra] = merged
+    return plan
+
+
+def _fit_costs(samples):
+    """Fit seconds = launch + spots * spot to the timed launches, i.e. samples = [(spots, seconds), ...]."""
+    if len(samples) < 3:
+        return None
+    n = len(samples)
+    mean_x = sum([x for x, _ in samples]) / n
+    mean_y = sum([y for _, y in samples]) / n
+    var_x = sum([(x - mean_x) ** 2 for x, _ in samples])
+    if var_x == 0:
+        return None
+    spot = sum([(x - mean_x) * (y - mean_y) for x, y in samples]) / var_x
+    return max(mean_y - spot * mean_x, 0), max(spot, 0)
+
+
+class Fetcher:
+    """
+    Fetch spot ranges with a pool of `fetch_jobs` concurrent fastq-dump workers, while more ranges can still be added,
+    e.g. by BLAST chunks that are still running. Nearby ranges of every add() are merged by plan_ranges
+    (see --launch_cost and --spot_cost), spots requested before are never fetched again, and spots kept in the spot
+    store (see --spot_store) or in the local SRA mirror (see --sra_mirror) are read from there instead of the network.
+    Every range is written to its own part files. Once finish() is called, the parts of an SRR are put together as
+    soon as all of them are done, in gzipped FASTQ files if --compress is on.
+    SRRs fetched by the last run (see the journal) aren't fetched again, as long as they have all the spots added.
+    """
+
+    def __init__(self, app_json, outdir, args, journal=None, log=None):
+        self.app_json = app_json
+        self.outdir = outdir
+        self.args = args
+        self.journal = journal
+        self.log = log
+        self.parts_dir = os.path.join(outdir, "parts")
+        os.makedirs(self.parts_dir, 0o750, exist_ok=True)
+        self.store = _open_store(args)
+        self.compress = max(1, int(args.get('CPU', 1))) if args.get('compress', False) else 0
+        self.jobs = max(1, int(args.get('fetch_jobs', 1)))
+        self.requested = {}
+        self.parts = {}
+        self.sra_files = {}
+        self.resumed = {}
+        self.futures = {}
+        self.samples = []
+        self._sources = {}
+        self._source_locks = {}
+        self._lock = threading.Lock()
+        # Only a few ranges wait for a worker, so add() holds back its caller when fastq-dump can't keep up:
+        self._slots = threading.BoundedSemaphore(4 * self.jobs)
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        utils.log("Downloading hits with {} fastq-dump worker(s).".format(self.jobs))
+
+    def _source(self, sra):
+        """Find the local SRA file of an SRR once (see locate_sra), or None if it is read from the network."""
+        if self.args.get('sra_mirror', None) is None:
+            return None
+        with self._lock:
+            lock = self._source_locks.setdefault(sra, threading.Lock())
+        with lock:
+            if sra not in self._sources:
+                self._sources[sra] = locate_sra(sra, self.app_json, self.args['sra_mirror'],
+                                                self.args.get('prefetch', False))
+                if self._sources[sra] is not None:
+                    utils.log("Reading spots of {} from {}.".format(sra, self._sources[sra]),
+                              self.args.get('verbose', False), 'debug')
+        return self._sources[sra]
+
+    def _fetch(self, sra, n, spots):
+        return _fetch_range(sra, n, spots, self.app_json, self.parts_dir, self.args.get('retry', 5), self.store,
+                            self._source(sra))
+
+    def _skip_fetched(self, download_list):
+        """Leave out the SRRs in download_list that were fetched by the last run with all the spot ranges wanted."""
+        if self.journal is None:
+            return download_list
+        todo = {}
+        for sra, ranges in download_list.items():
+            fetched = self.journal.last("fetched", sra=sra) if sra not in self.parts else None
+            if fetched is not None and all([os.path.isfile(f) for f in fetched['files'].values()]):
+                done = [tuple(r) for r in fetched['ranges']]
+                if len(_subtract(ranges, done)) == 0:
+                    if sra not in self.resumed:
+                        utils.log("Hits from {} were downloaded by the last run.".format(sra))
+                    self.resumed[sra] = fetched['files']
+                    continue
+                # More spots are wanted now, and the files of the SRR are rewritten with all of them:
+                self.resumed.pop(sra, None)
+                ranges = list(ranges) + done
+            todo[sra] = ranges
+        return todo
+
+    def add(self, download_list):
+        """Start fetching the spot ranges in download_list = {SRR: [(first, last), ...]} that weren't requested yet."""
+        download_list = self._skip_fetched(download_list)
+        missing = {}
+        for sra, ranges in download_list.items():
+            missing[sra] = _subtract(ranges, self.requested.get(sra, []))
+            self.requested.setdefault(sra, []).extend(missing[sra])
+            self.parts.setdefault(sra, [])
+        if self.store is not None:
+            found, wanted = 0, 0
+            for sra in missing.keys():
+                if len(missing[sra]) == 0:
+                    continue
+                stored, served = _read_stored(sra, len(self.parts[sra]), missing[sra], self.store, self.parts_dir)
+                self.parts[sra].extend(stored)
+                wanted += sum([last - first + 1 for first, last in missing[sra]])
+                missing[sra] = _subtract(missing[sra], served)
+                found += sum([last - first + 1 for first, last in served])
+            utils.log("Found {} of {} wanted spot(s) in the spot store {}.".format(
+                found, wanted, self.store.store_dir
+            ))
+        plan = plan_ranges(missing, self.args.get('launch_cost', None), self.args.get('spot_cost', None))
+        launches = sum([len(r) for r in plan.values()])
+        if launches == 0:
+            return
+        spots_read = sum([last - first + 1 for ranges in plan.values() for first, last, _ in ranges])
+        wanted = sum([last - first + 1 for ranges in missing.values() for first, last in ranges])
+        utils.log("Fetch plan: {} fastq-dump launch(es) reading {} spot(s) for {} wanted spot(s) "
+                  "in {} range(s).".format(launches, spots_read, wanted, sum([len(r) for r in missing.values()])))
+        for sra in sorted(plan.keys()):
+            for spots in plan[sra]:
+                self._slots.acquire()
+                # Parts are put together in the order of their first spots, once their files are there:
+                self.parts[sra].append((spots[0], None))
+                n = len(self.parts[sra]) - 1
+                future = self._executor.submit(self._fetch, sra, n, spots)
+                future.add_done_callback(lambda f: self._slots.release())
+                self.futures[future] = (sra, n, spots[1] - spots[0] + 1)
+
+    def _join(self, sra):
+        parts = sorted([p for p in self.parts[sra] if p[1] is not None], key=lambda p: p[0])
+        self.sra_files[sra] = _join_parts(sra, [files for _, files in parts], self.outdir, self.compress)
+        if self.journal is not None:
+            self.journal.write("fetched", sra=sra, ranges=self.requested[sra], files=self.sra_files[sra])
+
+    def finish(self):
+        """Wait for all ranges to be fetched. Return {SRR: {mate: file}}, including the SRRs fetched by the last run."""
+        self.sra_files.update(self.resumed)
+        remaining = dict([(sra, 0) for sra in self.parts.keys()])
+        for sra, _, _ in self.futures.values():
+            remaining[sra] += 1
+        try:
+            for sra in remaining.keys():
+                if remaining[sra] == 0:
+                    self._join(sra)
+            total, current = len(self.futures), 0
+            for future in as_completed(self.futures):
+                sra, n, size = self.futures[future]
+                files, range_log, seconds = future.result()
+                self.parts[sra][n] = (self.parts[sra][n][0], files)
+                if seconds is not None:
+                    self.samples.append((size, seconds))
+                if self.log is not None:
+                    self.log.write(range_log)
+                current += 1
+                if self.args.get('docker', False) is True:
+                    utils.log("Downloading hits: {}/{}".format(current, total))
+                else:
+                    utils.processing(current, total, "Downloading hits")
+                remaining[sra] -= 1
+                if remaining[sra] == 0:
+                    self._join(sra)
+        finally:
+            self.close()
+        costs = _fit_costs(self.samples)
+        if costs is not None:
+            utils.log("Measured costs: about {:.2f} seconds per fastq-dump launch and {:.6f} seconds per spot, "
+                      "which can be used to tune --launch_cost and --spot_cost.".format(*costs),
+                      self.args.get('verbose', False), 'debug')
+        return self.sra_files
+
+    def close(self):
+        """Stop fetching, e.g. after errors. Ranges that haven't started are cancelled."""
+        for future in self.futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        try:
+            os.rmdir(self.parts_dir)
+        except OSError:
+            pass
+
+
+def collect_fastq(sra_files):
+    """
+    Put the files of all SRRs, i.e. {SRR: {mate: file}}, together for Trinity.
+    Return (fastq_list, paired), where fastq_list = {'1': [...], '2': [...]}.
+    """
+    fastq_list = {}
+    paired = True  # the initial value
+    for sra in sra_files.keys():
+        for p in sorted(sra_files[sra].keys()):
+            fastq_list[p] = fastq_list.get(p, []) + [sra_files[sra][p]]
+        if len(sra_files[sra].keys()) < 2:
+            paired = False
+        if paired is False and len(sra_files[sra].keys()) > 1:
+            utils.log("WARNING: since some of fastq files are paired but some are not, "
+                      "all fastq files will be taken as singled-end files while being fed to Trinity.")
+    return fastq_list, paired
+
+
+def fetch_all(download_list, app_json, outdir, args, journal=None, log=None):
+    """
+    Fetch all spot ranges in download_list = {SRR: [(first, last), ...]} by a Fetcher.
+    SRRs fetched by the last run (see the journal) with all the spot ranges wanted are skipped.
+    Return (fastq_list, paired), where fastq_list = {'1': [...], '2': [...]} can be fed to Trinity.
+    """
+    fetcher = Fetcher(app_json, outdir, args, journal, log)
+    try:
+        fetcher.add(download_list)
+    except Exception:
+        fetcher.close()
+        raise
+    sra_files = fetcher.finish()
+    return collect_fastq(dict([(sra, sra_files[sra]) for sra in download_list.keys()]))
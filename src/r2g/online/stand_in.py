@@ -0,0 +1,352 @@
+"""
+A stand-in for the NCBI BLAST services r2g talks to, for testing and load testing without the real NCBI:
+    /portal/utils/autocomp.fcgi  resolves SRA accessions (check_sra_validity)
+    /blast/Blast.cgi             serves the SRA BLAST form (qblast), takes its submissions,
+    /Blast.cgi                   and serves wait pages or BLAST XML to pollers (Poller)
+Point r2g at it by --ncbi_url or the environment variable R2G_NCBI_URL, e.g.
+    python -m r2g.online.stand_in --port 8000 --delay 30 --hits 5000
+    r2g --ncbi_url http://127.0.0.1:8000 -s SRX885420 -q QUERY.fasta -o OUTPUT
+Any accession is valid: SRXn is an experiment of the run SRRn.
+"""
+
+import argparse
+import random
+import re
+import string
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qsl
+from xml.sax.saxutils import escape
+
+import r2g
+
+
+FORM_PAGE = """<!DOCTYPE html>
+<html><head><title>Standard Nucleotide BLAST (stand-in)</title></head>
+<body>
+<form id="searchForm" method="post" action="Blast.cgi">
+{hidden}
+<textarea name="QUERY" rows="10" cols="80"></textarea>
+<input name="QUERY_FROM" type="text" value=""><input name="QUERY_TO" type="text" value="">
+<input class="blastbutton" type="submit" value="BLAST">
+</form>
+</body></html>
+"""
+
+WAIT_PAGE = """<!DOCTYPE html>
+<html><head><title>NCBI Blast:{job_title}</title></head>
+<body>
+<!--
+QBlastInfoBegin
+    Status={status}
+QBlastInfoEnd
+-->
+<table><tr class="odd"><td>Status</td><td>{status_text}</td></tr></table>
+{error}
+<form method="get" action="Blast.cgi">
+<input name="RID" type="hidden" value="{rid}"><input name="RTOE" type="hidden" value="{rtoe}">\
+<input name="JOB_TITLE" type="hidden" value="{job_title}"><input name="ENTREZ_QUERY" type="hidden" value="{entrez}">\
+<input name="MAX_NUM_SEQ" type="hidden" value="{max_num_seq}">\
+<input name="SEARCH_DB_STATUS" type="hidden" value="{code}">
+</form>
+</body></html>
+"""
+
+ERROR_PAGE = """<!DOCTYPE html>
+<html><body><ul class="msg error"><li class="error"><p class="error">{}</p></li></ul></body></html>
+"""
+
+XML_HEAD = """<?xml version="1.0"?>
+<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">
+<BlastOutput>
+  <BlastOutput_program>{program}</BlastOutput_program>
+  <BlastOutput_version>stand-in</BlastOutput_version>
+  <BlastOutput_db>{db}</BlastOutput_db>
+  <BlastOutput_query-ID>{rid}</BlastOutput_query-ID>
+  <BlastOutput_query-def>{job_title}</BlastOutput_query-def>
+  <BlastOutput_query-len>{query_len}</BlastOutput_query-len>
+<BlastOutput_iterations>
+<Iteration>
+  <Iteration_iter-num>1</Iteration_iter-num>
+  <Iteration_query-ID>{rid}</Iteration_query-ID>
+<Iteration_hits>
+"""
+
+XML_HIT = """<Hit>
+  <Hit_num>{num}</Hit_num>
+  <Hit_id>gnl|SRA|{accession}</Hit_id>
+  <Hit_def>stand-in:{num}</Hit_def>
+  <Hit_accession>{accession}</Hit_accession>
+  <Hit_len>100</Hit_len>
+  <Hit_hsps>
+    <Hsp>
+      <Hsp_num>1</Hsp_num>
+      <Hsp_evalue>{evalue}</Hsp_evalue>
+      <Hsp_query-from>1</Hsp_query-from>
+      <Hsp_query-to>70</Hsp_query-to>
+    </Hsp>
+  </Hit_hsps>
+</Hit>
+"""
+
+XML_TAIL = """</Iteration_hits>
+</Iteration>
+</BlastOutput_iterations>
+</BlastOutput>
+"""
+
+
+def _accession(sra):
+    """Return (taxid, srx, [srr...]) of any accession: SRXn is an experiment of the run SRRn."""
+    found = re.match(r'^[SED]R[RX](\d+)$', sra.strip().upper())
+    if found is None:
+        return None
+    number = found.group(1)
+    return 7160, "SRX{}".format(number), ["SRR{}".format(number)]
+
+
+def _get_param(params, key, default=None):
+    for k, v in params:
+        if k == key:
+            return v
+    return default
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    A multi-threaded HTTP server that behaves like NCBI BLAST. Every search is "searching" for `delay` seconds
+    (give or take `jitter`), and then returns `hits` hits (or MAX_NUM_SEQ, whichever is smaller) spread over the
+    runs searched. Failures can be injected: `fail_rate` of searches end with the status "failed", and `error_rate`
+    of all requests are answered with HTTP 503. Like NCBI, the results of a search expire `ttl` seconds after they are
+    ready, so the server doesn't grow during long load tests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), delay=5, jitter=0, rtoe=None, hits=100, fail_rate=0,
+                 error_rate=0, ttl=3600, seed=None):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.delay = delay
+        self.jitter = jitter
+        self.rtoe = rtoe
+        self.hits = hits
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.random = random.Random(seed)
+        self.searches = {}
+        self._expiry = deque()  # (expiry time, RID) in the order of submission
+        self.lock = threading.Lock()
+        self.stats = {"autocomp": 0, "form": 0, "submit": 0, "poll": 0, "error": 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        """Serve in a background thread, and return the base URL."""
+        self._thread = threading.Thread(target=self.serve_forever, name="r2g-stand-in", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def chance(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def submit(self, params):
+        """Start a search. Return its record."""
+        with self.lock:
+            rid = ''.join(self.random.choice(string.ascii_uppercase + string.digits) for _ in range(11))
+            delay = max(0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.fail_rate
+        srx = [v for k, v in params if re.match(r'^EQ_MENU\d*$', k)]
+        search = {
+            "rid": rid,
+            "program": _get_param(params, "PROGRAM", "blastn"),
+            "srr": [srr for s in srx if _accession(s) is not None for srr in _accession(s)[-1]],
+            "query": _get_param(params, "QUERY", ""),
+            "job_title": _get_param(params, "JOB_TITLE", "stand-in search"),
+            "entrez": ' OR '.join(srx),
+            "max_num_seq": int(_get_param(params, "MAX_NUM_SEQ", 500)),
+            "expect": _get_param(params, "EXPECT", "10"),
+            "ready": time.time() + delay,
+            "rtoe": int(round(delay)) if self.rtoe is None else self.rtoe,
+            "failed": failed,
+        }
+        with self.lock:
+            self._expire()
+            self.searches[rid] = search
+            self._expiry.append((search["ready"] + self.ttl, rid))
+        return search
+
+    def _expire(self):
+        """Drop the searches expired. Searches are submitted in about the order they expire, so it doesn't scan all."""
+        now = time.time()
+        while len(self._expiry) > 0 and self._expiry[0][0] < now:
+            self.searches.pop(self._expiry.popleft()[1], None)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = "r2g-stand-in/{}".format(r2g.__version__)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, content_type="text/html"):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "{}; charset=utf-8".format(content_type))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self):
+        split = urlsplit(self.path)
+        params = parse_qsl(split.query, keep_blank_values=True)
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length", 0))
+            params += parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+        return split.path, params
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        path, params = self._params()
+        server = self.server
+        if server.chance(server.error_rate):
+            server.count("error")
+            return self._send(ERROR_PAGE.format("Service unavailable (injected)."), status=503)
+        if path == "/portal/utils/autocomp.fcgi":
+            server.count("autocomp")
+            return self._send(self._autocomp(_get_param(params, "q", "")), content_type="text/javascript")
+        if path not in ["/Blast.cgi", "/blast/Blast.cgi"]:
+            return self._send(ERROR_PAGE.format("Not found."), status=404)
+        rid = _get_param(params, "RID", None)
+        if rid is not None:
+            server.count("poll")
+            return self._poll(rid, _get_param(params, "FORMAT_TYPE", "HTML"))
+        if self.command == "POST" or _get_param(params, "CMD", "") == "Put":
+            server.count("submit")
+            if _get_param(params, "QUERY", "").strip() == "":
+                return self._send(ERROR_PAGE.format("Message ID#32 Error: Query contains no sequence data"))
+            return self._send(self._wait_page(server.submit(params)))
+        server.count("form")
+        hidden = ''.join([
+            '<input name="{}" type="hidden" value="{}">'.format(escape(k), escape(v, {'"': "&quot;"}))
+            for k, v in params
+        ])
+        return self._send(FORM_PAGE.format(hidden=hidden))
+
+    @staticmethod
+    def _autocomp(sra):
+        resolved = _accession(sra)
+        if resolved is None:
+            entries = ""
+        else:
+            taxid, srx, srr = resolved
+            entries = '"{} ( taxid:{}; run:{})@{} {}     {}"'.format(
+                srx, taxid, ' '.join(srr), srx.lower(), taxid, ' '.join(srr).lower()
+            )
+        return 'NSuggest_CreateData("{}", new Array({}), 1);'.format(sra.lower(), entries)
+
+    @staticmethod
+    def _wait_page(search, status="WAITING", status_text="Searching", code="21", error=""):
+        return WAIT_PAGE.format(
+            rid=search["rid"],
+            rtoe=search["rtoe"],
+            job_title=escape(search["job_title"]),
+            entrez=escape(search["entrez"]),
+            max_num_seq=search["max_num_seq"],
+            status=status,
+            status_text=status_text,
+            code=code,
+            error=error
+        )
+
+    def _poll(self, rid, format_type):
+        with self.server.lock:
+            self.server._expire()
+            search = self.server.searches.get(rid, None)
+        if search is None:
+            return self._send(ERROR_PAGE.format("Results for RID {} not found".format(escape(rid))))
+        if time.time() < search["ready"]:
+            return self._send(self._wait_page(search))
+        if search["failed"]:
+            return self._send(self._wait_page(
+                search, "FAILED", "Failed", "63",
+                '<p class="error">Search {} failed (injected).</p>'.format(rid)
+            ))
+        if format_type.upper() != "XML":
+            return self._send(self._wait_page(search, "READY", "Ready", "43"))
+        return self._send(self._results(search), content_type="text/xml")
+
+    def _results(self, search):
+        rng = random.Random(search["rid"])
+        num_hits = min(self.server.hits, search["max_num_seq"]) if len(search["srr"]) > 0 else 0
+        parts = [XML_HEAD.format(
+            program=escape(search["program"]),
+            db=' '.join(search["srr"]),
+            rid=search["rid"],
+            job_title=escape(search["job_title"]),
+            query_len=sum([len(line.strip()) for line in search["query"].splitlines() if line[:1] != ">"]),
+        )]
+        for num in range(1, num_hits + 1):
+            parts.append(XML_HIT.format(
+                num=num,
+                accession="{}.{}.{}".format(rng.choice(search["srr"]), rng.randint(1, 50000000), rng.randint(1, 2)),
+                evalue=search["expect"]
+            ))
+        parts.append(XML_TAIL)
+        return ''.join(parts)
+
+
+def main(raw_args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m r2g.online.stand_in",
+        description="A stand-in for the NCBI BLAST services, for testing r2g without the real NCBI."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Default: 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8000, help="Default: 8000.")
+    parser.add_argument("--delay", type=float, default=30, help="Seconds every search takes. Default: 30.")
+    parser.add_argument("--jitter", type=float, default=0, help="Random variation of --delay in seconds. Default: 0.")
+    parser.add_argument("--rtoe", type=int, default=None,
+                        help="RTOE reported in wait pages. Default: the real delay of every search.")
+    parser.add_argument("--hits", type=int, default=1000,
+                        help="Hits returned by every search (no more than MAX_NUM_SEQ). Default: 1000.")
+    parser.add_argument("--fail_rate", type=float, default=0, help="Fraction of failed searches. Default: 0.")
+    parser.add_argument("--error_rate", type=float, default=0,
+                        help="Fraction of requests answered with HTTP 503. Default: 0.")
+    parser.add_argument("--ttl", type=float, default=3600,
+                        help="Seconds the results of a search are kept after they are ready. Default: 3600.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random numbers.")
+    args = parser.parse_args(raw_args)
+    server = StandInServer((args.host, args.port), delay=args.delay, jitter=args.jitter, rtoe=args.rtoe,
+                           hits=args.hits, fail_rate=args.fail_rate, error_rate=args.error_rate, ttl=args.ttl,
+                           seed=args.seed)
+    print("Serving a stand-in NCBI at {}. Press Ctrl+C to stop.".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
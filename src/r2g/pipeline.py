@@ -0,0 +1,354 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from r2g import utils
+from r2g import errors
+from r2g.online import blast
+from r2g.online import fetch
+from r2g.local import aligners
+from r2g.local import assemblers
+from r2g.local import dedup
+from r2g.utils import metrics
+from r2g.utils.journal import Journal
+
+
+def _make_outdir(outdir):
+    try:
+        utils.log("Trying to create the output folder: {}".format(outdir))
+        os.mkdir(outdir, 0o750)
+    except OSError:
+        utils.log("{} exists.".format(outdir))
+        if not os.access(outdir, os.W_OK):
+            raise errors.OutputError('{} is not writable.'.format(outdir))
+
+
+def _configure_metrics(args):
+    if args.get('metrics', None) is not None or args.get('prom_textfile', None) is not None:
+        metrics.configure(args.get('metrics', None), args.get('prom_textfile', None))
+
+
+def _flush_metrics():
+    try:
+        metrics.flush()
+    except OSError as err:
+        utils.log("WARNING: couldn't write the metrics to {}. {}".format(metrics.REGISTRY.prom_textfile, err))
+
+
+def _recruit(args, app_json, journal):
+    """Recruit reads from the local files, so NCBI isn't involved at all."""
+    recruited = journal.last("recruited")
+    if recruited is not None and all([os.path.isfile(f) for fs in recruited['files'].values() for f in fs]):
+        seq_name, fastq_list, paired = recruited['name'], recruited['files'], recruited['paired']
+        fd_outdir = recruited['outdir']
+        utils.log("Reads recruited by the last run were loaded from the journal {}.".format(journal.path))
+    else:
+        fd_outdir = os.path.join(args['outdir'], "local_output_{}".format(utils.stamp()))
+        utils.log("Creating a folder for recruited reads: {}".format(fd_outdir))
+        os.mkdir(fd_outdir, 0o750)
+        seq_name, fastq_list, paired = aligners.recruit(args, app_json, fd_outdir)
+        journal.write("recruited", name=seq_name, files=fastq_list, paired=paired, outdir=fd_outdir)
+    if len(fastq_list) == 0:
+        utils.log("None of the local reads were hit by the query.")
+    return {'name': seq_name, 'hits': None, 'reads': fastq_list, 'paired': paired, 'reads_dir': fd_outdir,
+            'cleanup': [fd_outdir]}
+
+
+def _query(args, app_json, journal, resources=None, on_hits=None):
+    """
+    Query NCBI, and pass the hits of every submission to on_hits as soon as it is done.
+    Return (the name of the query, {SRR: [(first, last), ...]}).
+    """
+    utils.log("{} against following databases:".format(args['program']))
+    seq_name, hits = None, {}
+    for seq_name, chunk_hits in blast.iter_query(args, app_json.get('chromedriver', None), journal, resources):
+        if len(chunk_hits) > 0 and on_hits is not None:
+            on_hits(blast._clear_up_list(chunk_hits))
+        for sra in chunk_hits.keys():
+            hits.setdefault(sra, []).extend(chunk_hits[sra])
+    if seq_name is None:
+        seq_name = blast._split_query(args)[0]
+    download_list = blast._clear_up_list(hits)
+    journal.write("query", name=seq_name, hits=download_list)
+    return seq_name, download_list
+
+
+def _query_and_fetch(args, app_json, journal, resources=None):
+    """Query NCBI, and download the reads hit by every submission while the other submissions are still running."""
+    # fd_outdir refers to the output folder for fastq-dump:
+    fetching = journal.last("fetch")
+    if fetching is not None and os.path.isdir(fetching['outdir']):
+        fd_stamp, fd_outdir = fetching['stamp'], fetching['outdir']
+        utils.log("Resuming downloading to the folder for fastq-dump: {}".format(fd_outdir))
+    else:
+        fd_stamp = utils.stamp()
+        fd_outdir = os.path.join(args['outdir'], "fastq-dump_output_{}".format(fd_stamp))
+        utils.log("Creating a folder for fastq-dump: {}".format(fd_outdir))
+        os.mkdir(fd_outdir, 0o750)
+        journal.write("fetch", stamp=fd_stamp, outdir=fd_outdir)
+    fd_log_file = os.path.join(args['outdir'], 'run_fastq-dump_{}.log'.format(fd_stamp))
+    with open(fd_log_file, 'a') as fd_log:
+        queried = journal.last("query")
+        if queried is not None:
+            seq_name = queried['name']
+            download_list = dict([(sra, [tuple(r) for r in ranges]) for sra, ranges in queried['hits'].items()])
+            utils.log("Hits found by the last run were loaded from the journal {}.".format(journal.path))
+            fastq_list, paired = fetch.fetch_all(download_list, app_json, fd_outdir, args, journal, fd_log)
+        else:
+            fetcher = fetch.Fetcher(app_json, fd_outdir, args, journal, fd_log)
+            try:
+                seq_name, download_list = _query(args, app_json, journal, resources, fetcher.add)
+            except BaseException:
+                fetcher.close()
+                raise
+            fastq_list, paired = fetch.collect_fastq(fetcher.finish())
+    if len(download_list) == 0:
+        utils.log("NCBI hasn't return any valid hits blasting against {}. "
+                  "Don't panic, maybe you can try another SRA database instead.".format(args['sra']))
+    return {'name': seq_name, 'hits': download_list, 'reads': fastq_list, 'paired': paired, 'reads_dir': fd_outdir,
+            'cleanup': [fd_log_file, fd_outdir]}
+
+
+def _assemble(args, app_json, journal, found, assembly_lock=None):
+    """Assemble the reads with Trinity. Return the final result, or None if it stopped before Trinity."""
+    fastq_list = found['reads']
+    if args['dedup']:
+        deduplicated = journal.last("deduplicated")
+        if deduplicated is not None and all([os.path.isfile(f) for fs in deduplicated['files'].values()
+                                             for f in fs]):
+            fastq_list = deduplicated['files']
+        else:
+            fastq_list, _ = dedup.dedup_reads(fastq_list, found['paired'], found['reads_dir'], args['CPU'])
+            journal.write("deduplicated", files=fastq_list)
+        found['reads'] = fastq_list
+    if args['stage'] == "no_trinity":
+        utils.log('R2g stopped without the assembly stage as you requested.')
+        utils.log('All valid sequencing reads were saved in {}.'.format(found['reads_dir']))
+        return None
+    assembled = journal.last("assembled")
+    if assembled is not None and os.path.exists(assembled['result']):
+        utils.log("The assembly was finished by the last run: {}.".format(assembled['result']))
+        return assembled['result']
+    if assembly_lock is not None:
+        # Trinity uses all the CPUs it is given, so assemblies of different genes don't run at once:
+        assembly_lock.acquire()
+    try:
+        utils.log("Calling Trinity.")
+        # Trinity carries on from its own checkpoints if its output folder is reused:
+        assembling = journal.last("assembly")
+        trinity = assemblers.Trinity(args, app_json, fastq_list, found['paired'],
+                                     output=assembling['output'] if assembling is not None else None)
+        journal.write("assembly", output=trinity.output)
+        trinity_dir, trinity_log_file = trinity.run()
+    finally:
+        if assembly_lock is not None:
+            assembly_lock.release()
+    if args['stage'] == 'chrysalis' or args['stage'] == 'butterfly':
+        final_result = os.path.join(args['outdir'], "{}.homologs.{}.fasta".format(found['name'], utils.stamp()))
+        found['cleanup'].append(trinity_dir)
+        utils.log("The final assembled homologous gene was written to {}.".format(final_result))
+    else:
+        final_result = os.path.join(args['outdir'], "r2g_results-{}.{}".format(args['stage'], utils.stamp()))
+        utils.log('R2g stopped at the stage "{}" as you requested.'.format(args['stage']))
+        utils.log("The final results are in the folder {}.".format(final_result))
+    found['cleanup'].append(trinity_log_file)
+    trinity.copyto(final_result)
+    journal.write("assembled", result=final_result)
+    return final_result
+
+
+class Pipeline:
+    """
+    The r2g pipeline for one query, run in the same process without the command line, e.g.
+
+        from r2g.pipeline import Pipeline
+        with Pipeline(query="ATGC...", sra="SRX885420", outdir="OUTPUT") as pipe:
+            found = pipe.run()
+
+    or stage by stage with pipe.blast(), pipe.fetch() and pipe.assemble(). The arguments are either `args` as
+    returned by utils.parse_arguments, or options named as in the command line (see utils.default_arguments),
+    including mode="local". The paths to the apps are read from the config files if app_json isn't given.
+    Resources opened by blast.open_resources (browser sessions, the rate limiter, caches...) can be shared by many
+    pipelines, and they are left open.
+    Errors are raised from r2g.errors instead of exiting.
+    """
+
+    def __init__(self, args=None, app_json=None, resources=None, assembly_lock=None, **options):
+        if args is None:
+            args = utils.default_arguments(options.pop('mode', "online"), **options)
+        else:
+            args = dict(args, **options)
+        if args['mode'] == "batch":
+            raise errors.InputError("A pipeline finds the homologs of one query. Use run_batch for many genes.")
+        self.args = args
+        _configure_metrics(args)
+        self.app_json = utils.preflight(args, interactive=False) if app_json is None else app_json
+        self.resources = resources
+        self.assembly_lock = assembly_lock
+        self.found = None
+        self._journal = None
+        self._opened = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def journal(self):
+        if self._journal is None:
+            _make_outdir(self.args['outdir'])
+            # Stages run after the journal was closed carry on from it:
+            self._journal = Journal(self.args['outdir'], resume=self.args['resume'] or self._opened)
+            self._opened = True
+        return self._journal
+
+    def blast(self):
+        """Query NCBI only. Return (the name of the query, {SRR: [(first, last), ...]})."""
+        if self.args['mode'] == "local":
+            raise errors.InputError("The local mode doesn't query NCBI. Call fetch() to recruit the reads instead.")
+        queried = self.journal.last("query")
+        if queried is not None:
+            return queried['name'], dict([(sra, [tuple(r) for r in ranges]) for sra, ranges in queried['hits'].items()])
+        return _query(self.args, self.app_json, self.journal, self.resources)
+
+    def fetch(self, hits=None):
+        """
+        Download the reads hit by blast(), or by `hits` = {SRR: [(first, last), ...]} if given. Without either, the
+        reads are downloaded while NCBI is still being queried. In the local mode, the reads are recruited from the
+        local files instead. Return the reads as {'1': [fastq, ...], '2': [...]}.
+        """
+        if self.args['mode'] == "local":
+            self.found = _recruit(self.args, self.app_json, self.journal)
+        else:
+            if hits is not None:
+                self.journal.write("query", name=blast._split_query(self.args)[0], hits=blast._clear_up_list(hits))
+            self.found = _query_and_fetch(self.args, self.app_json, self.journal, self.resources)
+        self.found['result'] = None
+        return self.found['reads']
+
+    def assemble(self):
+        """Assemble the reads fetched, fetching them first if needed. Return the final result, or None."""
+        if self.found is None:
+            self.fetch()
+        if len(self.found['reads']) > 0:
+            self.found['result'] = _assemble(self.args, self.app_json, self.journal, self.found, self.assembly_lock)
+            # Clean up:
+            if self.args['cleanup']:
+                utils.log("A little bit of housekeeping work...")
+                utils.delete_everything(self.found['cleanup'])
+                self.found['cleanup'] = []
+        self.journal.write("done")
+        return self.found['result']
+
+    def run(self):
+        """
+        Run all stages, i.e. recruit reads from local files (the local mode) or query NCBI and fetch the reads, and
+        then assemble them by Trinity. Everything finished is recorded in the journal, so an interrupted run can be
+        resumed. Return {'name': ..., 'hits': {SRR: [(first, last), ...]}, 'reads': fastq_list, 'paired': ...,
+        'reads_dir': ..., 'result': ...}.
+        """
+        try:
+            self.assemble()
+        finally:
+            self.close()
+        return self.results()
+
+    def results(self):
+        if self.found is None:
+            return None
+        return dict([(k, v) for k, v in self.found.items() if k != 'cleanup'])
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            _flush_metrics()
+
+
+def run(args, app_json, resources=None, assembly_lock=None):
+    """Run the whole pipeline for one query, as parsed by utils.parse_arguments. See Pipeline.run."""
+    return Pipeline(args, app_json, resources, assembly_lock).run()
+
+
+def _read_genes(path):
+    """Read a multi-FASTA file of genes. Return [(name, ">name\nseq"), ...], where names can be used as folders."""
+    with open(path, 'r') as inf:
+        fasta = inf.read().strip().lstrip('>').split('\n>')
+    genes, names = [], {}
+    for fa in fasta:
+        fa = fa.split('\n', 1)
+        if len(fa) < 2 or len(fa[0].split()) == 0 or len(''.join(fa[1].split())) == 0:
+            continue
+        name = re.sub(r'[^\w.-]', '_', fa[0].split()[0])
+        names[name] = names.get(name, 0) + 1
+        if names[name] > 1:
+            name = "{}_{}".format(name, names[name])
+        genes.append((name, ">{}\n{}".format(name, ''.join(fa[1].split()))))
+    return genes
+
+
+def _run_gene(args, app_json, resources, assembly_lock):
+    start = time.time()
+    row = {'gene': args['gene'], 'status': "done", 'srr': 0, 'spots': 0, 'reads': 0, 'result': "", 'seconds': 0}
+    try:
+        found = run(args, app_json, resources, assembly_lock)
+    except Exception as err:
+        utils.log("WARNING: couldn't find the homologs of {}. {}".format(args['gene'], err))
+        row['status'] = "failed: {}".format(' '.join(str(err).split()))
+    else:
+        hits = found['hits'] if found['hits'] is not None else {}
+        row['srr'] = len(hits)
+        row['spots'] = sum([last - first + 1 for ranges in hits.values() for first, last in ranges])
+        row['reads'] = sum([len(fs) for fs in found['reads'].values()])
+        row['result'] = found['result'] if found['result'] is not None else ""
+        if len(found['reads']) == 0:
+            row['status'] = "no hits"
+    row['seconds'] = round(time.time() - start, 1)
+    return row
+
+
+SUMMARY_COLUMNS = ['gene', 'status', 'srr', 'spots', 'reads', 'result', 'seconds']
+
+
+def run_batch(args, app_json):
+    """
+    Run the pipeline for every gene in the multi-FASTA file args['query'], `genes` of them at once. Browser sessions,
+    the rate limiter, SRA accessions and caches are shared by all genes, and every gene is written to its own folder
+    in args['outdir']. Return the rows of the summary table, which is written to summary.tsv as well.
+    """
+    genes = _read_genes(args['query'])
+    if len(genes) == 0:
+        raise errors.InputError("No genes were found in {}.".format(args['query']))
+    _make_outdir(args['outdir'])
+    _configure_metrics(args)
+    utils.log("Finding the homologs of {} gene(s), {} at once.".format(len(genes), args['genes']))
+    resources = blast.open_resources(args, app_json.get('chromedriver', None))
+    assembly_lock = threading.Lock()
+    rows = {}
+    try:
+        with ThreadPoolExecutor(max_workers=args['genes']) as executor:
+            futures = {}
+            for name, seq in genes:
+                gene_args = dict(args, mode="online", query=seq, gene=name,
+                                 outdir=os.path.join(args['outdir'], name))
+                futures[executor.submit(_run_gene, gene_args, app_json, resources, assembly_lock)] = name
+            for future in as_completed(futures):
+                rows[futures[future]] = future.result()
+                utils.log("{} of {} gene(s) finished: {} ({}).".format(
+                    len(rows), len(genes), futures[future], rows[futures[future]]['status']
+                ))
+    finally:
+        blast.close_resources(resources)
+        _flush_metrics()
+    rows = [rows[name] for name, _ in genes]
+    summary = os.path.join(args['outdir'], "summary.tsv")
+    with open(summary, 'w') as outf:
+        outf.write('\t'.join(SUMMARY_COLUMNS) + '\n')
+        for row in rows:
+            outf.write('\t'.join([str(row[c]) for c in SUMMARY_COLUMNS]) + '\n')
+    utils.log("The summary of all genes was written to {}.".format(summary))
+    return rows
@@ -5,17 +5,16 @@ import argparse
 import json
 import os
 import sys
-import platform
-import subprocess
 import time
 import shutil
 import re
+import tempfile
 from copy import deepcopy
-from multiprocessing import cpu_count
 
 import r2g
 from r2g import errors
 from r2g.utils.dryrun import DryRunAction
+from r2g.utils.taxonomy import TaxonomyAction
 
 
 def log(info, verbose=False, attr='info', shift=""):
@@ -73,12 +72,7 @@ def processing(current, total, info, mode="fraction"):
     sys.stdout.flush()
 
 
-def parse_arguments(raw_args):
-    r2g_script = raw_args[0]
-    parser = argparse.ArgumentParser(
-        prog=r2g.__title__,
-        description=r2g.__description__
-    )
+def _add_general_arguments(parser, r2g_script):
     parser.add_argument("-V", "--version",
                         help="Print the version.",
                         action="version",
@@ -106,6 +100,92 @@ def parse_arguments(raw_args):
                         metavar="DIR",
                         default=os.getcwd()
                         )
+    parser.add_argument("--resume",
+                        help="Resume an interrupted run from the journal in the output directory. "
+                             "Finished queries, downloads and assemblies are skipped, and submitted queries are "
+                             "polled again instead of being submitted again.",
+                        action="store_true",
+                        default=False
+                        )
+    parser.add_argument("--metrics",
+                        help="Append counters and timings of every stage (NCBI submissions, polls, fastq-dump, "
+                             "Trinity...) to a file in the JSON lines format as they are recorded.",
+                        default=None,
+                        metavar="FILE"
+                        )
+    parser.add_argument("--prom_textfile",
+                        help="Write the totals of the metrics to a textfile for the textfile collector of "
+                             "Prometheus' node-exporter, e.g. /var/lib/node_exporter/r2g.prom.",
+                        default=None,
+                        metavar="FILE"
+                        )
+    parser.add_argument("--dry-run",
+                        help="A quick dry run to test if the r2g has been installed properly.",
+                        action=DryRunAction,
+                        r2g_script=r2g_script
+                        )
+    parser.add_argument("--build-taxonomy",
+                        help="Rebuild the taxonomy index used to name species from names.dmp in NCBI's taxdump "
+                             "(https://ftp.ncbi.nlm.nih.gov/pub/taxonomy/), and exit.",
+                        action=TaxonomyAction
+                        )
+
+
+def _add_trinity_arguments(parser):
+    trinity = parser.add_argument_group("Trinity options")
+    trinity.add_argument("-t", "--CPU",
+                         help="Number of CPU threads to use. Default: {}.".format(os.cpu_count()),
+                         default=os.cpu_count(),
+                         type=int,
+                         metavar="INT"
+                         )
+    trinity.add_argument("--max_memory",
+                         help='Suggest max Gb of memory to use by Trinity. Default: 4G.',
+                         type=str.upper,
+                         metavar="RAM",
+                         default="4G"
+                         )
+    trinity.add_argument("--min_contig_length",
+                         help="Minimum assembled contig length to report. Default: 150.",
+                         default=150,
+                         type=int,
+                         metavar="INT"
+                         )
+    # Doesn't work in Trinity >2.6.6 or <1.10.0:
+    # trinity.add_argument("-k", "--KMER_SIZE",
+    #                      help="K-mer size for Trinity, maximum: 32, default: 25.",
+    #                      default=25,
+    #                      type=int,
+    #                      metavar="INT"
+    #                      )
+    trinity.add_argument("--trim",
+                         help="Run Trimmomatic to qualify and trim reads. "
+                              "Using this option without any parameters will trigger preset settings in Trinity for "
+                              "Trimmomatic. See Trinity for more help. Default: disabled.",
+                         nargs="?",
+                         default=False,
+                         metavar="TRIM_PARAM"
+                         )
+    trinity.add_argument("--dedup",
+                         help="Remove duplicated reads, i.e. spots fetched more than once or with the same sequences, "
+                              "before they are fed to Trinity.",
+                         action="store_true"
+                         )
+    trinity.add_argument("--stage",
+                         help="Stop Trinity after the stage you chose. Default: butterfly (the final stage).",
+                         choices=["no_trinity", "jellyfish", "inchworm", "chrysalis", "butterfly"],
+                         default="butterfly",
+                         type=str.lower
+                         )
+
+
+def _online_parser(raw_args, prog=None, description=None, epilog=None):
+    parser = argparse.ArgumentParser(
+        prog=r2g.__title__ if prog is None else prog,
+        description=r2g.__description__ if description is None else description,
+        epilog=epilog
+    )
+    _add_general_arguments(parser, raw_args[0])
     parser.add_argument("-W", "--browser",
                         help="Temporarily overwrite the local path or the remote address of the chrome webdriver. "
                              "E.g., /path/to/chromedriver or http://127.0.0.1:4444/wd/hub",
@@ -118,13 +198,7 @@ def parse_arguments(raw_args):
                         metavar='SCHEME://IP:PORT',
                         default=None
                         )
-    parser.add_argument("--dry-run",
-                        help="A quick dry run to test if the r2g has been installed properly.",
-                        action=DryRunAction,
-                        r2g_script=r2g_script
-                        )
-    # 1. Online mode:
-    # 1.1 NCBI options:
+    # NCBI options:
     ncbi = parser.add_argument_group("NCBI options")
     ncbi.add_argument("-s", "--sra",
                       help='Choose SRA accessions (comma-separated without blank space). '
@@ -162,82 +236,319 @@ def parse_arguments(raw_args):
                       default=None,
                       metavar="FRAGMENT,OVERLAP"
                       )
-    # 1.2 Trinity options:
-    trinity = parser.add_argument_group("Trinity options")
-    trinity.add_argument("-t", "--CPU",
-                         help="Number of CPU threads to use. Default: {}.".format(cpu_count()),
-                         default=cpu_count(),
-                         type=int,
-                         metavar="INT"
+    ncbi.add_argument("-J", "--parallel",
+                      help="Number of BLAST queries (RIDs) kept in flight at NCBI at once. "
+                           "NCBI is still contacted no more than once every 10 seconds in total. Default: 3.",
+                      type=int,
+                      default=3,
+                      metavar="INT"
+                      )
+    ncbi.add_argument("--pack",
+                      help="Search several SRA experiments in one submission: none (one experiment per submission), "
+                           "species (experiments of the same species together), or all. Default: none.",
+                      choices=["none", "species", "all"],
+                      default="none",
+                      type=str.lower
+                      )
+    ncbi.add_argument("--cache",
+                      help="A folder to cache BLAST results in, so repeated queries don't have to be submitted "
+                           "again. Default: {}".format(os.path.join(os.path.expanduser('~'), ".r2g.cache")),
+                      default=os.path.join(os.path.expanduser('~'), ".r2g.cache"),
+                      metavar="DIR"
+                      )
+    ncbi.add_argument("--cache_size",
+                      help="Maximum size of the cache in megabytes. The least recently used results are removed "
+                           "first. Set it to 0 to disable caching. Default: 1024.",
+                      type=float,
+                      default=1024,
+                      metavar="MB"
+                      )
+    ncbi.add_argument("--cache_age",
+                      help="Maximum age of cached results in days. Default: 30.",
+                      type=float,
+                      default=30,
+                      metavar="DAYS"
+                      )
+    ncbi.add_argument("--ncbi_url",
+                      help="Send BLAST requests to another server that works like NCBI, e.g. a stand-in server "
+                           "started by `python -m r2g.online.stand_in` for testing. "
+                           "Default: $R2G_NCBI_URL or https://blast.ncbi.nlm.nih.gov.",
+                      default=None,
+                      metavar="URL"
+                      )
+    # Fetch options:
+    fetching = parser.add_argument_group("Fetch options")
+    fetching.add_argument("--fetch_jobs",
+                          help="Number of fastq-dump processes run at once to download hits. Default: 4.",
+                          type=int,
+                          default=4,
+                          metavar="INT"
+                          )
+    fetching.add_argument("--launch_cost",
+                          help="Estimated seconds of starting a fastq-dump process. Nearby spot ranges are fetched "
+                               "by one process, when reading the spots between them is cheaper. Default: 2.0.",
+                          type=float,
+                          default=2.0,
+                          metavar="SEC"
+                          )
+    fetching.add_argument("--spot_cost",
+                          help="Estimated seconds of reading a spot by fastq-dump. Default: 0.0002.",
+                          type=float,
+                          default=0.0002,
+                          metavar="SEC"
+                          )
+    fetching.add_argument("--spot_store",
+                          help="A folder to keep downloaded reads in, so spots hit again by other genes or runs are "
+                               "read from there instead of SRA. It can be shared by runs at the same time on Linux "
+                               "and macOS. Default: not used.",
+                          default=None,
+                          metavar="DIR"
+                          )
+    fetching.add_argument("--spot_store_size",
+                          help="Maximum size of the spot store in megabytes. The least recently used reads are "
+                               "removed first. Default: 10240.",
+                          type=float,
+                          default=10240,
+                          metavar="MB"
+                          )
+    fetching.add_argument("--sra_mirror",
+                          help="A folder of local SRA files, e.g. SRR1812889.sra, SRR1812889.sralite, or "
+                               "SRR1812889/SRR1812889.sra. Spots are read from these files instead of the network "
+                               "if they are found. Default: not used.",
+                          default=None,
+                          metavar="DIR"
+                          )
+    fetching.add_argument("--prefetch",
+                          help="Download the SRA files that are not in the mirror (see --sra_mirror) by prefetch "
+                               "first, and then read spots from them locally.",
+                          action="store_true"
+                          )
+    fetching.add_argument("--compress",
+                          help="Write the downloaded reads in block-gzipped FASTQ files (.fastq.gz), compressed by "
+                               "as many threads as --CPU, which Trinity reads directly.",
+                          action="store_true"
+                          )
+    # Trinity options:
+    _add_trinity_arguments(parser)
+    return parser
+
+
+def _check_online_arguments(args_dict):
+    if args_dict['prefetch'] and args_dict['sra_mirror'] is None:
+        raise errors.InputError("The option --prefetch needs a folder to download SRA files to by --sra_mirror.")
+    if args_dict['sra_mirror'] is not None:
+        args_dict['sra_mirror'] = os.path.abspath(os.path.expanduser(args_dict['sra_mirror']))
+    return args_dict
+
+
+def _parse_online_arguments(raw_args):
+    parser = _online_parser(
+        raw_args,
+        epilog='Run "{0} local --help" to recruit reads from local files instead of NCBI, or "{0} batch --help" '
+               'to find many genes in one run.'.format(r2g.__title__)
+    )
+    parser.set_defaults(mode="online")
+    args_dict = vars(parser.parse_args(raw_args[1:]))  # dict
+    return _check_online_arguments(args_dict)
+
+
+def _batch_parser(raw_args):
+    parser = _online_parser(
+        raw_args,
+        prog="{} batch".format(r2g.__title__),
+        description="Find the homologs of every gene in a multi-FASTA file (-q) in the same SRA experiments. "
+                    "Browser sessions, SRA accessions and caches are shared by all genes, and the results of every "
+                    "gene are written to its own folder in the output folder, with a summary table (summary.tsv)."
+    )
+    batch = parser.add_argument_group("Batch options")
+    batch.add_argument("--genes",
+                       help="Number of genes processed at once. Trinity assembles one gene at a time. Default: 2.",
+                       type=int,
+                       default=2,
+                       metavar="INT"
+                       )
+    parser.set_defaults(mode="batch")
+    return parser
+
+
+def _check_batch_arguments(args_dict):
+    if not os.path.isfile(args_dict['query']):
+        raise errors.InputError("The batch mode needs a multi-FASTA file of genes (-q), but got: {}".format(
+            args_dict['query']
+        ))
+    args_dict['query'] = os.path.abspath(args_dict['query'])
+    args_dict['genes'] = max(1, args_dict['genes'])
+    return _check_online_arguments(args_dict)
+
+
+def _parse_batch_arguments(raw_args):
+    args_dict = vars(_batch_parser(raw_args).parse_args(raw_args[2:]))  # dict
+    return _check_batch_arguments(args_dict)
+
+
+def _local_parser(raw_args):
+    parser = argparse.ArgumentParser(
+        prog="{} local".format(r2g.__title__),
+        description="Recruit reads from local FASTQ or SRA files with a local aligner instead of querying NCBI, "
+                    "and then assemble them into the homologous gene."
+    )
+    _add_general_arguments(parser, raw_args[0])
+    # Aligner options:
+    aligner = parser.add_argument_group("Aligner options")
+    aligner.add_argument("-q", "--query",
+                         help="Submit either a FASTA file or nucleotide sequences.",
+                         required=True,
+                         metavar="SEQUENCE"
                          )
-    trinity.add_argument("--max_memory",
-                         help='Suggest max Gb of memory to use by Trinity. Default: 4G.',
-                         type=str.upper,
-                         metavar="RAM",
-                         default="4G"
+    aligner.add_argument("-p", "--program",
+                         help="Specify a BLAST program: tblastn, tblastx, or "
+                              "blastn (including megablast, blastn, and discomegablast). Default: blastn.",
+                         choices=["megablast", "blastn", "discomegablast", "tblastn", "tblastx"],
+                         default="blastn",
+                         metavar="BLAST"
                          )
-    trinity.add_argument("--min_contig_length",
-                         help="Minimum assembled contig length to report. Default: 150.",
-                         default=150,
+    aligner.add_argument("--aligner",
+                         help="Choose a program to align reads to the query: blast (BLAST+), "
+                              "diamond (DIAMOND, for tblastn only), or kmer (the built-in k-mer recruiter "
+                              "for nucleotide queries, which needs NumPy). Default: blast.",
+                         choices=["blast", "diamond", "kmer"],
+                         default="blast",
+                         type=str.lower
+                         )
+    aligner.add_argument("--kmer_size",
+                         help="K-mer size for the k-mer recruiter, maximum: 31. Default: 25.",
                          type=int,
+                         default=25,
                          metavar="INT"
                          )
-    # Doesn't work in Trinity >2.6.6 or <1.10.0:
-    # trinity.add_argument("-k", "--KMER_SIZE",
-    #                      help="K-mer size for Trinity, maximum: 32, default: 25.",
-    #                      default=25,
-    #                      type=int,
-    #                      metavar="INT"
-    #                      )
-    trinity.add_argument("--trim",
-                         help="Run Trimmomatic to qualify and trim reads. "
-                              "Using this option without any parameters will trigger preset settings in Trinity for "
-                              "Trimmomatic. See Trinity for more help. Default: disabled.",
-                         nargs="?",
-                         default=False,
-                         metavar="TRIM_PARAM"
+    aligner.add_argument("-e", "--evalue",
+                         default=1e-3,
+                         help="Expected number of chance matches in a random model. Default: 1e-3.",
+                         metavar="FLOAT"
                          )
-    trinity.add_argument("--stage",
-                         help="Stop Trinity after the stage you chose. Default: butterfly (the final stage).",
-                         choices=["no_trinity", "jellyfish", "inchworm", "chrysalis", "butterfly"],
-                         default="butterfly",
-                         type=str.lower
+    aligner.add_argument("-c", "--cut",
+                         help="Cut sequences and align them respectively to prevent weaker matches from being "
+                              "ignored. Default: 70,20 (nucleotides), or 24,7 (amino acids)",
+                         default=None,
+                         metavar="FRAGMENT,OVERLAP"
                          )
-    # TODO:
-    # 2. Local mode:
-    #    local = subparser.add_parser("local")
-    #    local.add_argument("-q", "--query",
-    #                       help="Submit either a FASTA file or nucleotide sequences.",
-    #                       required=True,
-    #                       metavar="SEQUENCE")
-    #    local.add_argument("-o", "--outdir",
-    #                       help="Specify an output directory.",
-    #                       metavar="DIR",
-    #                       default=os.getcwd())
-    #
-    #    # 2.1 Aligner:
-    #    aligner = local.add_argument_group("Aligner options")
-    #    aligner.add_argument("--aligner",
-    #                         help="Choose a program to align sequences, default: blastx",
-    #                         default="blastx",
-    #                         type=str.lower)
-    # End of TODO
+    # Read options:
+    reads = parser.add_argument_group("Read options")
+    reads.add_argument("--left",
+                       help="Left reads of paired-end libraries, in FASTQ (or gzipped FASTQ) format "
+                            "(comma-separated without blank space).",
+                       default=None,
+                       metavar="FASTQ"
+                       )
+    reads.add_argument("--right",
+                       help="Right reads of paired-end libraries in the same order as --left.",
+                       default=None,
+                       metavar="FASTQ"
+                       )
+    reads.add_argument("--single",
+                       help="Single-end reads in FASTQ (or gzipped FASTQ) format.",
+                       default=None,
+                       metavar="FASTQ"
+                       )
+    reads.add_argument("--sra_files",
+                       help="SRA files (*.sra) on the disk. They will be converted by fastq-dump.",
+                       default=None,
+                       metavar="SRA"
+                       )
+    # Trinity options:
+    _add_trinity_arguments(parser)
+    parser.set_defaults(mode="local")
+    return parser
+
+
+def _check_local_arguments(args_dict):
+    for option in ["left", "right", "single", "sra_files"]:
+        if args_dict[option] is None:
+            args_dict[option] = []
+        else:
+            if not isinstance(args_dict[option], list):
+                args_dict[option] = args_dict[option].split(',')
+            args_dict[option] = [os.path.abspath(os.path.expanduser(f)) for f in args_dict[option]]
+            for f in args_dict[option]:
+                if not os.path.isfile(f):
+                    raise errors.InputError("No such file: {}".format(f))
+    if len(args_dict["left"]) != len(args_dict["right"]):
+        raise errors.InputError("The options --left and --right must list the same number of files.")
+    if len(args_dict["left"] + args_dict["single"] + args_dict["sra_files"]) == 0:
+        raise errors.InputError("No reads to align. Please specify --left/--right, --single, or --sra_files.")
+    if args_dict["aligner"] == "diamond" and args_dict["program"] != "tblastn":
+        raise errors.InputError("DIAMOND only aligns reads to protein queries. Please use it with -p tblastn.")
+    if args_dict["aligner"] == "kmer" and args_dict["program"] in ["tblastn", "tblastx"]:
+        raise errors.InputError("The k-mer recruiter only works with nucleotide queries.")
+    if not 0 < args_dict["kmer_size"] <= 31:
+        raise errors.InputError("The option --kmer_size must be between 1 and 31.")
+    return args_dict
 
-    args_dict = vars(parser.parse_args(raw_args[1:]))  # dict
+
+def _parse_local_arguments(raw_args):
+    args_dict = vars(_local_parser(raw_args).parse_args(raw_args[2:]))  # dict
+    return _check_local_arguments(args_dict)
+
+
+def parse_arguments(raw_args):
+    if len(raw_args) > 1 and raw_args[1] == "local":
+        args_dict = _parse_local_arguments(raw_args)
+    elif len(raw_args) > 1 and raw_args[1] == "batch":
+        args_dict = _parse_batch_arguments(raw_args)
+    else:
+        args_dict = _parse_online_arguments(raw_args)
+    return _finish_arguments(args_dict)
+
+
+def default_arguments(mode="online", **options):
+    """
+    Build the arguments of r2g without parsing the command line, e.g. to run r2g from Python. The mode is "online",
+    "local" or "batch", and options are named as in the command line, e.g. default_arguments(query="ATGC...",
+    sra="SRX885420", outdir="OUTPUT"). Options not given take their default values.
+    """
+    parsers = {"online": _online_parser, "local": _local_parser, "batch": _batch_parser}
+    required = {"online": ["query", "sra"], "local": ["query"], "batch": ["query", "sra"]}
+    if mode not in parsers:
+        raise errors.InputError("Unknown mode: {}. Choose one of online, local and batch.".format(mode))
+    for option in required[mode]:
+        if options.get(option, None) is None:
+            raise errors.InputError("The option {} is required.".format(option))
+    # Only the required options are parsed, so all the others take their defaults, converted by their types like
+    # in the command line. Their values are placeholders replaced by the options given:
+    parser = parsers[mode]([r2g.__title__])
+    args_dict = vars(parser.parse_args(["--{}=_".format(option) for option in required[mode]]))
+    args_dict['mode'] = mode
+    unknown = sorted(set(options.keys()) - set(args_dict.keys()))
+    if len(unknown) > 0:
+        raise errors.InputError("Unknown option(s): {}.".format(', '.join(unknown)))
+    args_dict.update(options)
+    args_dict['outdir'] = os.path.abspath(os.path.expanduser(args_dict['outdir']))
+    if mode == "local":
+        args_dict = _check_local_arguments(args_dict)
+    elif mode == "batch":
+        args_dict = _check_batch_arguments(args_dict)
+    else:
+        args_dict = _check_online_arguments(args_dict)
+    return _finish_arguments(args_dict)
+
+
+def _finish_arguments(args_dict):
     try:
         args_dict['retry'] = int(args_dict['retry'])
     except TypeError:
         args_dict['retry'] = float('inf')
+    for option in ['metrics', 'prom_textfile']:
+        if args_dict[option] is not None:
+            args_dict[option] = os.path.abspath(os.path.expanduser(args_dict[option]))
     # Detect if it is in a docker:
     try:
-        _ = re.search(r'docker', bytes2str(
-            subprocess.check_output(["cat", "/proc/self/cgroup"], stderr=subprocess.STDOUT)
-        )).group()
+        with open("/proc/self/cgroup", 'r') as inf:
+            _ = re.search(r'docker', inf.read()).group()
     except Exception:
         args_dict['docker'] = False
         # The options "--proxy" and "--browser" are valid only if not in a docker:
         # format proxies:
-        if args_dict['proxy'] is not None:
+        if args_dict.get('proxy', None) is not None:
             args_dict['proxy'] = args_dict['proxy'].strip('"').strip("'")
             try:
                 scheme = re.search(r'([\w\d]+)://\d{1,3}\.', args_dict['proxy']).group(1)
@@ -262,6 +573,7 @@ def parse_arguments(raw_args):
                 "https": args_dict['proxy']
             }
         else:
+            args_dict['proxy'] = None
             args_dict['chrome_proxy'] = None
             args_dict['firefox_proxy'] = None
     else:
@@ -314,8 +626,62 @@ def _input_webdriver_dir():
     return input("Input the local directory or the remote address (ip:port) of webdriver: ")
 
 
-def preflight(args):
-    """Pre-flight check and configure"""
+PREFLIGHT_CACHE = os.path.join(os.path.expanduser('~'), ".r2g.preflight.json")
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_mode]
+
+
+def _preflight_fingerprint(args, config_files):
+    """Everything but the apps themselves that the apps found by preflight depend on."""
+    return {
+        'local': args.get('mode', 'online') == 'local',
+        'browser': args.get("browser", None) if args.get("docker", False) is False else None,
+        'private_webdriver': os.environ.get("PRIVATE_WEBDRIVER", None),
+        'path': os.environ.get("PATH", None),
+        'config_files': [[cfg, _stat(cfg)] for cfg in config_files],
+    }
+
+
+def _load_preflight_cache(fingerprint):
+    """Return the apps checked by the last run if nothing they depend on has changed since, or None."""
+    try:
+        cached = file2json(PREFLIGHT_CACHE)
+        if cached['fingerprint'] != fingerprint:
+            return None
+        for app, path in cached['app_json'].items():
+            if _stat(path) != cached['stats'][app]:
+                return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return cached['app_json']
+
+
+def _save_preflight_cache(fingerprint, app_json):
+    cached = {
+        'fingerprint': fingerprint,
+        'app_json': app_json,
+        'stats': dict([(app, _stat(path)) for app, path in app_json.items()]),
+    }
+    # Another run may read it at any time, so it is replaced at once:
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.split(PREFLIGHT_CACHE)[0])
+        with os.fdopen(fd, 'w') as outf:
+            json.dump(cached, outf, indent=4, separators=(',', ': '))
+        os.replace(tmp, PREFLIGHT_CACHE)
+    except OSError:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def preflight(args, interactive=True):
+    """Pre-flight check and configure. Unless interactive, raise InputError instead of asking for missing apps."""
 
     def _check_app(path, app):
         """Check if the app exists and is executable"""
@@ -379,6 +745,8 @@ def preflight(args):
         for item in app_json.items():
             path_app = _check_app(item[1], item[0])
             formatted_app_json[item[0]] = path_app
+        if formatted_app_json == app_json:
+            return formatted_app_json
         try:
             with open(config_file, 'w') as outf:
                 json.dump(
@@ -430,21 +798,26 @@ def preflight(args):
             'accessible file: "{}"'.format(args['query'])
         )
 
-    system = platform.system().lower()
-    if system[:3] == 'win':
-        find = 'where'  # Windows
+    if args.get('mode', 'online') == 'local':
+        # No webdriver is needed without NCBI:
+        app_json = {}.fromkeys(['fastq-dump', "Trinity"])
     else:
-        find = 'which'  # including Linux and Darwin
-    app_json = {}.fromkeys(['fastq-dump', 'chromedriver', "Trinity"])
+        app_json = {}.fromkeys(['fastq-dump', 'chromedriver', "Trinity"])
     checked = []
     config_files = [
         os.path.abspath(os.path.join(r2g.__path__[0], "path.json")),
         os.path.abspath(os.path.join(os.path.expanduser('~'), ".r2g.path.json"))
     ]
     log(config_files, args['verbose'], 'debug')
+    fingerprint = _preflight_fingerprint(args, config_files)
+    cached = _load_preflight_cache(fingerprint)
+    if cached is not None:
+        log("Applying the apps checked by the last run: {}".format(PREFLIGHT_CACHE), args['verbose'], 'debug')
+        return cached
+    need_save = False
     for cfg in config_files:
         checked.append(_check_config(cfg))
-        log("Check config files: {} - {}".format(cfg, _check_config(cfg)), args['verbose'], 'debug')
+        log("Check config files: {} - {}".format(cfg, checked[-1]), args['verbose'], 'debug')
     if checked[0][0] is False:
         app_json = _reformat_config_file(config_files[0])
         log("Applying the config file: {}".format(config_files[0]))
@@ -452,7 +825,6 @@ def preflight(args):
         app_json = _reformat_config_file(config_files[1])
         log("Applying the config file: {}".format(config_files[1]))
     else:
-        need_save = False
         input_dir = {
             "Trinity": _input_trinity_dir,
             "fastq-dump": _input_fastq_dump_dir,
@@ -468,10 +840,14 @@ def preflight(args):
                     app_json["chromedriver"] = os.environ["PRIVATE_WEBDRIVER"]
                     continue
             configured = False
-            try:
-                path = os.path.split(bytes2str(subprocess.check_output([find, app])).strip())[0]
-                app_json[app] = os.path.join(path, app)
-            except subprocess.CalledProcessError:
+            path_app = shutil.which(app)
+            if path_app is not None:
+                app_json[app] = path_app
+            else:
+                if not interactive:
+                    raise errors.InputError("Couldn't find {} in your $PATH. Please configure it in {}.".format(
+                        app, config_files[1]
+                    ))
                 need_save = True
                 choice = _ask_yes_or_no(
                     "Couldn't find {} in your $PATH. Configure it manually now? ([Y]/N) ".format(app)
@@ -517,4 +893,8 @@ def preflight(args):
                         )
                 else:
                     log("The config file is not saved. You may have to re-config it next time.")
+    if not need_save:
+        # Apps configured by hand are checked again next time, unless they were saved in a config file.
+        # The config files may have just been rewritten, so they are looked at again:
+        _save_preflight_cache(_preflight_fingerprint(args, config_files), app_json)
     return app_json
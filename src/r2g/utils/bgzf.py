@@ -0,0 +1,68 @@
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Every BGZF block holds at most this many bytes, so it still fits in 64 KB when the data can't be compressed:
+BLOCK_SIZE = 0xff00
+# The empty block that marks the end of a BGZF file:
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def compress_block(data, level=6):
+    """Compress up to BLOCK_SIZE bytes into one BGZF block, i.e. a gzip member with its own size in the header."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter:
+    """
+    Write a block-gzipped (BGZF) file, which can be read by any gzip reader, e.g. Trinity and `zcat`.
+    The blocks are compressed by a pool of threads (zlib releases the GIL), and written in order as soon as they
+    are done, with a few blocks in flight only.
+    """
+
+    def __init__(self, path, threads=1, level=6):
+        self.path = path
+        self.level = level
+        self.threads = max(1, int(threads))
+        self._outf = open(path, 'wb')
+        self._buffer = bytearray()
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _submit(self, data):
+        self._pending.append(self._executor.submit(compress_block, data, self.level))
+        while len(self._pending) > 2 * self.threads:
+            self._outf.write(self._pending.pop(0).result())
+
+    def write(self, data):
+        self._buffer.extend(data)
+        start = 0
+        while len(self._buffer) - start >= BLOCK_SIZE:
+            self._submit(bytes(self._buffer[start:(start + BLOCK_SIZE)]))
+            start += BLOCK_SIZE
+        del self._buffer[:start]
+
+    def close(self):
+        if self._outf.closed:
+            return
+        try:
+            if len(self._buffer) > 0:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            for future in self._pending:
+                self._outf.write(future.result())
+            self._pending = []
+            self._outf.write(EOF_BLOCK)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._outf.close()
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+
+from r2g import errors
+
+
+class Journal:
+    """
+    An append-only journal of a run, kept in the output folder as JSON lines. Every record is flushed to the disk
+    before the work goes on, so a run killed at any point can be resumed from it (--resume) without redoing
+    the finished work, e.g.:
+        {"event": "submitted", "key": ..., "rid": ..., ...}
+        {"event": "result", "key": ..., "hits": {"SRR1812889": [25821753]}, ...}
+    """
+
+    filename = "r2g.journal"
+
+    def __init__(self, outdir, resume=False):
+        self.path = os.path.join(outdir, self.filename)
+        self.records = []
+        self._lock = threading.Lock()
+        if resume:
+            self.records, size = self._load(self.path)
+            if os.path.isfile(self.path) and os.path.getsize(self.path) > size:
+                # Cut off the line left half-written by a crash, so the next record starts on a line of its own:
+                with open(self.path, 'r+b') as outf:
+                    outf.truncate(size)
+        elif os.path.isfile(self.path):
+            # A fresh run in a used folder starts a fresh journal:
+            os.rename(self.path, "{}.{}".format(self.path, int(time.time())))
+        self._outf = open(self.path, 'a')
+
+    @staticmethod
+    def _load(path):
+        """Return (records, the size in bytes of the lines read)."""
+        records = []
+        size = 0
+        if not os.path.isfile(path):
+            return records, size
+        with open(path, 'rb') as inf:
+            for line in inf:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    records.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    # The last line may be cut short by a crash:
+                    break
+                size += len(line)
+        return records, size
+
+    def write(self, event, **fields):
+        record = dict(fields)
+        record["event"] = event
+        record["time"] = time.time()
+        with self._lock:
+            self._outf.write("{}\n".format(json.dumps(record)))
+            self._outf.flush()
+            os.fsync(self._outf.fileno())
+            self.records.append(record)
+        return record
+
+    def find(self, event, **fields):
+        """Return all records of the event that match the fields."""
+        with self._lock:
+            return [
+                r for r in self.records
+                if r["event"] == event and all([r.get(k, None) == v for k, v in fields.items()])
+            ]
+
+    def last(self, event, **fields):
+        found = self.find(event, **fields)
+        if len(found) > 0:
+            return found[-1]
+        return None
+
+    def check_plan(self, **plan):
+        """Record the plan of a run, or make sure a resumed run follows the same plan as the journal."""
+        recorded = self.last("plan")
+        if recorded is None:
+            self.write("plan", **plan)
+        elif any([recorded.get(k, None) != json.loads(json.dumps(v)) for k, v in plan.items()]):
+            raise errors.InputError(
+                "The journal {} belongs to a different run, so it can't be resumed. "
+                "Please use another output folder or run it without --resume.".format(self.path)
+            )
+
+    def close(self):
+        with self._lock:
+            self._outf.close()
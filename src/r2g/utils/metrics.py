@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # It isn't there on Windows:
+    resource = None
+
+
+# Upper bounds of the buckets of timing histograms (seconds), and of histograms of counts:
+SECONDS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 4 * 3600)
+COUNTS = (10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+
+
+def peak_rss(children=False):
+    """
+    The peak resident set size of this process in bytes, or of its largest child that has exited if children,
+    e.g. Trinity and fastq-dump. None if it can't be measured.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts it in KB, and macOS in bytes:
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _labels(labels):
+    return tuple(sorted([(k, str(v)) for k, v in labels.items()]))
+
+
+def _prom_name(name, labels, extra=()):
+    labels = list(labels) + list(extra)
+    if len(labels) == 0:
+        return name
+    return "{}{{{}}}".format(name, ','.join(['{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                                             for k, v in labels]))
+
+
+def _prom_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of a run, e.g. submissions to NCBI, polls, bytes fetched and the time taken by
+    every fastq-dump. Every value is appended to a JSON-lines file as it is recorded, e.g.
+        {"time": 1600000000.0, "metric": "r2g_fastq_dump_seconds", "type": "histogram", "value": 3.2, "labels": {}}
+    and the totals can be written to a textfile for the textfile collector of Prometheus' node-exporter.
+    Everything is kept in memory anyway, so recording costs next to nothing when no files are configured.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.path = None
+        self.prom_textfile = None
+        self._outf = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, prom_textfile=None):
+        """Write every value to the JSON-lines file `path`, and the totals to `prom_textfile` by flush()."""
+        with self._lock:
+            if path != self.path:
+                if self._outf is not None:
+                    self._outf.close()
+                self._outf = open(path, 'a') if path is not None else None
+                self.path = path
+            self.prom_textfile = prom_textfile
+
+    def _write(self, kind, name, value, labels):
+        if self._outf is not None:
+            self._outf.write("{}\n".format(json.dumps({
+                "time": time.time(), "metric": name, "type": kind, "value": value, "labels": dict(labels)
+            })))
+            self._outf.flush()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self._write("counter", name, value, key[1])
+
+    def gauge(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.gauges[key] = value
+            self._write("gauge", name, value, key[1])
+
+    def observe(self, name, value, buckets=SECONDS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key, None)
+            if histogram is None:
+                histogram = {'buckets': tuple(buckets) + (float('inf'), ), 'counts': [0] * (len(buckets) + 1),
+                             'sum': 0, 'count': 0}
+                self.histograms[key] = histogram
+            # The counts of the buckets are cumulative, like Prometheus':
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            self._write("histogram", name, value, key[1])
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds taken by the block in the histogram `name`, even if it raises."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def prom_text(self):
+        """The totals in the text format of Prometheus."""
+        lines = []
+        with self._lock:
+            for kind, values in [("counter", self.counters), ("gauge", self.gauges)]:
+                for name in sorted(set([k[0] for k in values.keys()])):
+                    lines.append("# TYPE {} {}".format(name, kind))
+                    for key in sorted([k for k in values.keys() if k[0] == name]):
+                        lines.append("{} {}".format(_prom_name(name, key[1]), _prom_value(values[key])))
+            for name in sorted(set([k[0] for k in self.histograms.keys()])):
+                lines.append("# TYPE {} histogram".format(name))
+                for key in sorted([k for k in self.histograms.keys() if k[0] == name]):
+                    histogram = self.histograms[key]
+                    for bound, count in zip(histogram['buckets'], histogram['counts']):
+                        lines.append("{} {}".format(
+                            _prom_name(name + "_bucket", key[1], [("le", _prom_value(bound))]), count
+                        ))
+                    lines.append("{} {}".format(_prom_name(name + "_sum", key[1]), _prom_value(histogram['sum'])))
+                    lines.append("{} {}".format(_prom_name(name + "_count", key[1]), histogram['count']))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Record the peak memory used so far, and rewrite the Prometheus textfile if any."""
+        for children, process in [(False, "r2g"), (True, "children")]:
+            rss = peak_rss(children)
+            if rss is not None:
+                self.gauge("r2g_peak_rss_bytes", rss, process=process)
+        if self.prom_textfile is None:
+            return
+        # node-exporter may read it at any time, so it is replaced at once:
+        outdir = os.path.split(os.path.abspath(self.prom_textfile))[0]
+        fd, tmp = tempfile.mkstemp(dir=outdir, prefix=".r2g-metrics_tmp_")
+        try:
+            with os.fdopen(fd, 'w') as outf:
+                outf.write(self.prom_text())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.prom_textfile)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+# The metrics of this process:
+REGISTRY = Metrics()
+configure = REGISTRY.configure
+inc = REGISTRY.inc
+gauge = REGISTRY.gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+flush = REGISTRY.flush
@@ -0,0 +1,160 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+import r2g
+from r2g import errors
+
+
+# Layout of an index file:
+#   header   MAGIC, byte order, source (BUNDLED or TAXDUMP), the mtime in ns of the bundled JSON built from (or 0),
+#            number of taxa (n)
+#   taxids   n sorted uint32
+#   offsets  (n + 1) uint32, where the name of taxids[i] is names[offsets[i]:offsets[i + 1]]
+#   names    UTF-8 strings
+MAGIC = b"R2GTAX2"
+_HEADER = struct.Struct("<7scc7xQI")
+
+# Where an index was built from: taxid_to_species.json bundled with r2g, or names.dmp of NCBI's taxdump.
+BUNDLED = 'b'
+TAXDUMP = 't'
+BUNDLED_JSON = os.path.join(r2g.__path__[0], "taxid_to_species.json")
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+class TaxonomyIndex:
+    """
+    A compact taxid-to-species index, memory-mapped from the disk and looked up by binary search in O(log n),
+    so nothing has to be parsed before the first lookup.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        try:
+            with open(index_file, 'rb') as inf:
+                self._mmap = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, byteorder, source, self.source_mtime, n = _HEADER.unpack_from(self._mmap, 0)
+        except (ValueError, struct.error):
+            raise errors.InputError("{} is not a taxonomy index.".format(index_file))
+        if magic != MAGIC or byteorder.decode() != sys.byteorder[0]:
+            raise errors.InputError("{} is not a taxonomy index built on this platform.".format(index_file))
+        self.source = source.decode()
+        self._n = n
+        start = _HEADER.size
+        view = memoryview(self._mmap)
+        self._taxids = view[start:(start + 4 * n)].cast('I')
+        self._offsets = view[(start + 4 * n):(start + 8 * n + 4)].cast('I')
+        self._names = start + 8 * n + 4
+
+    def __len__(self):
+        return self._n
+
+    def lookup(self, taxid, default=None):
+        try:
+            taxid = int(taxid)
+        except (TypeError, ValueError):
+            return default
+        i = bisect_left(self._taxids, taxid)
+        if i == self._n or self._taxids[i] != taxid:
+            return default
+        start, end = self._names + self._offsets[i], self._names + self._offsets[i + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+
+def build(names, index_file, source=BUNDLED, source_mtime=0):
+    """Write an index of names = {taxid: species, ...} to index_file, and record where it was built from."""
+    taxids = array('I', sorted([int(t) for t in names.keys()]))
+    if taxids.itemsize != 4:
+        raise errors.InputError("Taxonomy indexes can't be built on this platform.")
+    offsets = array('I', [0])
+    blob = bytearray()
+    for taxid in taxids:
+        blob += names.get(taxid, names.get(str(taxid), "")).encode('utf-8')
+        offsets.append(len(blob))
+    tmp = "{}.{}.tmp".format(index_file, os.getpid())
+    with open(tmp, 'wb') as outf:
+        outf.write(_HEADER.pack(MAGIC, sys.byteorder[0].encode(), source.encode(), source_mtime, len(taxids)))
+        outf.write(taxids.tobytes())
+        outf.write(offsets.tobytes())
+        outf.write(bytes(blob))
+    os.replace(tmp, index_file)
+    return index_file
+
+
+def build_from_taxdump(names_dmp, index_file):
+    """Build an index of scientific names from names.dmp in NCBI's taxdump."""
+    names = {}
+    with open(names_dmp, 'r') as inf:
+        for line in inf:
+            fields = [f.strip() for f in line.split('|')]
+            if len(fields) > 3 and fields[3] == "scientific name":
+                names[int(fields[0])] = fields[1]
+    if len(names) == 0:
+        raise errors.InputError("No scientific names were found in {}.".format(names_dmp))
+    return build(names, index_file, TAXDUMP)
+
+
+def _default_index_file():
+    """The index in the cache folder of the user, e.g. ~/.cache/r2g/taxid_to_species.idx."""
+    cache_dir = os.path.join(
+        os.environ.get("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser('~'), ".cache"), "r2g"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, "taxid_to_species.idx")
+
+
+def _build_bundled(index_file):
+    with open(BUNDLED_JSON, 'r') as inf:
+        names = json.load(inf)
+    return build(names, index_file, BUNDLED, os.stat(BUNDLED_JSON).st_mtime_ns)
+
+
+def default_index():
+    """
+    Load the default index, building it from the bundled taxid_to_species.json when it is missing, unreadable, or
+    was built from another version of the JSON. An index built from a taxdump by --build-taxonomy is always kept.
+    """
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            index_file = _default_index_file()
+            try:
+                index = TaxonomyIndex(index_file)
+            except (OSError, errors.InputError):
+                index = None
+            if index is None or (index.source == BUNDLED and
+                                 index.source_mtime != os.stat(BUNDLED_JSON).st_mtime_ns):
+                index = TaxonomyIndex(_build_bundled(index_file))
+            _default_index = index
+        return _default_index
+
+
+def species(taxid):
+    return default_index().lookup(taxid, "Unknown species (taxid {})".format(taxid))
+
+
+class TaxonomyAction(argparse.Action):
+    """Rebuild the default taxonomy index from names.dmp in NCBI's taxdump, and exit."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super(TaxonomyAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default, nargs=1, metavar="NAMES_DMP", help=help
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        global _default_index
+        try:
+            index_file = _default_index_file()
+            build_from_taxdump(values[0], index_file)
+        except (OSError, errors.InputError) as err:
+            parser.exit(1, "Couldn't build the taxonomy index: {}\n".format(err))
+        _default_index = None
+        parser.exit(0, "{} taxa were indexed in {}.\n".format(len(default_index()), index_file))
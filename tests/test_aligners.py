@@ -0,0 +1,115 @@
+import unittest
+from unittest import mock
+
+import os
+import shutil
+import tempfile
+
+from r2g import utils
+from r2g import errors
+from r2g.local import aligners
+
+
+class FakeAligner:
+    """Hit every read that contains a motif, in two shards, instead of running BLAST+."""
+
+    motif = "GATTCCAGAGA"
+
+    def __init__(self, args, workdir):
+        self.shards = 2
+
+    def build(self, query_file):
+        pass
+
+    def align(self, shard, output):
+        with open(shard, 'r') as inf, open(output, 'w') as outf:
+            for name, seq in zip(inf, inf):
+                if self.motif in seq:
+                    outf.write("{}\n".format(name.strip()[1:]))
+
+
+class TestAligners(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(os.path.split(os.path.abspath(__file__))[0], "data")
+        self.outdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.args = {
+            'query': ">gene\n{}".format("ATGC" * 30),
+            'cut': "70,20",
+            'program': "blastn",
+            'evalue': 1e-3,
+            'aligner': "fake",
+            'CPU': 2,
+            'verbose': False,
+            'left': [os.path.join(self.data_dir, "sample1_1.fastq.gz")],
+            'right': [os.path.join(self.data_dir, "sample1_2.fastq.gz")],
+            'single': [],
+            'sra_files': [],
+        }
+
+    def tearDown(self):
+        utils.delete_everything(self.outdir)
+
+    def test_parse_local_args(self):
+        utils.log("Testing r2g.utils parse_arguments in the local mode.")
+        raw_args = "r2g local -o OUTPUT -q ATGC --aligner BLAST --left {} --right {} -t 4".format(
+            self.args['left'][0], self.args['right'][0]
+        ).split()
+        parsed_args = utils.parse_arguments(raw_args)
+        self.assertEqual(
+            (parsed_args['mode'], parsed_args['aligner'], parsed_args['left'], parsed_args['right'],
+             parsed_args['single'], parsed_args['cut'], parsed_args['proxy']),
+            ('local', 'blast', self.args['left'], self.args['right'], [], '70,20', None)
+        )
+        with self.assertRaises(errors.InputError):
+            _ = utils.parse_arguments("r2g local -q ATGC --left {}".format(self.args['left'][0]).split())
+        with self.assertRaises(errors.InputError):
+            _ = utils.parse_arguments("r2g local -q ATGC --aligner diamond --single {}".format(
+                self.args['left'][0]
+            ).split())
+
+    def test_recruit(self):
+        utils.log("Testing r2g.local.aligners recruit.")
+        with mock.patch.dict(aligners.ALIGNERS, {"fake": FakeAligner}):
+            name, fastq_list, paired = aligners.recruit(self.args, {}, self.outdir)
+        self.assertEqual((name, sorted(fastq_list.keys()), paired), ("gene", ['1', '2'], True))
+        # Both reads of a spot are recruited if either of them is hit:
+        expected = {'1': [], '2': []}
+        for reads in aligners._iter_spots([self.args['left'][0], self.args['right'][0]]):
+            if any([FakeAligner.motif in r[1] for r in reads]):
+                expected['1'].append(''.join(reads[0]))
+                expected['2'].append(''.join(reads[1]))
+        self.assertGreater(len(expected['1']), 0)
+        for mate in ['1', '2']:
+            with open(fastq_list[mate][0], 'r') as inf:
+                self.assertEqual(inf.read(), ''.join(expected[mate]))
+
+    def test_same_names(self):
+        utils.log("Testing r2g.local.aligners recruit from files of the same name in different folders.")
+        for folder in ["a", "b"]:
+            os.mkdir(os.path.join(self.outdir, folder))
+            shutil.copy(self.args['left'][0], os.path.join(self.outdir, folder, "reads.fastq.gz"))
+        self.args.update({'left': [], 'right': [], 'single': [
+            os.path.join(self.outdir, folder, "reads.fastq.gz") for folder in ["a", "b"]
+        ]})
+        with mock.patch.dict(aligners.ALIGNERS, {"fake": FakeAligner}):
+            _, fastq_list, paired = aligners.recruit(self.args, {}, self.outdir)
+        self.assertFalse(paired)
+        self.assertEqual(len(set(fastq_list['1'])), 2)
+        recruited = []
+        for path in fastq_list['1']:
+            with open(path, 'r') as inf:
+                recruited.append(inf.read())
+        self.assertGreater(len(recruited[0]), 0)
+        self.assertEqual(recruited[0], recruited[1])
+
+    def test_unpaired_reads(self):
+        utils.log("Raising r2g.local.aligners _iter_spots error.")
+        fastq = os.path.join(self.outdir, "short_2.fastq")
+        with open(fastq, 'w') as outf:
+            outf.write("@a/2\nATGC\n+\nAAAA\n")
+        with self.assertRaises(errors.AlignerError):
+            _ = list(aligners._iter_spots([self.args['left'][0], fastq]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import gzip
+import os
+import struct
+import tempfile
+
+from r2g import utils
+from r2g.utils import bgzf
+
+
+class TestBgzf(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+
+    def tearDown(self):
+        utils.delete_everything(self.tmpdir)
+
+    def test_bgzf_writer(self):
+        utils.log("Testing r2g.utils.bgzf BgzfWriter.")
+        path = os.path.join(self.tmpdir, "reads.fastq.gz")
+        data = b''.join([b"@r%d/1\nATGCATGCAT\n+\nAAAAAAAAAA\n" % i for i in range(20000)])
+        with bgzf.BgzfWriter(path, threads=3) as outf:
+            for i in range(0, len(data), 1000):
+                outf.write(data[i:(i + 1000)])
+        with gzip.open(path, 'rb') as inf:
+            self.assertEqual(inf.read(), data)
+        # Walk through the blocks by the sizes in their headers:
+        with open(path, 'rb') as inf:
+            raw = inf.read()
+        offset, blocks = 0, 0
+        while offset < len(raw):
+            self.assertEqual(raw[offset:(offset + 4)], b"\x1f\x8b\x08\x04")
+            offset += struct.unpack("<H", raw[(offset + 16):(offset + 18)])[0] + 1
+            blocks += 1
+        self.assertEqual(offset, len(raw))
+        self.assertEqual(blocks, -(-len(data) // bgzf.BLOCK_SIZE) + 1)
+        self.assertTrue(raw.endswith(bgzf.EOF_BLOCK))
+
+
+if __name__ == '__main__':
+    unittest.main()
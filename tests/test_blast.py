@@ -1,14 +1,21 @@
 from __future__ import print_function
 
 import unittest
+from unittest import mock
 import tempfile
+import time
 import json
 import shutil
 import os
+import threading
+from array import array
 
 from r2g import utils
 from r2g.online import blast
+from r2g.online import NCBIWWW_selenium
 from r2g import errors
+from r2g.utils.journal import Journal
+from r2g.online.cache import AccessionCache
 
 
 class TestBlast(unittest.TestCase):
@@ -56,6 +63,196 @@ class TestBlast(unittest.TestCase):
             utils.log("Error occurred while testing: {}".format(err))
         self.assertTrue(assertion)
 
+    def test_query_concurrent(self):
+        utils.log("Testing r2g.online.blast query with several RIDs in flight.")
+        with open('{}/data/standard_result.xml'.format(os.path.split(os.path.abspath(__file__))[0]), 'r') as inf:
+            xml = inf.read()
+        formatted_SRAs = {'Aedes aegypti': {'SRX885420': ['SRR1812889'], 'SRX885419': ['SRR1812887']}}
+        self.args['parallel'] = 2
+        with mock.patch.object(NCBIWWW_selenium, 'check_sra_validity', return_value=formatted_SRAs), \
+                mock.patch.object(NCBIWWW_selenium, 'qblast', return_value=xml) as qblast:
+            name, download_list = blast.query(self.args, "http://127.0.0.1:4444/wd/hub")
+        self.assertEqual(qblast.call_count, 2)
+        self.assertEqual(name, 'some_gene')
+        self.assertEqual(download_list, {'SRR1812889': [(25821753, 25821753)]})
+
+    def test_query_packed(self):
+        utils.log("Testing r2g.online.blast query with packed SRA experiments.")
+        with open('{}/data/standard_result.xml'.format(os.path.split(os.path.abspath(__file__))[0]), 'r') as inf:
+            xml = inf.read()
+        formatted_SRAs = {
+            'Aedes aegypti': {'SRX885420': ['SRR1812889'], 'SRX885419': ['SRR1812887']},
+            'Aedes albopictus': {'SRX885413': ['SRR1812881']},
+        }
+        calls = []
+        for pack in ['none', 'species', 'all']:
+            self.args['pack'] = pack
+            with mock.patch.object(NCBIWWW_selenium, 'check_sra_validity', return_value=formatted_SRAs), \
+                    mock.patch.object(NCBIWWW_selenium, 'qblast', return_value=xml) as qblast:
+                _, download_list = blast.query(self.args, "http://127.0.0.1:4444/wd/hub")
+            calls.append(sorted([sorted(c[1]['srx']) for c in qblast.call_args_list]))
+            self.assertEqual(download_list, {'SRR1812889': [(25821753, 25821753)]})
+        self.assertEqual(calls, [
+            [['SRX885413'], ['SRX885419'], ['SRX885420']],
+            [['SRX885413'], ['SRX885419', 'SRX885420']],
+            [['SRX885413', 'SRX885419', 'SRX885420']],
+        ])
+        self.assertEqual(qblast.call_args[1]['max_num_seq'], 3 * (1000 // 20 + 1))
+
+    def test_query_cached(self):
+        utils.log("Testing r2g.online.blast query with cached results.")
+        with open('{}/data/standard_result.xml'.format(os.path.split(os.path.abspath(__file__))[0]), 'r') as inf:
+            xml = inf.read()
+        formatted_SRAs = {'Aedes aegypti': {'SRX885420': ['SRR1812889']}}
+        self.args['cache'] = os.path.join(self.args['outdir'], 'cache')
+        self.args['cache_size'] = 1
+        results = []
+        for _ in range(2):
+            with mock.patch.object(NCBIWWW_selenium, 'check_sra_validity', return_value=formatted_SRAs), \
+                    mock.patch.object(NCBIWWW_selenium, 'qblast', return_value=xml) as qblast:
+                results.append(blast.query(self.args, "http://127.0.0.1:4444/wd/hub"))
+        self.assertEqual(qblast.call_count, 0)
+        self.assertEqual(results[0], results[1])
+
+    def test_query_resumed(self):
+        utils.log("Testing r2g.online.blast query resumed from a journal.")
+        with open('{}/data/standard_result.xml'.format(os.path.split(os.path.abspath(__file__))[0]), 'r') as inf:
+            xml = inf.read()
+        formatted_SRAs = {'Aedes aegypti': {'SRX885420': ['SRR1812889'], 'SRX885419': ['SRR1812887']}}
+        journal = Journal(self.args['outdir'])
+        with mock.patch.object(NCBIWWW_selenium, 'check_sra_validity', return_value=formatted_SRAs), \
+                mock.patch.object(NCBIWWW_selenium, 'qblast', return_value=xml):
+            result = blast.query(self.args, "http://127.0.0.1:4444/wd/hub", journal)
+        journal.close()
+        # Pretend the last run was killed after submitting the second query:
+        lines = open(journal.path).read().splitlines()
+        submitted = '{"event": "submitted", "key": %s, "rid": "HNXWW7S3016", "params": [], "cookies": [], ' \
+                    '"rtoe": null}' % lines[-1].split('"key": ')[1].split(',')[0]
+        with open(journal.path, 'w') as outf:
+            outf.write('\n'.join(lines[:-1] + [submitted]) + '\n')
+        journal = Journal(self.args['outdir'], resume=True)
+        with mock.patch.object(NCBIWWW_selenium, 'check_sra_validity', return_value=formatted_SRAs), \
+                mock.patch.object(NCBIWWW_selenium, 'qblast', return_value=xml) as qblast, \
+                mock.patch.object(NCBIWWW_selenium.Poller, 'add') as add:
+            add.return_value.result.return_value = xml
+            resumed = blast.query(self.args, "http://127.0.0.1:4444/wd/hub", journal)
+        journal.close()
+        self.assertEqual(qblast.call_count, 0)
+        self.assertEqual(add.call_args[0][0], "HNXWW7S3016")
+        self.assertEqual(result, resumed)
+
+    def test_check_sra_validity(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium check_sra_validity with cached accessions.")
+        page = 'NSuggest_CreateData("srx88542", new Array(' \
+               '"SRX885419 ( taxid:7160; run:SRR1812887)@srx885419 7160     srr1812887", ' \
+               '"SRX885420 ( taxid:7160; run:SRR1812889)@srx885420 7160     srr1812889"), 1);'
+        response = mock.Mock(ok=True, content=page.encode('utf-8'))
+        cache = AccessionCache(os.path.join(self.args['outdir'], "sra_accessions.json"))
+        results = []
+        for _ in range(2):
+            with mock.patch.object(NCBIWWW_selenium.requests, 'get', return_value=response) as get:
+                results.append(NCBIWWW_selenium.check_sra_validity(
+                    ["SRX885420", "SRR1812887"], cache=cache, interval=0
+                ))
+            cache = AccessionCache(os.path.join(self.args['outdir'], "sra_accessions.json"))
+        self.assertEqual(get.call_count, 0)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(list(list(results[0].values())[0].items()),
+                         [('SRX885420', ['SRR1812889']), ('SRX885419', ['SRR1812887'])])
+
+    def test_rate_limiter(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium RateLimiter.")
+        limiter = NCBIWWW_selenium.RateLimiter(interval=0.2)
+        start = time.time()
+        for _ in range(3):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+    def test_webdriver_pool(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium WebDriverPool.")
+        with mock.patch.object(NCBIWWW_selenium, '_setup_chrome_webdriver',
+                               side_effect=lambda **kwargs: mock.Mock()) as setup:
+            pool = NCBIWWW_selenium.WebDriverPool(size=1, max_uses=2)
+            with pool.session() as first:
+                pass
+            with pool.session() as second:
+                pass
+            # recycled after two uses:
+            with pool.session() as third:
+                third.execute_script.side_effect = NCBIWWW_selenium.WebDriverException("crashed")
+            # failed the health check:
+            with pool.session() as fourth:
+                pass
+            pool.close()
+        self.assertIs(first, second)
+        self.assertIsNot(second, third)
+        self.assertIsNot(third, fourth)
+        self.assertEqual(setup.call_count, 3)
+        first.quit.assert_called_once_with()
+
+    def test_webdriver_pool_warm_up(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium WebDriverPool warming up while sessions are acquired.")
+
+        def _slow_start(**kwargs):
+            time.sleep(0.2)
+            return mock.Mock()
+
+        def _use():
+            with pool.session():
+                time.sleep(0.1)
+
+        with mock.patch.object(NCBIWWW_selenium, '_setup_chrome_webdriver', side_effect=_slow_start) as setup:
+            pool = NCBIWWW_selenium.WebDriverPool(size=2)
+            threads = [threading.Thread(target=pool.warm_up) for _ in range(2)]
+            threads += [threading.Thread(target=_use) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            pool.close()
+        self.assertLessEqual(setup.call_count, 2)
+
+    def test_poller(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium Poller.")
+        data_dir = "{}/data".format(os.path.split(os.path.abspath(__file__))[0])
+        with open("{}/poll_NCBI_searching.html".format(data_dir), 'rb') as inf:
+            searching = mock.Mock(ok=True, content=inf.read())
+        with open("{}/standard_result.xml".format(data_dir), 'rb') as inf:
+            ready = mock.Mock(ok=True, content=inf.read())
+        poller = NCBIWWW_selenium.Poller(limiter=NCBIWWW_selenium.RateLimiter(interval=0),
+                                           interval=0.1, first_delay=0)
+        with mock.patch.object(NCBIWWW_selenium.requests.Session, 'get', side_effect=[searching, ready]) as get:
+            start = time.time()
+            future = poller.add("HNXWW7S3016", [("RID", "HNXWW7S3016"), ("CMD", "Get")])
+            result = future.result(timeout=10)
+            poller.close()
+        self.assertEqual(result, ready.content.decode('utf-8'))
+        self.assertEqual(get.call_count, 2)
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_poller_unreadable(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium Poller with ready but unreadable results.")
+        unreadable = mock.Mock(ok=True, content=b'<input name="RID" type="hidden" value="HNXWW7S3016">'
+                                                 b'<td>Status</td><td>READY</td>')
+        poller = NCBIWWW_selenium.Poller(limiter=NCBIWWW_selenium.RateLimiter(interval=0),
+                                           interval=0.2, first_delay=0)
+        poller.max_unreadable = 3
+        with mock.patch.object(NCBIWWW_selenium.requests.Session, 'get', return_value=unreadable) as get:
+            start = time.time()
+            future = poller.add("HNXWW7S3016", [("RID", "HNXWW7S3016"), ("CMD", "Get")])
+            with self.assertRaises(errors.QueryError):
+                _ = future.result(timeout=10)
+            poller.close()
+        # Polled again only after the interval, and not forever:
+        self.assertEqual(get.call_count, 3)
+        self.assertGreaterEqual(time.time() - start, 0.4)
+
+    def test_parse_qblast_wait_page(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium _parse_qblast_wait_page.")
+        wait_page = '<input name="RID" type="hidden" value="HNXWW7S3016"><input name="RTOE" type="hidden" value="27">'
+        rid, status, _, _, rtoe, _ = NCBIWWW_selenium._parse_qblast_wait_page(wait_page)
+        self.assertEqual((rid, status, rtoe), ("HNXWW7S3016", "unknown", "27"))
+
     def test_format_seq_1(self):
         # Test 1 (total_length = 169, num_frag = 3):
         utils.log("Testing r2g.online.blast _format_seq 1.")
@@ -104,6 +301,15 @@ class TestBlast(unittest.TestCase):
         shutil.rmtree(query_file, ignore_errors=True)
         self.assertTrue(assertion)
 
+    def test_plan_submissions(self):
+        utils.log("Testing r2g.online.blast _plan_submissions.")
+        seq_list = [">a_{}\n{}".format(i, "A" * (30 if i < 4 else 10)) for i in range(6)]
+        plan = blast._plan_submissions(seq_list, max_fragments=3, max_residues=70)
+        self.assertEqual([len(p) for p in plan], [2, 3, 1])
+        self.assertEqual(sum(plan, []), seq_list)
+        plan = blast._plan_submissions(seq_list, max_fragments=4, max_residues=1000)
+        self.assertEqual([len(p) for p in plan], [4, 2])
+
     def test_parse_xml(self):
         utils.log("Testing r2g.online.blast _parse_xml.")
         xml_dir = "{}/data".format(os.path.split(os.path.abspath(__file__))[0])
@@ -116,7 +322,7 @@ class TestBlast(unittest.TestCase):
         parsed_results = [
             {},
             {},
-            {'SRR1812889': [25821753]}
+            {'SRR1812889': array('q', [25821753])}
         ]
         for i in range(len(xml_files)):
             with open(xml_files[i], 'r') as inf:
@@ -129,6 +335,22 @@ class TestBlast(unittest.TestCase):
                     break
         self.assertTrue(assertion)
 
+    def test_parse_xml_many_hits(self):
+        utils.log("Testing r2g.online.blast _parse_xml with many hits.")
+        hits = ''.join(
+            "<Hit><Hit_accession>SRR{}.{}</Hit_accession><Hit_hsps><Hsp></Hsp></Hit_hsps></Hit>".format(
+                1812889 + i % 2, i
+            ) for i in range(20000)
+        )
+        raw_results = "<?xml version=\"1.0\"?><BlastOutput><BlastOutput_iterations><Iteration>" \
+                      "<Iteration_hits>{}</Iteration_hits></Iteration>" \
+                      "<Iteration><Iteration_hits></Iteration_hits></Iteration>" \
+                      "</BlastOutput_iterations></BlastOutput>".format(hits)
+        download_list = blast._parse_xml(raw_results, self.args)
+        self.assertEqual(sorted(download_list.keys()), ['SRR1812889', 'SRR1812890'])
+        self.assertEqual(download_list['SRR1812889'], array('q', range(0, 20000, 2)))
+        self.assertEqual(download_list['SRR1812890'], array('q', range(1, 20000, 2)))
+
     def tearDown(self):
         shutil.rmtree(self.args['outdir'], ignore_errors=True)
 
@@ -0,0 +1,155 @@
+import unittest
+from unittest import mock
+import gzip
+import tempfile
+import shutil
+import os
+import time
+import multiprocessing
+
+from r2g import utils
+from r2g.online import cache as cache_module
+from r2g.online.cache import BlastCache, AccessionCache, SpotStore
+
+
+def _add_segments(store_dir, reads, first):
+    """Add 30 segments of SRR1 to a spot store, e.g. from another process."""
+    store = SpotStore(store_dir)
+    for spot in range(first, first + 30):
+        store.add("SRR1", [(spot, spot)], reads)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+
+    def test_key(self):
+        utils.log("Testing r2g.online.cache BlastCache key.")
+        key = BlastCache.key("blastn", "SRX1,SRX2", ">a_0\nATGC\n", 0.001, 10)
+        self.assertEqual(key, BlastCache.key("blastn", ["SRX2", "SRX1"], ">a_0\nAT\nGC", "1e-3", "10"))
+        self.assertNotEqual(key, BlastCache.key("tblastn", "SRX1,SRX2", ">a_0\nATGC\n", 0.001, 10))
+        self.assertNotEqual(key, BlastCache.key("blastn", "SRX1,SRX2", ">a_0\nATGC\n", 0.001, 11))
+
+    def test_get_and_put(self):
+        utils.log("Testing r2g.online.cache BlastCache get and put.")
+        cache = BlastCache(self.cache_dir)
+        key = cache.key("blastn", "SRX1", ">a_0\nATGC", 0.001, 10)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, "<BlastOutput></BlastOutput>")
+        self.assertEqual(cache.get(key), "<BlastOutput></BlastOutput>")
+
+    def test_max_age(self):
+        utils.log("Testing r2g.online.cache BlastCache max_age.")
+        cache = BlastCache(self.cache_dir, max_age=60)
+        key = cache.key("blastn", "SRX1", ">a_0\nATGC", 0.001, 10)
+        cache.put(key, "<BlastOutput></BlastOutput>")
+        path = cache._path(key)
+        os.utime(path, (time.time(), time.time() - 120))
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(os.path.isfile(path))
+
+    def test_evict(self):
+        utils.log("Testing r2g.online.cache BlastCache LRU eviction.")
+        cache = BlastCache(self.cache_dir, max_size=250)
+        keys = [cache.key("blastn", "SRX1", ">a_{}\nATGC".format(i), 0.001, 10) for i in range(3)]
+        for i in range(2):
+            cache.put(keys[i], 100 * "A")
+            os.utime(cache._path(keys[i]), (time.time() - 100 + i, time.time()))
+        # keys[0] was used most recently, so keys[1] goes first:
+        self.assertIsNotNone(cache.get(keys[0]))
+        cache.put(keys[2], 100 * "A")
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_evict_once(self):
+        utils.log("Testing r2g.online.cache BlastCache scanning the folder only when it has to.")
+        cache = BlastCache(self.cache_dir, max_size=1000)
+        keys = [cache.key("blastn", "SRX1", ">a_{}\nATGC".format(i), 0.001, 10) for i in range(12)]
+        with mock.patch.object(os, "walk", wraps=os.walk) as walk:
+            for key in keys[:9]:
+                cache.put(key, 100 * "A")
+            self.assertEqual(walk.call_count, 1)
+            # Over max_size, so it is trimmed to 90% of it:
+            for key in keys[9:]:
+                cache.put(key, 100 * "A")
+            self.assertEqual(walk.call_count, 2)
+        self.assertEqual(cache._size, 1000)
+
+    def test_accession_cache(self):
+        utils.log("Testing r2g.online.cache AccessionCache.")
+        cache_file = os.path.join(self.cache_dir, "sra_accessions.json")
+        cache = AccessionCache(cache_file, max_age=60)
+        cache.put("srx885420", "7160", "SRX885420", ["SRR1812889"])
+        cache.save()
+        cache = AccessionCache(cache_file, max_age=60)
+        self.assertEqual(cache.get("SRX885420"), ("7160", "SRX885420", ["SRR1812889"]))
+        self.assertIsNone(cache.get("SRX885419"))
+        cache = AccessionCache(cache_file, max_age=-1)
+        self.assertIsNone(cache.get("SRX885420"))
+
+    def _reads(self, spots):
+        reads = os.path.join(self.cache_dir, "reads.fastq")
+        with open(reads, 'w') as outf:
+            for spot in spots:
+                outf.write("@r{0}/1\nATGC\n+SRR1.{0}\nAAAA\n".format(spot))
+        return {'1': reads}
+
+    def test_spot_store(self):
+        utils.log("Testing r2g.online.cache SpotStore.")
+        store = SpotStore(os.path.join(self.cache_dir, "spots"))
+        self.assertEqual(store.lookup("SRR1", [(1, 10)]), [])
+        store.add("SRR1", [(1, 2), (5, 8)], self._reads([1, 2, 5, 6, 7, 8]))
+        store.add("SRR1", [(7, 12)], self._reads(range(7, 13)))
+        segments = store.lookup("SRR1", [(2, 10), (20, 30)])
+        self.assertEqual([pieces for _, _, pieces in segments], [[(2, 2), (5, 8)], [(9, 10)]])
+        with gzip.open(segments[1][1]['1'], 'rt') as inf:
+            self.assertEqual(inf.read().count('@'), 6)
+        store.discard("SRR1", segments[0][0])
+        self.assertEqual([pieces for _, _, pieces in store.lookup("SRR1", [(1, 10)])], [[(7, 10)]])
+        self.assertEqual(SpotStore(store.store_dir).lookup("SRR2", [(1, 10)]), [])
+
+    def test_spot_store_evict(self):
+        utils.log("Testing r2g.online.cache SpotStore LRU eviction.")
+        store = SpotStore(os.path.join(self.cache_dir, "spots"))
+        for i in range(3):
+            store.add("SRR1", [(i * 10, i * 10 + 1)], self._reads([i * 10, i * 10 + 1]))
+        name, files, _ = store.lookup("SRR1", [(0, 1)])[0]
+        os.utime(files['1'], (time.time() - 100, time.time()))
+        store.max_size = sum([os.path.getsize(f) for _, fs, _ in store.lookup("SRR1", [(10, 21)]) for f in fs.values()])
+        store.evict()
+        self.assertEqual(store.lookup("SRR1", [(0, 1)]), [])
+        self.assertEqual(len(store.lookup("SRR1", [(0, 30)])), 2)
+
+    def test_spot_store_evict_once(self):
+        utils.log("Testing r2g.online.cache SpotStore scanning the folders only when it has to.")
+        store = SpotStore(os.path.join(self.cache_dir, "spots"))
+        with mock.patch.object(os, "listdir", wraps=os.listdir) as listdir:
+            for i in range(5):
+                store.add("SRR1", [(i, i)], self._reads([i]))
+            scans = [c for c in listdir.call_args_list if c == mock.call(store.store_dir)]
+            self.assertEqual(len(scans), 1)
+        segments = store.lookup("SRR1", [(0, 4)])
+        self.assertEqual(store._size, sum([os.path.getsize(files['1']) for _, files, _ in segments]))
+        store.discard("SRR1", segments[0][0])
+        self.assertEqual(store._size, sum([os.path.getsize(files['1']) for _, files, _ in segments[1:]]))
+
+    @unittest.skipIf(cache_module.fcntl is None, "Spot stores can't be shared by processes on this platform.")
+    def test_spot_store_shared(self):
+        utils.log("Testing r2g.online.cache SpotStore shared by two processes.")
+        store_dir = os.path.join(self.cache_dir, "spots")
+        reads = self._reads([1])
+        workers = [multiprocessing.Process(target=_add_segments, args=(store_dir, reads, first)) for first in [0, 30]]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([worker.exitcode for worker in workers], [0, 0])
+        self.assertEqual(len(SpotStore(store_dir).lookup("SRR1", [(0, 59)])), 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
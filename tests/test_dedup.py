@@ -0,0 +1,66 @@
+import unittest
+import gzip
+import os
+import tempfile
+
+from r2g import utils
+from r2g.local import dedup
+from r2g.utils import bgzf
+
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+
+    def tearDown(self):
+        utils.delete_everything(self.tmpdir)
+
+    def _write(self, name, reads):
+        path = os.path.join(self.tmpdir, name)
+        data = ''.join(["@r{0}/{1}\n{2}\n+{3} r{0} length={4}\n{5}\n".format(
+            spot.split('.')[-1], mate, seq, spot, len(seq), "A" * len(seq)
+        ) for spot, mate, seq in reads]).encode()
+        if name.endswith('.gz'):
+            with bgzf.BgzfWriter(path) as outf:
+                outf.write(data)
+        else:
+            with open(path, 'wb') as outf:
+                outf.write(data)
+        return path
+
+    def test_dedup_paired(self):
+        utils.log("Testing r2g.local.dedup dedup_reads with paired reads.")
+        # SRR1.2 is fetched twice, and SRR2.7 has the same reads as SRR1.1:
+        left = [("SRR1.1", 1, "ATGC"), ("SRR1.2", 1, "GGGG"), ("SRR1.2", 1, "GGGG"), ("SRR1.3", 1, "ATGC")]
+        right = [("SRR1.1", 2, "CCCC"), ("SRR1.2", 2, "TTTT"), ("SRR1.2", 2, "TTTT"), ("SRR1.3", 2, "AAAA")]
+        fastq_list = {
+            '1': [self._write("SRR1_1.fastq", left), self._write("SRR2_1.fastq.gz", [("SRR2.7", 1, "ATGC")])],
+            '2': [self._write("SRR1_2.fastq", right), self._write("SRR2_2.fastq.gz", [("SRR2.7", 2, "CCCC")])],
+        }
+        outdir = os.path.join(self.tmpdir, "out")
+        os.mkdir(outdir)
+        deduped, removed = dedup.dedup_reads(fastq_list, True, outdir)
+        self.assertEqual(removed, 2)
+        self.assertEqual(deduped['2'], [os.path.join(outdir, "SRR1_2.dedup.fastq"),
+                                        os.path.join(outdir, "SRR2_2.dedup.fastq.gz")])
+        with open(deduped['1'][0], 'r') as inf1, open(deduped['2'][0], 'r') as inf2:
+            self.assertEqual([line for line in inf1 if line[0] == '+'],
+                             ["+SRR1.1 r1 length=4\n", "+SRR1.2 r2 length=4\n", "+SRR1.3 r3 length=4\n"])
+            self.assertEqual(inf2.read().count('@'), 3)
+        with gzip.open(deduped['1'][1], 'rt') as inf:
+            self.assertEqual(inf.read(), "")
+
+    def test_dedup_broken(self):
+        utils.log("Testing r2g.local.dedup dedup_reads with unpaired files.")
+        fastq_list = {
+            '1': [self._write("SRR1_1.fastq", [("SRR1.1", 1, "ATGC"), ("SRR1.2", 1, "ATGC")])],
+            '2': [self._write("SRR1_2.fastq", [("SRR1.1", 2, "GGCC")])],
+        }
+        self.assertEqual(dedup.dedup_reads(fastq_list, True, self.tmpdir), (fastq_list, 0))
+        # Taken as single-end reads, the second spot has the same sequence, and mates of a spot are kept:
+        deduped, removed = dedup.dedup_reads(fastq_list, False, self.tmpdir)
+        self.assertEqual((sorted(deduped.keys()), removed), (['1'], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,247 @@
 import unittest
+from unittest import mock
+import gzip
+import io
+import os
+import sys
+import tempfile
+
 from r2g import utils
 from r2g.online import fetch
+from r2g.utils import metrics
+from r2g.utils.journal import Journal
 from r2g import errors
 
 
 class TestFetch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.fastq = "@a/1\nATGC\n+\nAAAA\n@a/2\nGGCC\n+\nBBBB\n"
+
+    def tearDown(self):
+        utils.delete_everything(self.tmpdir)
+
+    def _fake_fastq_dump(self, stdout, returncode=0):
+        """Write a script that prints the same reads and exits like fastq-dump."""
+        script = os.path.join(self.tmpdir, "fastq-dump")
+        with open(script, 'w') as outf:
+            outf.write("#!{}\nimport sys\nsys.stdout.write({!r})\nsys.stderr.write('Written')\nsys.exit({})\n".format(
+                sys.executable, stdout, returncode
+            ))
+        os.chmod(script, 0o755)
+        return {'fastq-dump': script}
+
+    def test_iter_fastq(self):
+        utils.log("Testing r2g.online.fetch _iter_fastq.")
+        records = list(fetch._iter_fastq(io.BytesIO(self.fastq.encode())))
+        self.assertEqual(records, [('1', b"@a/1\nATGC\n+\nAAAA\n"), ('2', b"@a/2\nGGCC\n+\nBBBB\n")])
+        with self.assertRaises(errors.FetchError):
+            _ = list(fetch._iter_fastq(io.BytesIO(b"@a/1\nATGC\n+\nAAA\n")))
+
+    def test_fastq_dump_to(self):
+        utils.log("Testing r2g.online.fetch fastq_dump_to.")
+        writer = fetch.FastqWriter(self.tmpdir, "SRR1")
+        log = fetch.fastq_dump_to("SRR1", 1, 1, self._fake_fastq_dump(self.fastq), writer)
+        self.assertEqual(log, "SRR1 1-1:\nb'Written'----")
+        # A broken range leaves nothing behind:
+        with self.assertRaises(errors.FetchError):
+            _ = fetch.fastq_dump_to("SRR1", 2, 2, self._fake_fastq_dump(self.fastq + "@b/1\nAT\n+\n"), writer)
+        with self.assertRaises(errors.FetchError):
+            _ = fetch.fastq_dump_to("SRR1", 3, 3, self._fake_fastq_dump(self.fastq, 3), writer)
+        _ = fetch.fastq_dump_to("SRR1", 4, 4, self._fake_fastq_dump(self.fastq.replace("ATGC", "TTTT")), writer)
+        writer.close()
+        with open(writer.files['1'], 'r') as inf1, open(writer.files['2'], 'r') as inf2:
+            self.assertEqual(
+                (inf1.read(), inf2.read()),
+                ("@a/1\nATGC\n+\nAAAA\n@a/1\nTTTT\n+\nAAAA\n", "@a/2\nGGCC\n+\nBBBB\n" * 2)
+            )
+
+    def test_fetch_all(self):
+        utils.log("Testing r2g.online.fetch fetch_all.")
+        script = os.path.join(self.tmpdir, "fastq-dump")
+        with open(script, 'w') as outf:
+            outf.write(
+                "#!{}\n"
+                "import os, sys\n"
+                "first, last, sra = int(sys.argv[sys.argv.index('-N') + 1]), int(sys.argv[-2]), sys.argv[-1]\n"
+                "marker = os.path.join({!r}, 'failed_once')\n"
+                "if first == 5 and not os.path.exists(marker):\n"
+                "    open(marker, 'w').close()\n"
+                "    sys.stdout.write('@{{}}.5/1\\nAT\\n')\n"
+                "    sys.exit(1)\n"
+                "for spot in range(first, last + 1):\n"
+                "    for mate in [1, 2]:\n"
+                "        sys.stdout.write('@{{}}.{{}}/{{}}\\nATGC\\n+\\nAAAA\\n'.format(sra, spot, mate))\n"
+                "".format(sys.executable, self.tmpdir)
+            )
+        os.chmod(script, 0o755)
+        download_list = {"SRR1": [(1, 2), (5, 5), (9, 12)], "SRR2": [(3, 3)]}
+        args = {'fetch_jobs': 3, 'retry': 2, 'docker': True, 'launch_cost': 0}
+        with mock.patch.object(fetch.metrics, "observe") as observe:
+            fastq_list, paired = fetch.fetch_all(download_list, {'fastq-dump': script}, self.tmpdir, args)
+        self.assertTrue(paired)
+        # The spots of each SRR, not the reads of both mates:
+        self.assertIn(mock.call("r2g_reads_per_srr", 7, buckets=metrics.COUNTS, sra="SRR1"), observe.call_args_list)
+        self.assertIn(mock.call("r2g_reads_per_srr", 1, buckets=metrics.COUNTS, sra="SRR2"), observe.call_args_list)
+        self.assertEqual(fastq_list, {
+            '1': [os.path.join(self.tmpdir, "SRR1_1.fastq"), os.path.join(self.tmpdir, "SRR2_1.fastq")],
+            '2': [os.path.join(self.tmpdir, "SRR1_2.fastq"), os.path.join(self.tmpdir, "SRR2_2.fastq")],
+        })
+        with open(fastq_list['2'][0], 'r') as inf:
+            spots = [int(line.split('.')[1].split('/')[0]) for line in inf if line[0] == '@']
+        # In order, and nothing is left behind by the failed try:
+        self.assertEqual(spots, [1, 2, 5, 9, 10, 11, 12])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "parts")))
+
+    def test_plan_ranges(self):
+        utils.log("Testing r2g.online.fetch plan_ranges.")
+        download_list = {"SRR1": [(9, 12), (1, 2), (5, 5), (5000, 5010)], "SRR2": [(3, 3)]}
+        self.assertEqual(fetch.plan_ranges(download_list, launch_cost=2, spot_cost=0.01), {
+            "SRR1": [(1, 12, [(1, 2), (5, 5), (9, 12)]), (5000, 5010, [(5000, 5010)])],
+            "SRR2": [(3, 3, [(3, 3)])],
+        })
+        self.assertEqual(len(fetch.plan_ranges(download_list, launch_cost=0)["SRR1"]), 4)
+
+    def _fake_spot_dump(self):
+        """Write a script that prints one read per spot with its spot id, and notes the spot ranges it was run with."""
+        script = os.path.join(self.tmpdir, "fastq-dump")
+        with open(script, 'w') as outf:
+            outf.write(
+                "#!{}\n"
+                "import sys\n"
+                "first, last, sra = int(sys.argv[sys.argv.index('-N') + 1]), int(sys.argv[-2]), sys.argv[-1]\n"
+                "for spot in range(first, last + 1):\n"
+                "    sys.stdout.write('@r{{0}}/1\\nATGC\\n+{{1}}.{{0}} r{{0}} length=4\\nAAAA\\n'.format(spot, sra))\n"
+                "with open({!r}, 'a') as outf:\n"
+                "    outf.write('{{}}-{{}}\\n'.format(first, last))\n"
+                "with open({!r}, 'a') as outf:\n"
+                "    outf.write(sra + '\\n')\n"
+                "".format(sys.executable, os.path.join(self.tmpdir, "launches"), os.path.join(self.tmpdir, "sources"))
+            )
+        os.chmod(script, 0o755)
+        return {'fastq-dump': script}
+
+    def test_fetch_all_merged(self):
+        utils.log("Testing r2g.online.fetch fetch_all with merged spot ranges.")
+        download_list = {"SRR1": [(1, 2), (5, 5), (9, 12), (900, 900)]}
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'launch_cost': 1, 'spot_cost': 0.01}
+        fastq_list, paired = fetch.fetch_all(download_list, self._fake_spot_dump(), self.tmpdir, args)
+        self.assertFalse(paired)
+        with open(fastq_list['1'][0], 'r') as inf:
+            spots = [int(line[2:].split('/')[0]) for line in inf if line[0] == '@']
+        # Only the wanted spots are kept from the merged range:
+        self.assertEqual(spots, [1, 2, 5, 9, 10, 11, 12, 900])
+        with open(os.path.join(self.tmpdir, "launches"), 'r') as inf:
+            self.assertEqual(sorted(inf.read().split()), ["1-12", "900-900"])
+
+    def test_fetcher(self):
+        utils.log("Testing r2g.online.fetch Fetcher with ranges added while fetching.")
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'launch_cost': 0}
+        fetcher = fetch.Fetcher(self._fake_spot_dump(), self.tmpdir, args)
+        fetcher.add({"SRR1": [(1, 3)]})
+        fetcher.add({"SRR1": [(2, 5)], "SRR2": [(7, 7)]})
+        fetcher.add({"SRR1": [(1, 1)]})
+        sra_files = fetcher.finish()
+        self.assertEqual(sorted(sra_files.keys()), ["SRR1", "SRR2"])
+        with open(sra_files["SRR1"]['1'], 'r') as inf:
+            spots = [int(line[2:].split('/')[0]) for line in inf if line[0] == '@']
+        self.assertEqual(spots, [1, 2, 3, 4, 5])
+        # Spots requested before are never fetched again:
+        with open(os.path.join(self.tmpdir, "launches"), 'r') as inf:
+            self.assertEqual(sorted(inf.read().split()), ["1-3", "4-5", "7-7"])
+        self.assertEqual(fetch.collect_fastq(sra_files), ({'1': [sra_files["SRR1"]['1'], sra_files["SRR2"]['1']]},
+                                                          False))
+
+    def test_fetcher_resume(self):
+        utils.log("Testing r2g.online.fetch Fetcher skipping SRRs fetched by the last run.")
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'launch_cost': 0}
+        app_json = self._fake_spot_dump()
+        journal = Journal(self.tmpdir)
+        fetcher = fetch.Fetcher(app_json, self.tmpdir, args, journal)
+        fetcher.add({"SRR1": [(1, 3)], "SRR2": [(7, 7)]})
+        fetched = fetcher.finish()
+        journal.close()
+        os.remove(os.path.join(self.tmpdir, "launches"))
+        journal = Journal(self.tmpdir, resume=True)
+        fetcher = fetch.Fetcher(app_json, self.tmpdir, args, journal)
+        fetcher.add({"SRR1": [(2, 3)], "SRR2": [(7, 7)]})
+        # More spots of SRR2 are wanted, so it is fetched again as a whole:
+        fetcher.add({"SRR2": [(8, 8)]})
+        sra_files = fetcher.finish()
+        journal.close()
+        self.assertEqual(sra_files, fetched)
+        with open(os.path.join(self.tmpdir, "launches"), 'r') as inf:
+            self.assertEqual(sorted(inf.read().split()), ["7-7", "8-8"])
+        with open(sra_files["SRR2"]['1'], 'r') as inf:
+            self.assertEqual(inf.read().count('@'), 2)
+
+    def test_fetch_all_resume(self):
+        utils.log("Testing r2g.online.fetch fetch_all resumed with more spots wanted.")
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'launch_cost': 0}
+        app_json = self._fake_spot_dump()
+        journal = Journal(self.tmpdir)
+        _ = fetch.fetch_all({"SRR1": [(1, 2)], "SRR2": [(5, 5)]}, app_json, self.tmpdir, args, journal)
+        journal.close()
+        os.remove(os.path.join(self.tmpdir, "launches"))
+        journal = Journal(self.tmpdir, resume=True)
+        fastq_list, _ = fetch.fetch_all({"SRR1": [(1, 3)], "SRR2": [(5, 5)]}, app_json, self.tmpdir, args, journal)
+        journal.close()
+        # SRR2 is skipped, but SRR1 needs one more spot:
+        with open(os.path.join(self.tmpdir, "launches"), 'r') as inf:
+            self.assertEqual(inf.read().split(), ["1-3"])
+        with open(fastq_list['1'][0], 'r') as inf:
+            self.assertEqual([int(line[2:].split('/')[0]) for line in inf if line[0] == '@'], [1, 2, 3])
+
+    def test_fetch_all_compressed(self):
+        utils.log("Testing r2g.online.fetch fetch_all with compressed output.")
+        download_list = {"SRR1": [(1, 2), (5, 5)]}
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'compress': True, 'CPU': 2}
+        fastq_list, _ = fetch.fetch_all(download_list, self._fake_spot_dump(), self.tmpdir, args)
+        self.assertEqual(fastq_list, {'1': [os.path.join(self.tmpdir, "SRR1_1.fastq.gz")]})
+        with gzip.open(fastq_list['1'][0], 'rt') as inf:
+            spots = [int(line[2:].split('/')[0]) for line in inf if line[0] == '@']
+        self.assertEqual(spots, [1, 2, 5])
+
+    def test_fetch_all_mirror(self):
+        utils.log("Testing r2g.online.fetch fetch_all with a local SRA mirror.")
+        app_json = self._fake_spot_dump()
+        mirror = os.path.join(self.tmpdir, "mirror")
+        os.makedirs(os.path.join(mirror, "SRR1"))
+        open(os.path.join(mirror, "SRR1", "SRR1.sra"), 'w').close()
+        # A fake prefetch which only knows SRR2:
+        with open(os.path.join(self.tmpdir, "prefetch"), 'w') as outf:
+            outf.write("#!{}\nimport os, sys\nif sys.argv[1] != 'SRR2':\n    sys.exit(3)\n"
+                       "open(os.path.join(sys.argv[-1], 'SRR2.sralite'), 'w').close()\n".format(sys.executable))
+        os.chmod(os.path.join(self.tmpdir, "prefetch"), 0o755)
+        download_list = {"SRR1": [(1, 2)], "SRR2": [(3, 3)], "SRR3": [(4, 4)]}
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'sra_mirror': mirror, 'prefetch': True}
+        fastq_list, _ = fetch.fetch_all(download_list, app_json, self.tmpdir, args)
+        self.assertEqual(len(fastq_list['1']), 3)
+        with open(os.path.join(self.tmpdir, "sources"), 'r') as inf:
+            self.assertEqual(sorted(inf.read().split()), [
+                os.path.join(mirror, "SRR1", "SRR1.sra"), os.path.join(mirror, "SRR2.sralite"), "SRR3"
+            ])
+        self.assertEqual(fetch.locate_sra("SRR3", app_json, mirror), None)
+
+    def test_fetch_all_stored(self):
+        utils.log("Testing r2g.online.fetch fetch_all with the spot store.")
+        app_json = self._fake_spot_dump()
+        args = {'fetch_jobs': 2, 'retry': 2, 'docker': True, 'launch_cost': 0,
+                'spot_store': os.path.join(self.tmpdir, "spots"), 'spot_store_size': 10}
+        for n, download_list in enumerate([{"SRR1": [(1, 4), (9, 9)]}, {"SRR1": [(3, 6), (9, 10)]}]):
+            outdir = os.path.join(self.tmpdir, str(n))
+            os.makedirs(outdir)
+            fastq_list, _ = fetch.fetch_all(download_list, app_json, outdir, args)
+            with open(fastq_list['1'][0], 'r') as inf:
+                spots = [int(line[2:].split('/')[0]) for line in inf if line[0] == '@']
+            # Spots from the store and from fastq-dump are in spot order:
+            self.assertEqual(spots, [s for f, l in download_list["SRR1"] for s in range(f, l + 1)])
+        # The second run only downloads the spots it hasn't seen:
+        with open(os.path.join(self.tmpdir, "launches"), 'r') as inf:
+            self.assertEqual(sorted(inf.read().split()), ["1-4", "10-10", "5-6", "9-9"])
+
     def test_fastq_dump(self):
-        utils.log("Testing r2g.online.fetch fastq_dump.")
+        utils.log("Testing r2g.online.fetch fastq_dump_to with fastq-dump.")
         args = {
             'query': "ATGC",
             'verbose': False,
@@ -27,22 +262,30 @@ class TestFetch(unittest.TestCase):
         }
         log = "SRR1812889 232339-232339:\nb'Read 1 spots for SRR1812889\\nWritten 1 spots for SRR1812889\\n'----"
         utils.log("Testing fastq-dump.")
-        fetched_fastq, fetched_log = fetch.fastq_dump('SRR1812889', 232339, 232339, app_json)
+        writer = fetch.FastqWriter(self.tmpdir, 'SRR1812889')
+        fetched_log = fetch.fastq_dump_to('SRR1812889', 232339, 232339, app_json, writer)
+        writer.close()
+        fetched_fastq = {}
+        for mate, path in writer.files.items():
+            with open(path, 'r') as inf:
+                fetched_fastq[mate] = inf.read()
         self.assertEqual((fastq, log), (fetched_fastq, fetched_log))
 
     def test_fastq_dump_error(self):
-        utils.log("Raising r2g.online.fetch fastq_dump error.")
+        utils.log("Raising r2g.online.fetch fastq_dump_to error.")
         args = {
             'query': "ATGC",
             'verbose': False,
             'stage': 'butterfly'
         }
         app_json = utils.preflight(args)
+        writer = fetch.FastqWriter(self.tmpdir, 'SRR1812889')
         with self.assertRaises(errors.FetchError):
-            _, _ = fetch.fastq_dump('SRR1812889', "X", "J", app_json)
+            _ = fetch.fastq_dump_to('SRR1812889', "X", "J", app_json, writer)
+        writer.close()
 
-    def test_parse_fastq_error(self):
-        utils.log("Raising r2g.online.fetch _parse_fastq error.")
+    def test_iter_fastq_error(self):
+        utils.log("Raising r2g.online.fetch _iter_fastq error.")
         check = []
         fake_fastqs = [
             "@a\nATGC\n+\nAAAA\n",
@@ -54,7 +297,7 @@ class TestFetch(unittest.TestCase):
         ]
         for seq in fake_fastqs:
             try:
-                _ = fetch._parse_fastq(seq)
+                _ = list(fetch._iter_fastq(io.BytesIO(seq.encode())))
             except errors.FetchError:
                 check.append(False)
             else:
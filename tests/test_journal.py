@@ -0,0 +1,68 @@
+import unittest
+import tempfile
+import shutil
+
+from r2g import utils
+from r2g import errors
+from r2g.utils.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+
+    def test_resume(self):
+        utils.log("Testing r2g.utils.journal Journal resume.")
+        journal = Journal(self.outdir)
+        journal.write("submitted", key="a", rid="RID1")
+        journal.write("result", key="a", hits={"SRR1812889": [25821753]})
+        journal.close()
+        # a crash while writing the last line:
+        with open(journal.path, 'a') as outf:
+            outf.write('{"event": "resu')
+        journal = Journal(self.outdir, resume=True)
+        self.assertEqual(journal.last("result", key="a")["hits"], {"SRR1812889": [25821753]})
+        self.assertIsNone(journal.last("result", key="b"))
+        self.assertEqual(len(journal.find("submitted")), 1)
+        journal.close()
+        # A fresh run starts a fresh journal:
+        journal = Journal(self.outdir)
+        self.assertIsNone(journal.last("submitted"))
+        journal.close()
+
+    def test_resume_torn(self):
+        utils.log("Testing r2g.utils.journal Journal resumed twice after a crash.")
+        journal = Journal(self.outdir)
+        journal.write("result", key="k1", hits={})
+        journal.close()
+        with open(journal.path, 'a') as outf:
+            outf.write('{"event": "res')
+        journal = Journal(self.outdir, resume=True)
+        journal.write("result", key="k2", hits={})
+        journal.close()
+        journal = Journal(self.outdir, resume=True)
+        journal.write("result", key="k3", hits={})
+        journal.close()
+        journal = Journal(self.outdir, resume=True)
+        self.assertEqual([r["key"] for r in journal.find("result")], ["k1", "k2", "k3"])
+        journal.close()
+        with open(journal.path, 'r') as inf:
+            self.assertNotIn('"res{', inf.read())
+
+    def test_check_plan(self):
+        utils.log("Testing r2g.utils.journal Journal check_plan.")
+        journal = Journal(self.outdir)
+        journal.check_plan(name="some_gene", chunks=[">a_0\nATGC"])
+        journal.close()
+        journal = Journal(self.outdir, resume=True)
+        journal.check_plan(name="some_gene", chunks=[">a_0\nATGC"])
+        with self.assertRaises(errors.InputError):
+            journal.check_plan(name="other_gene", chunks=[">a_0\nATGC"])
+        journal.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import os
+import json
+import tempfile
+
+from r2g import utils
+from r2g.utils import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.metrics = metrics.Metrics()
+
+    def tearDown(self):
+        self.metrics.configure()
+        utils.delete_everything(self.tmpdir)
+
+    def test_json_lines(self):
+        utils.log("Testing r2g.utils.metrics Metrics in the JSON lines format.")
+        path = os.path.join(self.tmpdir, "metrics.jsonl")
+        self.metrics.configure(path)
+        self.metrics.inc("r2g_ncbi_polls_total")
+        self.metrics.inc("r2g_ncbi_polls_total", 2)
+        self.metrics.observe("r2g_fastq_dump_seconds", 0.3, sra="SRR1")
+        with open(path, 'r') as inf:
+            records = [json.loads(line) for line in inf]
+        self.assertEqual([(r['metric'], r['type'], r['value'], r['labels']) for r in records], [
+            ("r2g_ncbi_polls_total", "counter", 1, {}),
+            ("r2g_ncbi_polls_total", "counter", 2, {}),
+            ("r2g_fastq_dump_seconds", "histogram", 0.3, {"sra": "SRR1"}),
+        ])
+        self.assertEqual(self.metrics.counters[("r2g_ncbi_polls_total", ())], 3)
+
+    def test_prom_textfile(self):
+        utils.log("Testing r2g.utils.metrics Metrics in the Prometheus textfile.")
+        path = os.path.join(self.tmpdir, "r2g.prom")
+        self.metrics.configure(prom_textfile=path)
+        self.metrics.inc("r2g_fetched_bytes_total", 100)
+        for seconds in [0.05, 3, 7200]:
+            self.metrics.observe("r2g_trinity_seconds", seconds, buckets=(1, 10))
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("r2g_qblast_seconds"):
+                raise ValueError("timed anyway")
+        self.metrics.flush()
+        with open(path, 'r') as inf:
+            lines = inf.read().splitlines()
+        self.assertIn("# TYPE r2g_fetched_bytes_total counter", lines)
+        self.assertIn("r2g_fetched_bytes_total 100", lines)
+        self.assertIn("# TYPE r2g_peak_rss_bytes gauge", lines)
+        self.assertEqual([line for line in lines if line.startswith("r2g_trinity_seconds")], [
+            'r2g_trinity_seconds_bucket{le="1"} 1',
+            'r2g_trinity_seconds_bucket{le="10"} 2',
+            'r2g_trinity_seconds_bucket{le="+Inf"} 3',
+            "r2g_trinity_seconds_sum 7203.05",
+            "r2g_trinity_seconds_count 3",
+        ])
+        self.assertIn('r2g_qblast_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertEqual(os.listdir(self.tmpdir), ["r2g.prom"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+from unittest import mock
+
+import os
+import json
+import sys
+import tempfile
+from array import array
+
+from r2g import utils
+from r2g import errors
+from r2g import pipeline
+
+
+def _fake_iter_query(args, webdriver, journal=None, resources=None):
+    """Hit the spots 1-3 of SRR1 for both gene_a, and nothing for gene_b, in two submissions."""
+    name = args['query'].split('\n', 1)[0][1:]
+    if name.startswith("gene_a"):
+        yield name, {"SRR1": array('q', [1, 2])}
+        yield name, {"SRR1": array('q', [2, 3])}
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.genes = os.path.join(self.tmpdir, "genes.fasta")
+        with open(self.genes, 'w') as outf:
+            outf.write(">gene_a some gene\nATGCATGC\nATGC\n>gene_b\nGGGGCCCC\n>gene_a\nATGC\n")
+        script = os.path.join(self.tmpdir, "fastq-dump")
+        with open(script, 'w') as outf:
+            outf.write(
+                "#!{}\n"
+                "import sys\n"
+                "first, last, sra = int(sys.argv[sys.argv.index('-N') + 1]), int(sys.argv[-2]), sys.argv[-1]\n"
+                "for spot in range(first, last + 1):\n"
+                "    sys.stdout.write('@r{{0}}/1\\nATGC\\n+{{1}}.{{0}} r{{0}} length=4\\nAAAA\\n'.format(spot, sra))\n"
+                "".format(sys.executable)
+            )
+        os.chmod(script, 0o755)
+        self.app_json = {'fastq-dump': script, 'chromedriver': None, 'Trinity': None}
+
+    def tearDown(self):
+        utils.delete_everything(self.tmpdir)
+
+    def test_read_genes(self):
+        utils.log("Testing r2g.pipeline _read_genes.")
+        self.assertEqual(pipeline._read_genes(self.genes), [
+            ("gene_a", ">gene_a\nATGCATGCATGC"), ("gene_b", ">gene_b\nGGGGCCCC"), ("gene_a_2", ">gene_a_2\nATGC")
+        ])
+
+    def test_parse_batch_args(self):
+        utils.log("Testing r2g.utils parse_arguments in the batch mode.")
+        args = utils.parse_arguments("r2g batch -q {} -s SRX1 -o OUT --genes 3".format(self.genes).split())
+        self.assertEqual((args['mode'], args['genes'], args['query']), ('batch', 3, self.genes))
+        with self.assertRaises(errors.InputError):
+            _ = utils.parse_arguments("r2g batch -q ATGC -s SRX1".split())
+
+    def test_run_batch(self):
+        utils.log("Testing r2g.pipeline run_batch.")
+        args = utils.parse_arguments("r2g batch -q {} -s SRX1 -o {} --stage no_trinity --launch_cost 0".format(
+            self.genes, os.path.join(self.tmpdir, "out")
+        ).split())
+        with mock.patch.object(pipeline.blast, "open_resources", return_value={}), \
+                mock.patch.object(pipeline.blast, "close_resources") as close_resources, \
+                mock.patch.object(pipeline.blast, "iter_query", _fake_iter_query):
+            rows = pipeline.run_batch(args, self.app_json)
+        close_resources.assert_called_once_with({})
+        self.assertEqual([(r['gene'], r['status'], r['srr'], r['spots'], r['reads']) for r in rows], [
+            ("gene_a", "done", 1, 3, 1), ("gene_b", "no hits", 0, 0, 0), ("gene_a_2", "done", 1, 3, 1)
+        ])
+        with open(os.path.join(args['outdir'], "summary.tsv"), 'r') as inf:
+            lines = inf.read().splitlines()
+        self.assertEqual(lines[0].split('\t'), pipeline.SUMMARY_COLUMNS)
+        self.assertEqual([line.split('\t')[0] for line in lines[1:]], ["gene_a", "gene_b", "gene_a_2"])
+        fastq = [f for f in os.listdir(os.path.join(args['outdir'], "gene_a")) if f.startswith("fastq-dump_output")]
+        with open(os.path.join(args['outdir'], "gene_a", fastq[0], "SRR1_1.fastq"), 'r') as inf:
+            self.assertEqual(inf.read().count('@'), 3)
+
+    def test_default_arguments(self):
+        utils.log("Testing r2g.utils default_arguments.")
+        args = utils.default_arguments(query="ATGC", sra="SRX1", outdir=self.tmpdir, retry=None)
+        cli = utils.parse_arguments("r2g -q ATGC -s SRX1 -o {} -r".format(self.tmpdir).split())
+        self.assertEqual(args, cli)
+        with self.assertRaises(errors.InputError):
+            _ = utils.default_arguments(query="ATGC")
+        with self.assertRaises(errors.InputError):
+            _ = utils.default_arguments(query="ATGC", sra="SRX1", not_an_option=1)
+        with self.assertRaises(errors.InputError):
+            _ = utils.default_arguments("local", query="ATGC", left="no_such_file.fq", right="no_such_file.fq")
+
+    def test_pipeline_stages(self):
+        utils.log("Testing r2g.pipeline Pipeline.")
+        outdir = os.path.join(self.tmpdir, "out")
+        with mock.patch.object(pipeline.blast, "iter_query", _fake_iter_query):
+            with pipeline.Pipeline(query=">gene_a\nATGC", sra="SRX1", outdir=outdir, stage="no_trinity",
+                                   launch_cost=0, app_json=self.app_json) as pipe:
+                self.assertEqual(pipe.blast(), ("gene_a", {"SRR1": [(1, 3)]}))
+                reads = pipe.fetch()
+                self.assertIsNone(pipe.assemble())
+            self.assertEqual(list(reads.keys()), ['1'])
+            found = pipe.results()
+            self.assertEqual((found['name'], found['hits'], found['result']), ("gene_a", {"SRR1": [(1, 3)]}, None))
+            with open(reads['1'][0], 'r') as inf:
+                self.assertEqual(inf.read().count('@'), 3)
+            found = pipeline.Pipeline(query=">gene_a\nATGC", sra="SRX1", outdir=os.path.join(self.tmpdir, "run"),
+                                      stage="no_trinity", launch_cost=0, app_json=self.app_json).run()
+            self.assertEqual(found['hits'], {"SRR1": [(1, 3)]})
+            # Only the hits given are fetched:
+            pipe = pipeline.Pipeline(query=">gene_a\nATGC", sra="SRX1", outdir=os.path.join(self.tmpdir, "hits"),
+                                     stage="no_trinity", app_json=self.app_json)
+            with open(pipe.fetch(hits={"SRR1": [2]})['1'][0], 'r') as inf:
+                self.assertEqual(inf.read().count('@'), 1)
+            pipe.close()
+        with self.assertRaises(errors.InputError):
+            _ = pipeline.Pipeline(mode="batch", query=self.genes, sra="SRX1", app_json=self.app_json)
+
+    def test_pipeline_metrics(self):
+        utils.log("Testing r2g.pipeline Pipeline with metrics.")
+        metrics_file, prom_textfile = os.path.join(self.tmpdir, "metrics.jsonl"), os.path.join(self.tmpdir, "r2g.prom")
+        try:
+            with mock.patch.object(pipeline.blast, "iter_query", _fake_iter_query):
+                pipeline.Pipeline(query=">gene_a\nATGC", sra="SRX1", outdir=os.path.join(self.tmpdir, "out"),
+                                  stage="no_trinity", metrics=metrics_file, prom_textfile=prom_textfile,
+                                  app_json=self.app_json).run()
+        finally:
+            pipeline.metrics.configure()
+        with open(metrics_file, 'r') as inf:
+            records = [json.loads(line) for line in inf]
+        self.assertEqual(sum([r['value'] for r in records if r['metric'] == "r2g_fetched_reads_total"]), 3)
+        self.assertEqual([r['value'] for r in records if r['metric'] == "r2g_reads_per_srr"], [3])
+        with open(prom_textfile, 'r') as inf:
+            self.assertIn("# TYPE r2g_fastq_dump_seconds histogram", inf.read().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
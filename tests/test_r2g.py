@@ -27,21 +27,40 @@ CGGAGGGACAAGAACAGTTTACAGGTGTATTGGAAAACAATTTCTAA"""
 args_dict = {
     'CPU': 4,
     'browser': None,
+    'cache': os.path.join(os.path.expanduser('~'), '.r2g.cache'),
+    'cache_age': 30,
+    'cache_size': 1024,
     'chrome_proxy': None,
     'cleanup': False,
+    'compress': False,
     'cut': '50,20',
+    'dedup': False,
     'docker': False,
     'evalue': 0.001,
+    'fetch_jobs': 4,
     'firefox_proxy': None,
+    'launch_cost': 2.0,
     'max_memory': '4G',
     'max_num_seq': 1000,
+    'metrics': None,
     'min_contig_length': 150,
+    'mode': 'online',
+    'ncbi_url': None,
     'outdir': 'RPS7',
+    'pack': 'none',
+    'parallel': 3,
+    'prefetch': False,
     'program': 'blastn',
+    'prom_textfile': None,
     'proxy': None,
     'query': None,
+    'resume': False,
     'retry': 5,
+    'spot_cost': 0.0002,
+    'spot_store': None,
+    'spot_store_size': 10240,
     'sra': 'SRX5138669',
+    'sra_mirror': None,
     'stage': 'butterfly',
     'trim': False,
     'verbose': False
@@ -0,0 +1,103 @@
+import unittest
+
+import os
+import tempfile
+
+from r2g import utils
+from r2g import errors
+from r2g.local import aligners
+from r2g.local import recruiter
+
+
+def _revcomp(seq):
+    return seq[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+def _brute_force(library, seq_list, k):
+    """Recruit spots sharing a k-mer with the query the slow way."""
+    kmers = set()
+    for chunk in seq_list:
+        seq = chunk.split('\n', 1)[-1]
+        for i in range(len(seq) - k + 1):
+            kmers.add(seq[i:(i + k)])
+            kmers.add(_revcomp(seq[i:(i + k)]))
+    spots = set()
+    for spot, reads in enumerate(aligners._iter_spots(library)):
+        for read in reads:
+            seq = read[1].strip()
+            if any([seq[i:(i + k)] in kmers for i in range(len(seq) - k + 1)]):
+                spots.add(spot)
+    return spots
+
+
+@unittest.skipIf(recruiter.np is None, "NumPy is not installed.")
+class TestRecruiter(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(os.path.split(os.path.abspath(__file__))[0], "data")
+        self.library = (os.path.join(self.data_dir, "sample1_1.fastq.gz"),
+                        os.path.join(self.data_dir, "sample1_2.fastq.gz"))
+        reads = [r for _, r in zip(range(3), aligners._iter_spots(self.library))]
+        # A query made of a left read, and the reverse complement of a right read:
+        self.seq_list = [
+            ">gene_0\n{}".format(reads[0][0][1].strip()[:60]),
+            ">gene_1\n{}".format(_revcomp(reads[2][1][1].strip()[10:80])),
+        ]
+        self.args = {
+            'program': "blastn",
+            'kmer_size': 21,
+            'CPU': 2,
+            'verbose': False,
+        }
+
+    def test_iter_blocks(self):
+        utils.log("Testing r2g.local.recruiter _iter_blocks.")
+        blocks = list(recruiter._iter_blocks(self.library[0], block_size=1000))
+        self.assertGreater(len(blocks), 1)
+        spots = 0
+        for block, first_spot in blocks:
+            self.assertEqual(first_spot, spots)
+            self.assertEqual(block.count(b"\n") % 4, 0)
+            spots += block.count(b"\n") // 4
+        self.assertEqual(spots, len(list(aligners._iter_spots(self.library))))
+
+    def test_recruit(self):
+        utils.log("Testing r2g.local.recruiter KmerRecruiter.")
+        expected = _brute_force(self.library, self.seq_list, self.args['kmer_size'])
+        self.assertTrue({0, 2}.issubset(expected))
+        recruiter.BLOCK_SIZE, block_size = 4096, recruiter.BLOCK_SIZE
+        try:
+            hits = recruiter.KmerRecruiter(self.args, self.seq_list).recruit([self.library])
+        finally:
+            recruiter.BLOCK_SIZE = block_size
+        self.assertEqual(hits, {0: expected})
+
+    def test_recruit_local(self):
+        utils.log("Testing r2g.local.aligners recruit with the k-mer recruiter.")
+        outdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        args = dict(self.args)
+        args.update({
+            'query': '\n'.join(self.seq_list),
+            'cut': "70,20",
+            'aligner': "kmer",
+            'left': [self.library[0]],
+            'right': [self.library[1]],
+            'single': [],
+            'sra_files': [],
+        })
+        try:
+            _, fastq_list, paired = aligners.recruit(args, {}, outdir)
+            self.assertTrue(paired)
+            with open(fastq_list['1'][0], 'r') as inf:
+                self.assertGreater(len(inf.read().splitlines()) // 4, 1)
+        finally:
+            utils.delete_everything(outdir)
+
+    def test_protein_query(self):
+        utils.log("Raising r2g.local.recruiter KmerRecruiter error.")
+        self.args['program'] = "tblastn"
+        with self.assertRaises(errors.AlignerError):
+            _ = recruiter.KmerRecruiter(self.args, self.seq_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+
+from r2g import utils
+from r2g import errors
+from r2g.online import blast
+from r2g.online import NCBIWWW_selenium
+from r2g.online.stand_in import StandInServer
+
+
+class TestStandIn(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(delay=0.5, hits=50, seed=1)
+        self.base_url = self.server.start()
+        self.limiter = NCBIWWW_selenium.RateLimiter(interval=0)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _submit(self, srx, max_num_seq=100):
+        """Fill in and submit the BLAST form like qblast does in a browser."""
+        form_url = "{}/blast/Blast.cgi?PAGE_TYPE=BlastSearch&BLAST_SPEC=SRA&DB_GROUP=Exp{}{}&MAX_NUM_SEQ={}".format(
+            self.base_url, NCBIWWW_selenium._add_eq_menus(srx), NCBIWWW_selenium._add_program("blastn"), max_num_seq
+        )
+        form = requests.get(form_url).text
+        self.assertIn('class="blastbutton"', form)
+        params = dict(parse_qsl(urlsplit(form_url).query))
+        params["QUERY"] = ">gene_0\nATGCATGCATGC"
+        wait_page = requests.post("{}/blast/Blast.cgi".format(self.base_url), data=params).text
+        rid, status, job_title, entrez_query, rtoe, max_num_seq = NCBIWWW_selenium._parse_qblast_wait_page(wait_page)
+        self.assertEqual((status, entrez_query), ("searching", srx.replace(',', ' OR ')))
+        poll_params = [("RID", rid), ("JOB_TITLE", job_title), ("ENTREZ_QUERY", entrez_query),
+                       ("MAX_NUM_SEQ", max_num_seq), ("CMD", "Get"), ("FORMAT_TYPE", "XML")]
+        return rid, poll_params, (), rtoe
+
+    def test_check_sra_validity(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium check_sra_validity with the stand-in server.")
+        formatted_SRAs = NCBIWWW_selenium.check_sra_validity(["SRX885420", "SRR885421"], base_url=self.base_url)
+        species = NCBIWWW_selenium._taxid_to_species(7160)
+        self.assertEqual(formatted_SRAs, {species: {"SRX885420": ["SRR885420"], "SRX885421": ["SRR885421"]}})
+        with self.assertRaises(errors.QueryError):
+            _ = NCBIWWW_selenium.check_sra_validity("NOT_AN_SRA", base_url=self.base_url)
+
+    def test_poll_many(self):
+        utils.log("Testing r2g.online.NCBIWWW_selenium Poller with the stand-in server.")
+        poller = NCBIWWW_selenium.Poller(limiter=self.limiter, interval=0.2, first_delay=0, base_url=self.base_url)
+        try:
+            futures = [poller.add(*self._submit("SRX{},SRX{}".format(i, i + 1))) for i in range(10)]
+            for future in futures:
+                hits = blast._parse_xml(future.result(timeout=30), {'verbose': False})
+                self.assertEqual(sum([len(spots) for spots in hits.values()]), 50)
+                self.assertTrue(set(hits.keys()).issubset({"SRR{}".format(i) for i in range(11)}))
+        finally:
+            poller.close()
+        self.assertEqual(self.server.stats["submit"], 10)
+        self.assertGreaterEqual(self.server.stats["poll"], 10)
+
+    def test_max_num_seq(self):
+        utils.log("Testing the stand-in server with a small MAX_NUM_SEQ.")
+        poller = NCBIWWW_selenium.Poller(limiter=self.limiter, interval=0.2, first_delay=0, base_url=self.base_url)
+        try:
+            result = poller.add(*self._submit("SRX1", max_num_seq=7)).result(timeout=30)
+        finally:
+            poller.close()
+        self.assertEqual(len(blast._parse_xml(result, {'verbose': False})["SRR1"]), 7)
+
+    def test_injected_failures(self):
+        utils.log("Raising r2g.online.NCBIWWW_selenium Poller errors with the stand-in server.")
+        self.server.fail_rate = 1
+        poller = NCBIWWW_selenium.Poller(limiter=self.limiter, interval=0.2, first_delay=0, base_url=self.base_url)
+        try:
+            with self.assertRaises(errors.QueryError):
+                _ = poller.add(*self._submit("SRX1")).result(timeout=30)
+        finally:
+            poller.close()
+
+
+    def test_expiry(self):
+        utils.log("Testing the stand-in server dropping expired searches.")
+        self.server.delay, self.server.ttl = 0, 0.2
+        rids = [self._submit("SRX{}".format(i))[0] for i in range(3)]
+        self.assertEqual(sorted(self.server.searches.keys()), sorted(rids))
+        time.sleep(0.3)
+        rid = self._submit("SRX3")[0]
+        self.assertEqual(list(self.server.searches.keys()), [rid])
+        expired = requests.get("{}/Blast.cgi?CMD=Get&FORMAT_TYPE=XML&RID={}".format(self.base_url, rids[0])).text
+        self.assertIn("not found", expired)
+
+
+if __name__ == '__main__':
+    unittest.main()
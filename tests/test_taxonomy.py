@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+import tempfile
+import shutil
+import os
+import json
+
+from r2g import utils
+from r2g import errors
+from r2g.utils import taxonomy
+
+
+class TestTaxonomy(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.index_file = os.path.join(self.tmp_dir, "taxonomy.idx")
+
+    def test_lookup(self):
+        utils.log("Testing r2g.utils.taxonomy TaxonomyIndex lookup.")
+        names = {"7160": "Aedes albopictus", "7159": "Aedes aegypti", "45518": "[Candida] aaseri", "1": "root"}
+        taxonomy.build(names, self.index_file)
+        index = taxonomy.TaxonomyIndex(self.index_file)
+        self.assertEqual(len(index), 4)
+        for taxid, name in names.items():
+            self.assertEqual(index.lookup(taxid), name)
+        self.assertEqual(index.lookup(7160), "Aedes albopictus")
+        self.assertIsNone(index.lookup("7161"))
+        self.assertIsNone(index.lookup(None))
+        self.assertEqual(index.lookup(99999999, "Unknown"), "Unknown")
+
+    def test_build_from_taxdump(self):
+        utils.log("Testing r2g.utils.taxonomy build_from_taxdump.")
+        names_dmp = os.path.join(self.tmp_dir, "names.dmp")
+        with open(names_dmp, 'w') as outf:
+            outf.write("7159\t|\tAedes aegypti\t|\t\t|\tscientific name\t|\n"
+                       "7159\t|\tyellow fever mosquito\t|\t\t|\tgenbank common name\t|\n"
+                       "7160\t|\tAedes albopictus\t|\t\t|\tscientific name\t|\n")
+        taxonomy.build_from_taxdump(names_dmp, self.index_file)
+        index = taxonomy.TaxonomyIndex(self.index_file)
+        self.assertEqual((len(index), index.lookup(7159)), (2, "Aedes aegypti"))
+
+    def test_not_an_index(self):
+        utils.log("Raising r2g.utils.taxonomy TaxonomyIndex error.")
+        with open(self.index_file, 'w') as outf:
+            outf.write("{}")
+        with self.assertRaises(errors.InputError):
+            _ = taxonomy.TaxonomyIndex(self.index_file)
+
+    def test_species(self):
+        utils.log("Testing r2g.utils.taxonomy species.")
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp_dir}), \
+                mock.patch.object(taxonomy, "_default_index", None):
+            self.assertEqual(taxonomy.species("45518"), "[Candida] aaseri")
+            self.assertEqual(taxonomy.species("0"), "Unknown species (taxid 0)")
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "r2g", "taxid_to_species.idx")))
+
+    def test_default_index(self):
+        utils.log("Testing r2g.utils.taxonomy default_index rebuilding the index.")
+        bundled_json = os.path.join(self.tmp_dir, "taxid_to_species.json")
+        names_dmp = os.path.join(self.tmp_dir, "names.dmp")
+        with open(names_dmp, 'w') as outf:
+            outf.write("7159\t|\tAedes aegypti\t|\t\t|\tscientific name\t|\n")
+
+        def _load(names, mtime):
+            with open(bundled_json, 'w') as outf:
+                json.dump(names, outf)
+            os.utime(bundled_json, (mtime, mtime))
+            with mock.patch.object(taxonomy, "_default_index", None):
+                return taxonomy.default_index()
+
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp_dir}), \
+                mock.patch.object(taxonomy, "BUNDLED_JSON", bundled_json):
+            index = _load({"7159": "Aedes"}, 1000)
+            self.assertEqual((index.source, index.lookup(7159)), (taxonomy.BUNDLED, "Aedes"))
+            # Another version of the bundled JSON:
+            self.assertEqual(_load({"7159": "Aedes aegypti"}, 2000).lookup(7159), "Aedes aegypti")
+            # An index built from a taxdump is never replaced by the bundled JSON:
+            taxonomy.build_from_taxdump(names_dmp, taxonomy._default_index_file())
+            index = _load({"7159": "Aedes"}, 3000)
+            self.assertEqual((index.source, index.lookup(7159)), (taxonomy.TAXDUMP, "Aedes aegypti"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,21 +17,40 @@ class TestUtils(unittest.TestCase):
         self.args = {
             'CPU': 4,
             'browser': None,
+            'cache': os.path.join(os.path.expanduser('~'), '.r2g.cache'),
+            'cache_age': 30,
+            'cache_size': 1024,
             'chrome_proxy': None,
             'cleanup': False,
+            'compress': False,
             'cut': '80,50',
+            'dedup': False,
             'docker': False,
             'evalue': 0.001,
+            'fetch_jobs': 4,
             'firefox_proxy': None,
+            'launch_cost': 2.0,
             'max_memory': '4G',
             'max_num_seq': 1000,
+            'metrics': None,
             'min_contig_length': 150,
+            'mode': 'online',
+            'ncbi_url': None,
             'outdir': 'OUTPUT',
+            'pack': 'none',
+            'parallel': 3,
+            'prefetch': False,
             'program': 'blastn',
+            'prom_textfile': None,
             'proxy': None,
             'query': 'ATGC',
+            'resume': False,
             'retry': float('inf'),
+            'spot_cost': 0.0002,
+            'spot_store': None,
+            'spot_store_size': 10240,
             'sra': 'SRXNNNNNN',
+            'sra_mirror': None,
             'stage': 'butterfly',
             'trim': False,
             'verbose': False
@@ -116,5 +135,52 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(assertion1 & assertion2)
 
 
+class TestPreflightCache(unittest.TestCase):
+    """Everything preflight depends on is faked in a temporary folder, so neither $HOME nor $PATH is read."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="r2g-test_tmp_")
+        self.app_json = {"chromedriver": "http://127.0.0.1:4444/wd/hub"}
+        for app in ["fastq-dump", "Trinity"]:
+            self.app_json[app] = os.path.join(self.tmpdir, app)
+            with open(self.app_json[app], 'w') as outf:
+                outf.write("")
+        self.args = {'query': 'ATGC', 'mode': 'online', 'browser': None, 'docker': False, 'verbose': False}
+        self.patches = [
+            mock.patch.dict(os.environ, {"HOME": self.tmpdir, "PATH": self.tmpdir}),
+            mock.patch.object(utils, "PREFLIGHT_CACHE", os.path.join(self.tmpdir, "preflight.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.config_files = [
+            os.path.abspath(os.path.join(r2g.__path__[0], "path.json")),
+            os.path.abspath(os.path.join(os.path.expanduser('~'), ".r2g.path.json"))
+        ]
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        utils.delete_everything(self.tmpdir)
+
+    def test_preflight_cache(self):
+        utils.log("Testing r2g.utils preflight with the cache.")
+        fingerprint = utils._preflight_fingerprint(self.args, self.config_files)
+        self.assertIsNone(utils._load_preflight_cache(fingerprint))
+        utils._save_preflight_cache(fingerprint, self.app_json)
+        self.assertEqual(utils._load_preflight_cache(fingerprint), self.app_json)
+        self.assertEqual(os.listdir(self.tmpdir).count("preflight.json"), 1)
+        self.assertEqual([f for f in os.listdir(self.tmpdir) if f.endswith(".tmp")], [])
+        self.assertIsNone(utils._load_preflight_cache(
+            utils._preflight_fingerprint(dict(self.args, mode='local'), self.config_files)
+        ))
+        # Nothing is looked up again while the cache is valid:
+        with mock.patch.object(utils.shutil, "which") as which:
+            self.assertEqual(utils.preflight(self.args), self.app_json)
+        which.assert_not_called()
+        # The app was changed:
+        os.chmod(self.app_json["Trinity"], 0o755)
+        self.assertIsNone(utils._load_preflight_cache(fingerprint))
+
+
 if __name__ == '__main__':
     unittest.main()